@@ -12,12 +12,108 @@ class Settings(BaseSettings):
     TELEGRAM_WEBHOOK_SECRET: str = Field("", env="TELEGRAM_WEBHOOK_SECRET")
     PUBLIC_BASE_URL: str = Field("", env="PUBLIC_BASE_URL")
 
+    # shared Bot API client; TELEGRAM_HTTP2 needs the optional 'h2' package
+    TELEGRAM_API_BASE: str = Field("https://api.telegram.org", env="TELEGRAM_API_BASE")
+    TELEGRAM_HTTP2: bool = Field(False, env="TELEGRAM_HTTP2")
+    TELEGRAM_MAX_CONNECTIONS: int = Field(20, env="TELEGRAM_MAX_CONNECTIONS")
+    TELEGRAM_MAX_KEEPALIVE: int = Field(10, env="TELEGRAM_MAX_KEEPALIVE")
+    TELEGRAM_KEEPALIVE_EXPIRY: float = Field(60.0, env="TELEGRAM_KEEPALIVE_EXPIRY")
+    TELEGRAM_CONNECT_TIMEOUT: float = Field(5.0, env="TELEGRAM_CONNECT_TIMEOUT")
+    TELEGRAM_READ_TIMEOUT: float = Field(15.0, env="TELEGRAM_READ_TIMEOUT")
+
+    # "webhook" (POST /tg/webhook) or "polling" (getUpdates long polling, no public URL needed)
+    TELEGRAM_INGEST_MODE: str = Field("webhook", env="TELEGRAM_INGEST_MODE")
+    TELEGRAM_POLL_TIMEOUT: int = Field(30, env="TELEGRAM_POLL_TIMEOUT")
+    TELEGRAM_POLL_LIMIT: int = Field(100, env="TELEGRAM_POLL_LIMIT")
+
+    # free text the NL fast path scores below this goes to the LLM
+    NL_MIN_CONFIDENCE: float = Field(0.75, env="NL_MIN_CONFIDENCE")
+
     OPENAI_API_KEY: str = Field("", env="OPENAI_API_KEY")
+    OPENAI_BASE_URL: str | None = Field(None, env="OPENAI_BASE_URL")
+    OPENAI_MODEL: str = Field("gpt-4o-mini", env="OPENAI_MODEL")
+    LLM_TIMEOUT_SECONDS: float = Field(8.0, env="LLM_TIMEOUT_SECONDS")
+    LLM_CONCURRENCY: int = Field(4, env="LLM_CONCURRENCY")
+    LLM_BREAKER_FAILURES: int = Field(5, env="LLM_BREAKER_FAILURES")
+    LLM_BREAKER_RESET_SECONDS: float = Field(30.0, env="LLM_BREAKER_RESET_SECONDS")
+
+    # coalesce concurrent free-text parses into one completion (app.services.openai_parser.LLMDispatcher)
+    LLM_COALESCE_ENABLED: bool = Field(True, env="LLM_COALESCE_ENABLED")
+    LLM_COALESCE_WINDOW_MS: float = Field(25.0, env="LLM_COALESCE_WINDOW_MS")
+    LLM_COALESCE_MAX: int = Field(16, env="LLM_COALESCE_MAX")
+
+    # LLM parse cache: in-process LRU in front of the llm_cache table
+    LLM_CACHE_ENABLED: bool = Field(True, env="LLM_CACHE_ENABLED")
+    LLM_CACHE_SIZE: int = Field(4096, env="LLM_CACHE_SIZE")
+    LLM_CACHE_MAX_ROWS: int = Field(100_000, env="LLM_CACHE_MAX_ROWS")
+    LLM_CACHE_TTL_SECONDS: float = Field(30 * 24 * 3600, env="LLM_CACHE_TTL_SECONDS")
 
     DATABASE_URL: str | None = Field(None, env="DATABASE_URL")
     DB_PATH: str = Field("sawmill_mvp.db", env="DB_PATH")
 
+    # connection pool; DB_POOL_SIZE=0 falls back to connect-per-call
+    DB_POOL_SIZE: int = Field(8, env="DB_POOL_SIZE")
+    DB_POOL_MIN: int = Field(1, env="DB_POOL_MIN")
+    DB_POOL_TIMEOUT: float = Field(10.0, env="DB_POOL_TIMEOUT")
+    DB_POOL_HEALTHCHECK_SECONDS: float = Field(30.0, env="DB_POOL_HEALTHCHECK_SECONDS")
+    SQLITE_MMAP_SIZE: int = Field(64 * 1024 * 1024, env="SQLITE_MMAP_SIZE")
+    SQLITE_BUSY_TIMEOUT_MS: int = Field(5000, env="SQLITE_BUSY_TIMEOUT_MS")
+    NAME_CACHE_SIZE: int = Field(2048, env="NAME_CACHE_SIZE")
+    # Postgres bulk paths (app.dialect): rows per batched statement, COPY threshold,
+    # and server-side prepared statements for the hottest single-row queries
+    DB_BATCH_PAGE_SIZE: int = Field(100, env="DB_BATCH_PAGE_SIZE")
+    DB_COPY_MIN_ROWS: int = Field(200, env="DB_COPY_MIN_ROWS")
+    DB_PREPARED_STATEMENTS: bool = Field(True, env="DB_PREPARED_STATEMENTS")
+
+    # thread pool for blocking DB work off the event loop
+    DB_WORKERS: int = Field(8, env="DB_WORKERS")
+
+    # group commit of webhook writes (app.services.write_batcher)
+    WRITE_BATCH_ENABLED: bool = Field(True, env="WRITE_BATCH_ENABLED")
+    WRITE_BATCH_WINDOW_MS: float = Field(5.0, env="WRITE_BATCH_WINDOW_MS")
+    WRITE_BATCH_MAX: int = Field(100, env="WRITE_BATCH_MAX")
+
+    # durable inbox: the webhook appends, INBOX_WORKERS claim and process;
+    # the webhook answers 503 (Telegram retries) once INBOX_MAX_PENDING rows queue up
+    INBOX_ENABLED: bool = Field(True, env="INBOX_ENABLED")
+    INBOX_WORKERS: int = Field(4, env="INBOX_WORKERS")
+    INBOX_MAX_ATTEMPTS: int = Field(5, env="INBOX_MAX_ATTEMPTS")
+    INBOX_RETRY_BACKOFF: float = Field(2.0, env="INBOX_RETRY_BACKOFF")
+    INBOX_VISIBILITY_TIMEOUT: float = Field(300.0, env="INBOX_VISIBILITY_TIMEOUT")
+    INBOX_POLL_SECONDS: float = Field(1.0, env="INBOX_POLL_SECONDS")
+    INBOX_MAX_PENDING: int = Field(10_000, env="INBOX_MAX_PENDING")
+
+    # update dedup: in-memory recent-ID filter + TTL pruning of updates_processed
+    RECENT_UPDATES_SIZE: int = Field(10_000, env="RECENT_UPDATES_SIZE")
+    UPDATES_TTL_HOURS: float = Field(7 * 24, env="UPDATES_TTL_HOURS")
+    UPDATES_PRUNE_INTERVAL_SECONDS: float = Field(3600, env="UPDATES_PRUNE_INTERVAL_SECONDS")
+    UPDATES_PRUNE_BATCH: int = Field(500, env="UPDATES_PRUNE_BATCH")
+
+    # bulk ledger import (app.services.importer): POST /import needs
+    # "Authorization: Bearer <IMPORT_API_TOKEN>" and is disabled while it is empty
+    IMPORT_API_TOKEN: str = Field("", env="IMPORT_API_TOKEN")
+    IMPORT_CHUNK_ROWS: int = Field(500, env="IMPORT_CHUNK_ROWS")
+    IMPORT_DIR: str = Field("imports", env="IMPORT_DIR")
+
+    # streaming exports (GET /export/<name>): same bearer scheme, own token;
+    # pages are EXPORT_PAGE_ROWS keyset reads on EXPORT_WORKERS threads
+    EXPORT_API_TOKEN: str = Field("", env="EXPORT_API_TOKEN")
+    EXPORT_PAGE_ROWS: int = Field(2000, env="EXPORT_PAGE_ROWS")
+    EXPORT_WORKERS: int = Field(2, env="EXPORT_WORKERS")
+
+    # GET /metrics (Prometheus text); bearer METRICS_TOKEN when set, open otherwise.
+    # LOG_TRACE_IDS prefixes log lines with the update's trace id
+    METRICS_TOKEN: str = Field("", env="METRICS_TOKEN")
+    LOG_TRACE_IDS: bool = Field(False, env="LOG_TRACE_IDS")
+
+    # outbound send queue: RATE_LIMIT_PER_MINUTE is the per-chat limit
     RATE_LIMIT_PER_MINUTE: int = Field(60, env="RATE_LIMIT_PER_MINUTE")
+    TELEGRAM_GLOBAL_RATE: float = Field(30.0, env="TELEGRAM_GLOBAL_RATE")
+    TELEGRAM_SEND_MAX_RETRIES: int = Field(5, env="TELEGRAM_SEND_MAX_RETRIES")
+    TELEGRAM_SEND_BACKOFF: float = Field(0.5, env="TELEGRAM_SEND_BACKOFF")
+    TELEGRAM_COALESCE: bool = Field(False, env="TELEGRAM_COALESCE")
+    # longest shutdown waits for queued replies; whatever is still queued then is logged and dropped
+    TELEGRAM_SEND_DRAIN_SECONDS: float = Field(30.0, env="TELEGRAM_SEND_DRAIN_SECONDS")
     ALLOWED_ORIGINS: str = Field("*", env="ALLOWED_ORIGINS")
 
     class Config:
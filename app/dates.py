@@ -0,0 +1,132 @@
+# app/dates.py
+"""Canonical timestamps for every ``date`` column.
+
+All dates are stored as ``YYYY-MM-DD HH:MM:SS`` in the configured TIMEZONE,
+so they sort lexically and range scans can use the date indexes.
+"""
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from .config import settings
+
+log = logging.getLogger("sawmill.dates")
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+try:
+    TZ = ZoneInfo(settings.TIMEZONE)
+except Exception:
+    log.warning("Unknown TIMEZONE %r; using UTC", settings.TIMEZONE)
+    TZ = timezone.utc
+
+_DMY = re.compile(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})$")
+
+
+def now_local() -> datetime:
+    return datetime.now(TZ)
+
+
+def canonical(dt: datetime) -> str:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(TZ).replace(tzinfo=None)
+    return dt.strftime(FMT)
+
+
+def parse_date(value: Optional[str], naive_is_utc: bool = False) -> Optional[datetime]:
+    """Parse user/LLM/legacy date text into an aware datetime, or None.
+
+    Understands ISO dates and datetimes, DD/MM/YYYY (Indian order), and the
+    words today/yesterday. Naive datetimes are local unless ``naive_is_utc``
+    (legacy rows written with ``datetime.utcnow()``).
+    """
+    if value is None:
+        return None
+    s = str(value).strip()
+    if not s:
+        return None
+    low = s.lower()
+    today = now_local().replace(hour=0, minute=0, second=0, microsecond=0)
+    if low == "today":
+        return today
+    if low == "yesterday":
+        return today - timedelta(days=1)
+    m = _DMY.match(s)
+    if m:
+        d, mth, y = (int(g) for g in m.groups())
+        if y < 100:
+            y += 2000
+        try:
+            return datetime(y, mth, d, tzinfo=TZ)
+        except ValueError:
+            return None
+    try:
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        has_time = len(s) > 10
+        dt = dt.replace(tzinfo=timezone.utc if (naive_is_utc and has_time) else TZ)
+    return dt
+
+
+def normalize_date(value: Optional[str]) -> str:
+    """Canonical form of ``value``; missing or unparseable dates become now."""
+    dt = parse_date(value)
+    if dt is None:
+        if value:
+            log.warning("Unparseable date %r; using now", value)
+        dt = now_local()
+    return canonical(dt)
+
+
+class BadDate(ValueError):
+    """A report bound that parse_date cannot read (``value`` is the text as given)."""
+
+    def __init__(self, value: Optional[str]):
+        super().__init__(f"unreadable date {value!r}")
+        self.value = value
+
+
+def report_window(kind: str, start: Optional[str] = None, end: Optional[str] = None) -> Tuple[str, Optional[str], Optional[str]]:
+    """(label, start, end) for a report kind; end is exclusive, None bounds mean open.
+
+    Raises BadDate for a custom window whose start/end cannot be parsed, or
+    that has neither, rather than widening it to all time.
+    """
+    kind = (kind or "daily").lower()
+    today = now_local().date()
+    if start or end or kind == "custom":
+        s = parse_date(start) if start else None
+        e = parse_date(end) if end else None
+        for value, dt in ((start, s), (end, e)):
+            if value and dt is None:
+                raise BadDate(value)
+        if s is None and e is None:
+            raise BadDate(None)
+        lo = canonical(s) if s else None
+        # a bare end date means "through that day"
+        hi = canonical(e + timedelta(days=1)) if e and len(str(end).strip()) <= 10 else (canonical(e) if e else None)
+        return "Custom", lo, hi
+    if kind in ("weekly", "week"):
+        first = today - timedelta(days=today.weekday())
+        return "Weekly", _day(first), _day(today + timedelta(days=1))
+    if kind in ("monthly", "month"):
+        first = today.replace(day=1)
+        return "Monthly", _day(first), _day(today + timedelta(days=1))
+    if kind in ("all", "alltime", "all-time", "total"):
+        return "All-time", None, None
+    return "Daily", _day(today), _day(today + timedelta(days=1))
+
+
+def _day(d: date) -> str:
+    return d.strftime("%Y-%m-%d") + " 00:00:00"
+
+
+def describe_window(start: Optional[str], end: Optional[str]) -> str:
+    """Human span for a report window, showing the (exclusive) end as the last included day."""
+    lo = start[:10] if start else "…"
+    hi = (datetime.strptime(end, FMT) - timedelta(seconds=1)).strftime("%Y-%m-%d") if end else "…"
+    return lo if lo == hi else f"{lo} → {hi}"
@@ -1,165 +1,853 @@
+import logging
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from contextlib import contextmanager
 from typing import Iterator
 from .config import settings
+from .dates import normalize_date, parse_date, canonical
+from .parsing import size_key, describe_size
+from .dialect import POSTGRES as USE_POSTGRES, psycopg2, insert_returning, insert_count, copy_rows, execute_prepared
+from .metrics import DB_WRITE
+
+log = logging.getLogger("sawmill.db")
+
+if psycopg2 is not None:
+    from psycopg2.pool import ThreadedConnectionPool
+    from .dialect import PgConnection
+
+
+def _pg_conn():
+    return psycopg2.connect(settings.DATABASE_URL, connection_factory=PgConnection)
+
+
+def _sqlite_conn():
+    conn = sqlite3.connect(settings.DB_PATH, check_same_thread=False,
+                           timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    return conn
+
+
+class PoolTimeout(RuntimeError):
+    """No pooled connection became free within DB_POOL_TIMEOUT."""
+
+
+class _Pool:
+    """Bounded checkout around a backend-specific connection store.
+
+    Connections idle for longer than DB_POOL_HEALTHCHECK_SECONDS are pinged
+    with ``SELECT 1`` before being handed out and replaced if the ping fails.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._last_used: dict[int, float] = {}
+
+    def _acquire_slot(self):
+        if not self._slots.acquire(timeout=settings.DB_POOL_TIMEOUT):
+            raise PoolTimeout(f"no DB connection free after {settings.DB_POOL_TIMEOUT}s (size={self.size})")
+
+    def _is_stale(self, conn) -> bool:
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        return idle > settings.DB_POOL_HEALTHCHECK_SECONDS
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1")
+            c.fetchone()
+            return True
+        except Exception:
+            return False
+
+    def _touch(self, conn):
+        self._last_used[id(conn)] = time.monotonic()
 
-USE_POSTGRES = bool(settings.DATABASE_URL)
+    def _forget(self, conn):
+        self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-if USE_POSTGRES:
-    import psycopg2
 
-    def _pg_conn():
-        return psycopg2.connect(settings.DATABASE_URL)
-else:
-    def _sqlite_conn():
+class _SQLitePool(_Pool):
+    """One long-lived connection per thread; the semaphore caps concurrent use."""
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: set = set()
+
+    def getconn(self):
+        self._acquire_slot()
+        try:
+            conn = getattr(self._local, "conn", None)
+            if conn is not None and self._is_stale(conn) and not self._ping(conn):
+                log.warning("Dropping unhealthy SQLite connection")
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = _sqlite_conn()
+                self._local.conn = conn
+                with self._lock:
+                    self._conns.add(conn)
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken: bool = False):
+        if broken:
+            self._discard(conn)
+        else:
+            self._touch(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        if getattr(self._local, "conn", None) is conn:
+            self._local.conn = None
+        with self._lock:
+            self._conns.discard(conn)
+        self._forget(conn)
+
+    def closeall(self):
+        with self._lock:
+            conns, self._conns = list(self._conns), set()
+        for conn in conns:
+            self._forget(conn)
+        self._local = threading.local()
+
+
+class _PgPool(_Pool):
+    """psycopg2 ThreadedConnectionPool that blocks instead of raising when exhausted."""
+
+    def __init__(self, minconn: int, size: int):
+        super().__init__(size)
+        self._pool = ThreadedConnectionPool(min(minconn, size), size, settings.DATABASE_URL,
+                                            connection_factory=PgConnection)
+
+    def getconn(self):
+        self._acquire_slot()
+        try:
+            conn = self._pool.getconn()
+            if conn.closed or (self._is_stale(conn) and not self._ping(conn)):
+                log.warning("Dropping unhealthy Postgres connection")
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken: bool = False):
+        try:
+            if broken or conn.closed:
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+            else:
+                self._touch(conn)
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._last_used.clear()
+        self._pool.closeall()
+
+
+class _DirectPool:
+    """DB_POOL_SIZE=0: open and close a connection for every checkout."""
+
+    size = 0
+
+    def getconn(self):
+        if USE_POSTGRES:
+            return _pg_conn()
         return sqlite3.connect(settings.DB_PATH, check_same_thread=False)
 
+    def putconn(self, conn, broken: bool = False):
+        conn.close()
+
+    def closeall(self):
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if settings.DB_POOL_SIZE <= 0:
+                    _pool = _DirectPool()
+                elif USE_POSTGRES:
+                    _pool = _PgPool(settings.DB_POOL_MIN, settings.DB_POOL_SIZE)
+                else:
+                    _pool = _SQLitePool(settings.DB_POOL_SIZE)
+    return _pool
+
+
+def close_pool():
+    """Close every pooled connection; the next db_conn() builds a fresh pool."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.closeall()
+
+
+_tx = threading.local()
+
 
 @contextmanager
 def db_conn() -> Iterator:
-    if USE_POSTGRES:
-        conn = _pg_conn()
-    else:
-        conn = _sqlite_conn()
+    """Check out a pooled connection as one unit of work.
+
+    Nested ``db_conn()`` blocks on the same thread join the outer transaction,
+    so helpers such as ``upsert_supplier`` can be composed into a single
+    commit. Only the outermost block commits (or rolls back).
+    """
+    conn = getattr(_tx, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+
+    pool = _get_pool()
+    conn = pool.getconn()
+    _tx.conn, _tx.on_commit = conn, []
+    broken = False
     try:
         yield conn
-    finally:
         conn.commit()
-        conn.close()
+        callbacks = _tx.on_commit
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+        raise
+    finally:
+        _tx.conn, _tx.on_commit = None, []
+        pool.putconn(conn, broken)
+    for fn in callbacks:
+        fn()
+
+
+def _after_commit(fn):
+    """Run ``fn`` once the current transaction commits; dropped on rollback."""
+    if getattr(_tx, "conn", None) is None:
+        fn()
+    else:
+        _tx.on_commit.append(fn)
+
+
+class _IdCache:
+    """Bounded, thread-safe LRU of name -> row id."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, name: str) -> int | None:
+        with self._lock:
+            rid = self._data.get(name)
+            if rid is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(name)
+            self.hits += 1
+            return rid
+
+    def put(self, name: str, rid: int):
+        if self.maxsize <= 0 or rid is None:
+            return
+        with self._lock:
+            self._data[name] = rid
+            self._data.move_to_end(name)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+supplier_ids = _IdCache(settings.NAME_CACHE_SIZE)
+customer_ids = _IdCache(settings.NAME_CACHE_SIZE)
+
+
+class _Inventory:
+    """In-memory mirror of the ``inventory`` and ``batch_ledger`` tables.
+
+    Filled once by ``load_inventory`` and then kept current by the deltas
+    each write commits (``_move_stock``), so stock and yield questions are
+    dict lookups. Per-size counts are also rolled up by cross-section
+    (thickness x width) for "how many 2x4" questions that give no length.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        # size_key -> [(t, w, l), produced, reserved, shipped]
+        self._sizes: dict[str, list] = {}
+        # section key ("TxW") -> [produced, reserved, shipped] over every length
+        self._sections: dict[str, list] = {}
+        # batch_id -> [logs_in, volume_in, planks, volume_out]; _all sums every batch
+        self._batches: dict[int, list] = {}
+        self._all = [0, 0.0, 0, 0.0]
+
+    def load(self, sizes: dict, batches: dict):
+        with self._lock:
+            self._sizes, self._sections, self._batches = {}, {}, {}
+            self._all = [0, 0.0, 0, 0.0]
+            self._add(sizes, batches)
+            self.loaded = True
+
+    def apply(self, sizes: dict, batches: dict):
+        # before the first load the tables are the only truth; load() picks these up
+        if self.loaded:
+            with self._lock:
+                self._add(sizes, batches)
+
+    def _add(self, sizes: dict, batches: dict):
+        for key, (dims, *counts) in sizes.items():
+            entry = self._sizes.setdefault(key, [dims, 0, 0, 0])
+            section = self._sections.setdefault(size_key(dims[0], dims[1]), [0, 0, 0])
+            for i, n in enumerate(counts):
+                entry[i + 1] += n
+                section[i] += n
+        for batch_id, deltas in batches.items():
+            entry = self._batches.setdefault(batch_id, [0, 0.0, 0, 0.0])
+            for i, n in enumerate(deltas):
+                entry[i] += n
+                self._all[i] += n
+
+    @staticmethod
+    def _stock_row(label: str, produced: int, reserved: int, shipped: int) -> dict:
+        on_hand = produced - shipped
+        return {"size": label, "produced": produced, "reserved": reserved, "shipped": shipped,
+                "on_hand": on_hand, "free": on_hand - reserved}
+
+    def stock(self, t: float, w: float, l: float | None = None) -> dict | None:
+        """Counts for one size, or for its whole cross-section when ``l`` is None."""
+        key = size_key(t, w, l)
+        with self._lock:
+            entry = self._sizes.get(key) if l else self._sections.get(key)
+            counts = list(entry[1:] if l else entry) if entry else None
+        return self._stock_row(describe_size(t, w, l), *counts) if counts else None
+
+    def all_stock(self) -> list[dict]:
+        with self._lock:
+            rows = [(dims, p, r, s) for dims, p, r, s in self._sizes.values()]
+        out = [self._stock_row(describe_size(*dims), p, r, s) for dims, p, r, s in rows]
+        return sorted(out, key=lambda row: -row["on_hand"])
+
+    @staticmethod
+    def _yield_row(logs_in: int, volume_in: float, planks: int, volume_out: float) -> dict:
+        return {"logs_in": logs_in, "volume_in": volume_in, "planks": planks, "volume_out": round(volume_out, 2),
+                "remaining": round(volume_in - volume_out, 2),
+                "yield_pct": round(100 * volume_out / volume_in, 1) if volume_in else None}
+
+    def batch(self, batch_id: int | None = None) -> dict | None:
+        """Yield for one batch, or across all batches when ``batch_id`` is None."""
+        with self._lock:
+            entry = self._all if batch_id is None else self._batches.get(batch_id)
+            values = list(entry) if entry else None
+        return self._yield_row(*values) if values else None
+
+
+inventory = _Inventory()
 
 
 def init_db():
+    """Bring the schema up to date; see app.migrations for the versioned steps."""
+    from .migrations import migrate
+    migrate()
+
+
+# (table, column) for every foreign key; each gets an idx_<table>_<column>
+FK_COLUMNS = (("stock_in", "supplier_id"), ("stock_out", "batch_id"), ("orders", "customer_id"),
+              ("order_items", "order_id"), ("deliveries", "order_id"), ("payments", "order_id"))
+
+DATED_TABLES = {"stock_in": "batch_id", "stock_out": "id", "orders": "order_id",
+                "deliveries": "delivery_id", "payments": "payment_id"}
+
+
+def _backfill_dates(c, chunk: int = 500):
+    """One-time rewrite of legacy free-form dates into canonical local time.
+
+    Rows written before normalization held user text, ``datetime.utcnow()``
+    strings (naive UTC) or NULL. NULLs carry no information and stay NULL;
+    unparseable text is left as-is and logged.
+    """
+    for table, pk in DATED_TABLES.items():
+        c.execute(f"SELECT {pk}, date FROM {table} WHERE date IS NOT NULL")
+        rows = c.fetchall()
+        updates, bad = [], 0
+        for rid, raw in rows:
+            dt = parse_date(raw, naive_is_utc=True)
+            if dt is None:
+                bad += 1
+                continue
+            value = canonical(dt)
+            if value != raw:
+                updates.append((value, rid))
+        for i in range(0, len(updates), chunk):
+            c.executemany(f"UPDATE {table} SET date=? WHERE {pk}=?", updates[i:i + chunk])
+        if rows:
+            log.info("Normalized %s/%s %s dates (%s unparseable)", len(updates), len(rows), table, bad)
+
+
+def warm_name_caches():
+    """Preload the most recently added suppliers/customers into the id caches."""
     with db_conn() as conn:
         c = conn.cursor()
-        # core tables
-        c.execute("""CREATE TABLE IF NOT EXISTS suppliers(
-            supplier_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE, phone TEXT, address TEXT
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS customers(
-            customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE, phone TEXT, address TEXT
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS stock_in(
-            batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            supplier_id INTEGER, qty_logs INTEGER, volume_cft REAL, date TEXT,
-            FOREIGN KEY(supplier_id) REFERENCES suppliers(supplier_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS stock_out(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            batch_id INTEGER, thickness_mm REAL, width_mm REAL, length_mm REAL,
-            qty INTEGER, date TEXT,
-            FOREIGN KEY(batch_id) REFERENCES stock_in(batch_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS orders(
-            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_id INTEGER, status TEXT, date TEXT,
-            FOREIGN KEY(customer_id) REFERENCES customers(customer_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS order_items(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER, thickness_mm REAL, width_mm REAL, length_mm REAL,
-            size_label TEXT, qty INTEGER,
-            FOREIGN KEY(order_id) REFERENCES orders(order_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS deliveries(
-            delivery_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER, lorry_number TEXT, status TEXT, date TEXT,
-            FOREIGN KEY(order_id) REFERENCES orders(order_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS payments(
-            payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER, amount REAL, method TEXT, date TEXT,
-            FOREIGN KEY(order_id) REFERENCES orders(order_id)
-        )""")
-        # idempotency table to record processed Telegram update_id's
-        c.execute("""CREATE TABLE IF NOT EXISTS updates_processed(
-            update_id INTEGER PRIMARY KEY,
-            ts TEXT DEFAULT (datetime('now'))
-        )""")
-        conn.commit()
+        c.execute("SELECT name, supplier_id FROM suppliers ORDER BY supplier_id DESC LIMIT ?",
+                  (supplier_ids.maxsize,))
+        for name, sid in reversed(c.fetchall()):
+            supplier_ids.put(name, sid)
+        c.execute("SELECT name, customer_id FROM customers ORDER BY customer_id DESC LIMIT ?",
+                  (customer_ids.maxsize,))
+        for name, cid in reversed(c.fetchall()):
+            customer_ids.put(name, cid)
 
 
-def upsert_supplier(name: str) -> int:
+def _upsert_named(cache: _IdCache, table: str, id_col: str, name: str) -> int:
+    rid = cache.get(name)
+    if rid is not None:
+        return rid
     with db_conn() as conn:
         c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO suppliers(name) VALUES(?)", (name,))
-        c.execute("SELECT supplier_id FROM suppliers WHERE name=?", (name,))
-        row = c.fetchone()
-        sid = row[0] if row else None
-        return sid
+        if USE_POSTGRES:
+            # new names come back from the INSERT itself; only existing ones need the SELECT
+            c.execute(f"INSERT INTO {table}(name) VALUES(?) ON CONFLICT (name) DO NOTHING RETURNING {id_col}", (name,))
+            row = c.fetchone()
+        else:
+            c.execute(f"INSERT OR IGNORE INTO {table}(name) VALUES(?)", (name,))
+            row = None
+        if row is None:
+            c.execute(f"SELECT {id_col} FROM {table} WHERE name=?", (name,))
+            row = c.fetchone()
+        rid = row[0] if row else None
+    # a rolled-back insert must not leave a dangling id in the cache
+    _after_commit(lambda: cache.put(name, rid))
+    return rid
+
+
+def upsert_supplier(name: str) -> int:
+    return _upsert_named(supplier_ids, "suppliers", "supplier_id", name)
 
 
 def upsert_customer(name: str) -> int:
-    with db_conn() as conn:
-        c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO customers(name) VALUES(?)", (name,))
-        c.execute("SELECT customer_id FROM customers WHERE name=?", (name,))
+    return _upsert_named(customer_ids, "customers", "customer_id", name)
+
+
+def _insert_many(c, table: str, cols: tuple, rows: list) -> list[int]:
+    """INSERT ``rows`` and return their generated ids in order (see dialect.insert_returning)."""
+    return insert_returning(c, table, cols, rows)
+
+
+_CFT_MM3 = 304.8 ** 3
+
+
+def _plank_cft(t, w, l) -> float:
+    """Board volume of one plank in cubic feet; 0 when the length is unknown."""
+    return (t or 0) * (w or 0) * (l or 0) / _CFT_MM3
+
+
+def _size_delta(sizes: dict, t, w, l, produced: int = 0, reserved: int = 0, shipped: int = 0):
+    if not (t and w):
+        return
+    entry = sizes.setdefault(size_key(t, w, l), [(t, w, l), 0, 0, 0])
+    entry[1] += produced
+    entry[2] += reserved
+    entry[3] += shipped
+
+
+def _batch_delta(batches: dict, batch_id, logs_in: int = 0, volume_in: float = 0.0, planks: int = 0,
+                 volume_out: float = 0.0):
+    if not batch_id:
+        return
+    entry = batches.setdefault(batch_id, [0, 0.0, 0, 0.0])
+    entry[0] += logs_in
+    entry[1] += volume_in
+    entry[2] += planks
+    entry[3] += volume_out
+
+
+def _move_stock(c, sizes: dict | None = None, batches: dict | None = None):
+    """Add inventory/batch-ledger deltas inside the caller's transaction.
+
+    ``sizes`` maps size_key -> [(t, w, l), produced, reserved, shipped] and
+    ``batches`` maps batch_id -> [logs_in, volume_in, planks, volume_out].
+    The in-memory mirror picks the deltas up only once the write commits.
+    """
+    sizes, batches = sizes or {}, batches or {}
+    if sizes:
+        c.executemany("INSERT OR IGNORE INTO inventory(size_key,thickness_mm,width_mm,length_mm) VALUES(?,?,?,?)",
+                      [(key, *dims) for key, (dims, *_n) in sizes.items()])
+        c.executemany("UPDATE inventory SET produced=produced+?, reserved=reserved+?, shipped=shipped+? WHERE size_key=?",
+                      [(p, r, s, key) for key, (_dims, p, r, s) in sizes.items()])
+    if batches:
+        c.executemany("INSERT OR IGNORE INTO batch_ledger(batch_id) VALUES(?)", [(b,) for b in batches])
+        c.executemany("""UPDATE batch_ledger SET logs_in=logs_in+?, volume_in=volume_in+?, planks=planks+?,
+                         volume_out=volume_out+? WHERE batch_id=?""",
+                      [(*deltas, b) for b, deltas in batches.items()])
+    if sizes or batches:
+        _after_commit(lambda: inventory.apply(sizes, batches))
+
+
+def _write_stockin(c, ps: list) -> list[int]:
+    rows = []
+    for p in ps:
+        sid = upsert_supplier(p.get("supplier_name", "Unknown"))
+        rows.append((sid, p.get("qty_logs") or p.get("qty") or 0, p.get("volume_cft"), normalize_date(p.get("date_str"))))
+    ids = _insert_many(c, "stock_in", ("supplier_id", "qty_logs", "volume_cft", "date"), rows)
+    _bump(c, logs_in=sum(r[1] for r in rows), volume_in=sum(r[2] or 0 for r in rows))
+    batches = {}
+    for batch_id, (sid, qty, vol, date_str) in zip(ids, rows):
+        _batch_delta(batches, batch_id, logs_in=qty, volume_in=vol or 0)
+        log.info("Inserted stock_in batch_id=%s supplier_id=%s qty=%s vol=%s date=%s", batch_id, sid, qty, vol, date_str)
+    _move_stock(c, batches=batches)
+    return ids
+
+
+def _write_production(c, ps: list) -> list[int]:
+    # 0 means "no batch given"; NULL keeps the foreign key valid on Postgres
+    rows = [(p.get("batch_id") or None, p.get("thickness_mm"), p.get("width_mm"), p.get("length_mm"),
+             p.get("qty"), normalize_date(p.get("date_str"))) for p in ps]
+    ids = _insert_many(c, "stock_out", ("batch_id", "thickness_mm", "width_mm", "length_mm", "qty", "date"), rows)
+    _bump(c, planks_cut=sum(r[4] or 0 for r in rows))
+    sizes, batches = {}, {}
+    for batch_id, t, w, l, qty, _date in rows:
+        _size_delta(sizes, t, w, l, produced=qty or 0)
+        _batch_delta(batches, batch_id, planks=qty or 0, volume_out=(qty or 0) * _plank_cft(t, w, l))
+    _move_stock(c, sizes, batches)
+    return ids
+
+
+def _write_order(c, ps: list) -> list[int]:
+    rows = [(upsert_customer(p.get("customer_name", "Unknown")), "pending", normalize_date(p.get("date_str")))
+            for p in ps]
+    ids = _insert_many(c, "orders", ("customer_id", "status", "date"), rows)
+    copy_rows(c, "order_items", ("order_id", "thickness_mm", "width_mm", "length_mm", "size_label", "qty"),
+              [(oid, p.get("thickness_mm"), p.get("width_mm"), p.get("length_mm"), p.get("size_label"), p.get("qty"))
+               for oid, p in zip(ids, ps)])
+    copy_rows(c, "order_state", ("order_id", "customer_id", "qty_ordered", "amount"),
+              [(oid, row[0], p.get("qty") or 0, p.get("amount")) for oid, row, p in zip(ids, rows, ps)])
+    _bump(c, orders_pending=len(ids))
+    sizes = {}
+    for p in ps:
+        _size_delta(sizes, p.get("thickness_mm"), p.get("width_mm"), p.get("length_mm"), reserved=p.get("qty") or 0)
+    _move_stock(c, sizes)
+    return ids
+
+
+def _write_delivery(c, ps: list) -> list[int]:
+    # order_id -> [qty_ordered, qty_delivered before, after, deliveries]
+    state: dict[int, list | None] = {}
+    rows = []
+    for p in ps:
+        order_id = p.get("order_id") or None
+        if order_id and order_id not in state:
+            c.execute("SELECT qty_ordered, qty_delivered FROM order_state WHERE order_id=?", (order_id,))
+            row = c.fetchone()
+            state[order_id] = [row[0], row[1], row[1], 0] if row else None
+        st = state.get(order_id)
+        if st is not None:
+            # no qty means the rest of the order; more than is left only ships what is left
+            left = max(st[0] - st[2], 0)
+            st[2] += left if p.get("qty") is None else min(p["qty"], left)
+            st[3] += 1
+        rows.append((order_id, p.get("lorry_number"), p.get("qty"), "dispatched", normalize_date(p.get("date_str"))))
+    ids = _insert_many(c, "deliveries", ("order_id", "lorry_number", "qty", "status", "date"), rows)
+    state = {oid: st for oid, st in state.items() if st is not None}
+    sizes = {}
+    for order_id, (_ordered, before, after, _n) in state.items():
+        _ship_items(c, order_id, before, after, sizes)
+    _move_stock(c, sizes)
+    c.executemany("UPDATE order_state SET deliveries=deliveries+?, qty_delivered=? WHERE order_id=?",
+                  [(n, after, oid) for oid, (_ordered, _before, after, n) in state.items()])
+    _settle_orders(c, state)
+    return ids
+
+
+def _ship_items(c, order_id: int, before: int, after: int, sizes: dict):
+    """Move the order's units ``before``..``after`` (counted across its items in order) from reserved to shipped."""
+    if after <= before:
+        return
+    c.execute("SELECT thickness_mm, width_mm, length_mm, qty FROM order_items WHERE order_id=? ORDER BY id",
+              (order_id,))
+    _allocate_shipped(c.fetchall(), before, after, sizes)
+
+
+def _allocate_shipped(items: list, before: int, after: int, sizes: dict):
+    start = 0
+    for t, w, l, qty in items:
+        qty = qty or 0
+        n = min(after, start + qty) - max(before, start)
+        if n > 0:
+            _size_delta(sizes, t, w, l, reserved=-n, shipped=n)
+        start += qty
+
+
+def _write_payment(c, ps: list) -> list[int]:
+    rows = [(p.get("order_id") or None, p.get("amount"), p.get("method"), normalize_date(p.get("date_str")))
+            for p in ps]
+    ids = _insert_many(c, "payments", ("order_id", "amount", "method", "date"), rows)
+    _bump(c, payments_received=sum(r[1] or 0 for r in rows))
+    paid: dict[int, float] = {}
+    for order_id, amount, *_rest in rows:
+        if order_id:
+            paid[order_id] = paid.get(order_id, 0) + (amount or 0)
+    c.executemany("UPDATE order_state SET amount_paid=amount_paid+? WHERE order_id=?",
+                  [(amt, oid) for oid, amt in paid.items()])
+    _settle_orders(c, paid)
+    return ids
+
+
+def _order_status(deliveries: int, amount: float | None, paid: float, undelivered: int = 0) -> str:
+    """'pending' until delivered in full, then 'closed' once a priced order is paid in full, else 'delivered'."""
+    if not deliveries or undelivered > 0:
+        return "pending"
+    if amount is not None and (paid or 0) >= amount - 1e-6:
+        return "closed"
+    return "delivered"
+
+
+def _settle_orders(c, order_ids):
+    """Re-derive status for ``order_ids`` and mirror it onto ``orders.status`` and orders_pending."""
+    changed, left_pending = [], 0
+    for oid in order_ids:
+        c.execute("SELECT deliveries, amount, amount_paid, qty_ordered - qty_delivered, status FROM order_state "
+                  "WHERE order_id=?", (oid,))
         row = c.fetchone()
-        cid = row[0] if row else None
-        return cid
+        if not row:
+            continue
+        status = _order_status(*row[:4])
+        if status != row[4]:
+            changed.append((status, oid))
+            left_pending += row[4] == "pending"
+    if changed:
+        c.executemany("UPDATE order_state SET status=? WHERE order_id=?", changed)
+        c.executemany("UPDATE orders SET status=? WHERE order_id=?", changed)
+    _bump(c, orders_pending=-left_pending)
 
 
-import logging
-from datetime import datetime
-log = logging.getLogger("sawmill.db")
+# payload type -> writer(cursor, [payload, ...]) -> [generated id, ...]
+WRITERS = {
+    "STOCK_IN": _write_stockin,
+    "PRODUCTION": _write_production,
+    "ORDER": _write_order,
+    "DELIVERY": _write_delivery,
+    "PAYMENT": _write_payment,
+}
 
-def insert_stockin(p: dict) -> int:
-    sid = upsert_supplier(p.get("supplier_name", "Unknown"))
-    date_str = p.get("date_str") or datetime.utcnow().isoformat(sep=" ", timespec="seconds")
-    qty = p.get("qty_logs") or p.get("qty") or 0
-    vol = p.get("volume_cft")
+
+def _write_one(kind: str, p: dict, inbox_id: int | None = None) -> int:
     with db_conn() as conn:
         c = conn.cursor()
-        c.execute(
-            "INSERT INTO stock_in(supplier_id,qty_logs,volume_cft,date) VALUES(?,?,?,?)",
-            (sid, qty, vol, date_str),
-        )
-        batch_id = c.lastrowid
-        log.info("Inserted stock_in batch_id=%s supplier_id=%s qty=%s vol=%s date=%s", batch_id, sid, qty, vol, date_str)
-        return batch_id
+        with DB_WRITE.time(kind):
+            rid = WRITERS[kind](c, [p])[0]
+        if inbox_id is not None:
+            c.execute("DELETE FROM inbox WHERE id=?", (inbox_id,))
+        return rid
+
+
+def insert_stockin(p: dict) -> int:
+    return _write_one("STOCK_IN", p)
 
 
 def insert_production(p: dict) -> int:
+    return _write_one("PRODUCTION", p)
+
+
+def insert_order(p: dict) -> int:
+    return _write_one("ORDER", p)
+
+
+def insert_delivery(p: dict) -> int:
+    return _write_one("DELIVERY", p)
+
+
+def insert_payment(p: dict) -> int:
+    return _write_one("PAYMENT", p)
+
+
+def _write_grouped(c, ops: list) -> list[int]:
+    """Run the WRITERS for ``[(type, payload, ...), ...]``, one call per type; ids in op order."""
+    by_kind: dict[str, list[int]] = {}
+    for i, op in enumerate(ops):
+        by_kind.setdefault(op[0], []).append(i)
+    results: list = [None] * len(ops)
+    for kind, idxs in by_kind.items():
+        with DB_WRITE.time(kind):
+            ids = WRITERS[kind](c, [ops[i][1] for i in idxs])
+        for i, rid in zip(idxs, ids):
+            results[i] = rid
+    return results
+
+
+def apply_batch(ops: list, inbox_id: int | None = None) -> list[int]:
+    """Apply ``[(type, payload), ...]`` all or nothing: one transaction, one executemany per type.
+
+    For the entries of one multi-line message. Unlike apply_writes there is
+    no one-by-one retry: if any entry fails, nothing is written and the
+    update (and ``inbox_id``) stays unprocessed, so a redelivery cannot
+    duplicate the entries that did go in.
+    """
     with db_conn() as conn:
         c = conn.cursor()
-        c.execute("""INSERT INTO stock_out(batch_id,thickness_mm,width_mm,length_mm,qty,date)
-                     VALUES(?,?,?,?,?,?)""",
-                  (p.get("batch_id"), p.get("thickness_mm"), p.get("width_mm"),
-                   p.get("length_mm"), p.get("qty"), p.get("date_str")))
-        return c.lastrowid
+        ids = _write_grouped(c, ops)
+        if inbox_id is not None:
+            c.execute("DELETE FROM inbox WHERE id=?", (inbox_id,))
+        return ids
 
 
-def insert_order(p: dict) -> int:
-    cid = upsert_customer(p.get("customer_name", "Unknown"))
+def apply_writes(ops: list) -> list:
+    """Apply ``[(type, payload[, inbox_id]), ...]`` in one transaction, one executemany per type.
+
+    Returns the generated id for each op, in order. An op's inbox row, if
+    given, is deleted in the same transaction, so a crash can never leave a
+    committed write whose update still looks unprocessed. If the combined
+    transaction fails, each op is retried on its own so one bad record
+    cannot sink the others; its slot then holds the exception instead.
+    """
+    ops = [(op[0], op[1], op[2] if len(op) > 2 else None) for op in ops]
+    results: list = [None] * len(ops)
+    try:
+        with db_conn() as conn:
+            c = conn.cursor()
+            results = _write_grouped(c, ops)
+            done = [(inbox_id,) for _k, _p, inbox_id in ops if inbox_id is not None]
+            if done:
+                c.executemany("DELETE FROM inbox WHERE id=?", done)
+        return results
+    except Exception as e:
+        if len(ops) == 1:
+            return [e]
+        log.warning("Batch of %s writes failed (%s); applying one by one", len(ops), e)
+    for i, (kind, p, inbox_id) in enumerate(ops):
+        try:
+            results[i] = _write_one(kind, p, inbox_id)
+        except Exception as e:
+            results[i] = e
+    return results
+
+
+def meta_get(key: str) -> str | None:
     with db_conn() as conn:
         c = conn.cursor()
-        c.execute("""INSERT INTO orders(customer_id,status,date)
-                     VALUES(?,?,?)""", (cid, "pending", p.get("date_str")))
-        order_id = c.lastrowid
-        c.execute("""INSERT INTO order_items(order_id,thickness_mm,width_mm,length_mm,size_label,qty)
-                     VALUES(?,?,?,?,?,?)""",
-                  (order_id, p.get("thickness_mm"), p.get("width_mm"),
-                   p.get("length_mm"), p.get("size_label"), p.get("qty")))
-        return order_id
+        c.execute("SELECT value FROM meta WHERE key=?", (key,))
+        row = c.fetchone()
+    return row[0] if row else None
 
 
-def insert_delivery(p: dict) -> int:
+def meta_set(key: str, value: str):
+    with db_conn() as conn:
+        conn.cursor().execute("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", (key, value))
+
+
+# durable inbox: the webhook appends, app.services.inbox workers claim and process
+def inbox_append(update_id: int | None, payload: str) -> bool:
+    """Store a raw update; False if this update_id is already queued."""
     with db_conn() as conn:
         c = conn.cursor()
-        c.execute("""INSERT INTO deliveries(order_id,lorry_number,status,date)
-                     VALUES(?,?,?,?)""",
-                  (p.get("order_id"), p.get("lorry_number"), "dispatched", p.get("date_str")))
-        return c.lastrowid
+        execute_prepared(c, "inbox_append", """INSERT OR IGNORE INTO inbox(update_id,payload,status,attempts,
+                         received_at,available_at) VALUES(?,?,'pending',0,?,?)""",
+                         (update_id, payload, time.time(), time.time()))
+        return c.rowcount == 1
 
 
-def insert_payment(p: dict) -> int:
+def inbox_append_many(rows: list) -> int:
+    """Store ``[(update_id, payload), ...]`` in one transaction; returns how many were new."""
+    now = time.time()
+    with db_conn() as conn:
+        return insert_count(conn.cursor(), "inbox", ("update_id", "payload", "status", "attempts", "received_at",
+                                                     "available_at"),
+                            [(u, p, "pending", 0, now, now) for u, p in rows], ignore_conflicts=True)
+
+
+def inbox_claim(worker: str):
+    """Claim the oldest available pending row: (id, payload, attempts) or None.
+
+    The conditional UPDATE is the SQLite stand-in for SELECT ... FOR UPDATE
+    SKIP LOCKED: if another worker won the race, rowcount is 0 and we move on
+    to the next candidate.
+    """
+    now = time.time()
     with db_conn() as conn:
         c = conn.cursor()
-        c.execute("""INSERT INTO payments(order_id,amount,method,date)
-                     VALUES(?,?,?,?)""",
-                  (p.get("order_id"), p.get("amount"), p.get("method"), p.get("date_str")))
-        return c.lastrowid
+        c.execute("""SELECT id, payload, attempts FROM inbox
+                     WHERE status='pending' AND available_at <= ? ORDER BY id LIMIT 5""", (now,))
+        for rid, payload, attempts in c.fetchall():
+            c.execute("""UPDATE inbox SET status='processing', claimed_at=?, worker=?
+                         WHERE id=? AND status='pending'""", (now, worker, rid))
+            if c.rowcount == 1:
+                return rid, payload, attempts
+    return None
+
+
+def inbox_done(inbox_id: int):
+    with db_conn() as conn:
+        execute_prepared(conn.cursor(), "inbox_done", "DELETE FROM inbox WHERE id=?", (inbox_id,))
+
+
+def inbox_retry(inbox_id: int, attempts: int, delay: float, error: str):
+    with db_conn() as conn:
+        conn.cursor().execute("""UPDATE inbox SET status='pending', attempts=?, available_at=?, last_error=?,
+                                 worker=NULL WHERE id=?""", (attempts, time.time() + delay, error[:500], inbox_id))
+
+
+def inbox_dead(inbox_id: int, attempts: int, error: str):
+    with db_conn() as conn:
+        conn.cursor().execute("UPDATE inbox SET status='dead', attempts=?, last_error=? WHERE id=?",
+                              (attempts, error[:500], inbox_id))
+
+
+def inbox_recover(older_than: float) -> list[int]:
+    """Return rows stuck in 'processing' since before ``older_than`` to the queue.
+
+    Their dedup claims are released too: the inbox row still existing means
+    the business write never committed (it deletes the row in the same
+    transaction), so the update must run again. Returns the update_ids.
+    """
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, update_id FROM inbox WHERE status='processing' AND claimed_at < ?", (older_than,))
+        rows = c.fetchall()
+        if rows:
+            c.executemany("DELETE FROM updates_processed WHERE update_id=?", [(u,) for _i, u in rows if u is not None])
+            c.executemany("UPDATE inbox SET status='pending', worker=NULL WHERE id=?", [(i,) for i, _u in rows])
+    return [u for _i, u in rows]
+
+
+def inbox_status() -> dict:
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT status, COUNT(1), MIN(received_at) FROM inbox GROUP BY status")
+        rows = c.fetchall()
+    out = {"pending": 0, "processing": 0, "dead": 0, "oldest_pending_at": None}
+    for status, n, oldest in rows:
+        out[status] = n
+        if status == "pending":
+            out["oldest_pending_at"] = oldest
+    return out
 
 
 # idempotency helpers
@@ -174,3 +862,402 @@ def mark_update_processed(update_id: int):
     with db_conn() as conn:
         c = conn.cursor()
         c.execute("INSERT OR IGNORE INTO updates_processed(update_id) VALUES(?)", (update_id,))
+
+
+def claim_update(update_id: int) -> bool:
+    """Atomically claim an update; False if it was already claimed (one statement, no race)."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        execute_prepared(c, "claim_update", "INSERT OR IGNORE INTO updates_processed(update_id) VALUES(?)",
+                         (update_id,))
+        return c.rowcount == 1
+
+
+def release_update(update_id: int):
+    """Give up a claim so a redelivery of the update can be processed again."""
+    with db_conn() as conn:
+        execute_prepared(conn.cursor(), "release_update", "DELETE FROM updates_processed WHERE update_id=?",
+                         (update_id,))
+
+
+def prune_updates_processed(older_than: str, batch: int) -> int:
+    """Delete up to ``batch`` claims with ts < ``older_than`` (UTC 'YYYY-MM-DD HH:MM:SS')."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("""DELETE FROM updates_processed WHERE update_id IN
+                     (SELECT update_id FROM updates_processed WHERE ts < ? LIMIT ?)""", (older_than, batch))
+        return c.rowcount
+
+
+# running totals
+TOTALS = ("logs_in", "volume_in", "planks_cut", "orders_pending", "payments_received")
+
+_TOTALS_SQL = {
+    # use COALESCE for SQLite compatibility
+    "logs_in": "SELECT COALESCE(SUM(qty_logs),0) FROM stock_in",
+    "volume_in": "SELECT COALESCE(SUM(volume_cft),0) FROM stock_in",
+    "planks_cut": "SELECT COALESCE(SUM(qty),0) FROM stock_out",
+    "orders_pending": "SELECT COUNT(1) FROM orders WHERE status='pending'",
+    "payments_received": "SELECT COALESCE(SUM(amount),0) FROM payments",
+}
+
+
+def _bump(c, **deltas):
+    """Add to running totals inside the caller's transaction."""
+    for name, delta in deltas.items():
+        if delta:
+            c.execute("UPDATE totals SET value=value+? WHERE name=?", (delta, name))
+
+
+def _compute_totals(c, names=TOTALS) -> dict:
+    out = {}
+    for name in names:
+        c.execute(_TOTALS_SQL[name])
+        out[name] = c.fetchone()[0]
+    return out
+
+
+def _write_totals(c, values: dict):
+    for name, value in values.items():
+        c.execute("INSERT OR REPLACE INTO totals(name,value) VALUES(?,?)", (name, value or 0))
+
+
+def rebuild_totals() -> dict:
+    """Recompute every running total from history (full scans; run off-peak)."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        values = _compute_totals(c)
+        _write_totals(c, values)
+    log.info("Rebuilt totals: %s", values)
+    return values
+
+
+def verify_totals() -> dict:
+    """Compare running totals with a full recomputation; returns {name: (stored, actual)} for mismatches."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        actual = _compute_totals(c)
+        c.execute("SELECT name, value FROM totals")
+        stored = dict(c.fetchall())
+    return {name: (stored.get(name), actual[name]) for name in TOTALS
+            if abs((stored.get(name) or 0) - (actual[name] or 0)) > 1e-6}
+
+
+# order settlement
+def _delivered_qty(c, ordered: dict) -> dict:
+    """``{order_id: units delivered}`` from the deliveries table, for orders with ``ordered`` units.
+
+    Deliveries add up to the ordered quantity at most; one without a qty
+    (every delivery before quantities were recorded) delivers the rest.
+    """
+    c.execute("""SELECT order_id, SUM(qty), SUM(CASE WHEN qty IS NULL THEN 1 ELSE 0 END)
+                 FROM deliveries WHERE order_id IS NOT NULL GROUP BY order_id""")
+    out = {}
+    for oid, total, rest in c.fetchall():
+        if oid in ordered:
+            out[oid] = ordered[oid] if rest else min(total or 0, ordered[oid])
+    return out
+
+
+def _rebuild_order_state(c):
+    """Recompute order_state counters and status, and orders.status, from history (full scans).
+
+    ``amount`` exists only here, so rows are updated in place rather than recreated.
+    """
+    c.execute("INSERT OR IGNORE INTO order_state(order_id,customer_id) SELECT order_id, customer_id FROM orders")
+    c.execute("""UPDATE order_state SET
+                     qty_ordered=COALESCE((SELECT SUM(qty) FROM order_items i WHERE i.order_id=order_state.order_id),0),
+                     deliveries=(SELECT COUNT(1) FROM deliveries d WHERE d.order_id=order_state.order_id),
+                     amount_paid=COALESCE((SELECT SUM(amount) FROM payments p WHERE p.order_id=order_state.order_id),0)""")
+    c.execute("SELECT order_id, qty_ordered FROM order_state")
+    delivered = _delivered_qty(c, dict(c.fetchall()))
+    c.execute("UPDATE order_state SET qty_delivered=0")
+    c.executemany("UPDATE order_state SET qty_delivered=? WHERE order_id=?", [(q, oid) for oid, q in delivered.items()])
+    c.execute("SELECT order_id, deliveries, amount, amount_paid, qty_ordered - qty_delivered FROM order_state")
+    statuses = [(_order_status(n, amount, paid, left), oid) for oid, n, amount, paid, left in c.fetchall()]
+    c.executemany("UPDATE order_state SET status=? WHERE order_id=?", statuses)
+    c.executemany("UPDATE orders SET status=? WHERE order_id=?", statuses)
+
+
+def rebuild_order_state() -> dict:
+    """Recompute order_state, orders.status and orders_pending from history (run off-peak)."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        _rebuild_order_state(c)
+        _write_totals(c, _compute_totals(c, ["orders_pending"]))
+        c.execute("SELECT status, COUNT(1) FROM order_state GROUP BY status")
+        return dict(c.fetchall())
+
+
+def _order_row(row) -> dict:
+    order_id, customer, qty, delivered, amount, paid, status = row
+    return {"order_id": order_id, "customer": customer, "qty_ordered": qty, "qty_delivered": delivered,
+            "amount": amount, "amount_paid": paid, "due": round(amount - paid, 2) if amount is not None else None,
+            "status": status}
+
+
+_ORDER_COLS = """s.order_id, c.name, s.qty_ordered, s.qty_delivered, s.amount, s.amount_paid, s.status
+                 FROM order_state s LEFT JOIN customers c ON c.customer_id = s.customer_id"""
+
+
+def order_summary(order_id: int) -> dict | None:
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT {_ORDER_COLS} WHERE s.order_id=?", (order_id,))
+        row = c.fetchone()
+    return _order_row(row) if row else None
+
+
+def open_orders(limit: int = 25) -> list[dict]:
+    """Orders not yet delivered in full, oldest first (status index range)."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT {_ORDER_COLS} WHERE s.status='pending' ORDER BY s.order_id LIMIT ?", (limit,))
+        return [_order_row(r) for r in c.fetchall()]
+
+
+def customer_dues(customer_name: str | None = None) -> list[dict]:
+    """Unpaid balance per customer over orders that are not closed.
+
+    Reads only open order_state rows through the status/customer indexes;
+    orders without an agreed amount count as open but add nothing to the due.
+    """
+    sql = """SELECT c.name, COUNT(1), COALESCE(SUM(s.amount - s.amount_paid), 0), COALESCE(SUM(s.amount_paid), 0)
+             FROM order_state s JOIN customers c ON c.customer_id = s.customer_id
+             WHERE s.status IN ('pending','delivered')"""
+    args = []
+    if customer_name:
+        cid = customer_ids.get(customer_name)
+        if cid is None:
+            with db_conn() as conn:
+                c = conn.cursor()
+                c.execute("SELECT customer_id FROM customers WHERE name=?", (customer_name,))
+                row = c.fetchone()
+            if not row:
+                return []
+            cid = row[0]
+        sql += " AND s.customer_id=?"
+        args.append(cid)
+    sql += " GROUP BY s.customer_id, c.name ORDER BY 3 DESC"
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute(sql, args)
+        rows = c.fetchall()
+    return [{"customer": name, "open_orders": n, "due": round(due, 2), "paid": round(paid, 2)}
+            for name, n, due, paid in rows]
+
+
+# live inventory
+def _compute_inventory(c) -> tuple[dict, dict]:
+    """Inventory and batch-ledger contents recomputed from history (full scans)."""
+    sizes, batches = {}, {}
+    c.execute("SELECT thickness_mm, width_mm, length_mm, SUM(qty) FROM stock_out GROUP BY thickness_mm, width_mm, length_mm")
+    for t, w, l, qty in c.fetchall():
+        _size_delta(sizes, t, w, l, produced=qty or 0)
+    c.execute("SELECT order_id, thickness_mm, width_mm, length_mm, qty FROM order_items ORDER BY order_id, id")
+    items: dict[int, list] = {}
+    for order_id, t, w, l, qty in c.fetchall():
+        items.setdefault(order_id, []).append((t, w, l, qty))
+        _size_delta(sizes, t, w, l, reserved=qty or 0)
+    delivered = _delivered_qty(c, {oid: sum(i[3] or 0 for i in its) for oid, its in items.items()})
+    for order_id, qty in delivered.items():
+        _allocate_shipped(items[order_id], 0, qty, sizes)
+    c.execute("SELECT batch_id, qty_logs, volume_cft FROM stock_in")
+    for batch_id, logs, vol in c.fetchall():
+        _batch_delta(batches, batch_id, logs_in=logs or 0, volume_in=vol or 0)
+    c.execute("SELECT batch_id, thickness_mm, width_mm, length_mm, qty FROM stock_out")
+    for batch_id, t, w, l, qty in c.fetchall():
+        _batch_delta(batches, batch_id, planks=qty or 0, volume_out=(qty or 0) * _plank_cft(t, w, l))
+    return sizes, batches
+
+
+def _write_inventory(c, sizes: dict, batches: dict):
+    c.execute("DELETE FROM inventory")
+    c.execute("DELETE FROM batch_ledger")
+    copy_rows(c, "inventory", ("size_key", "thickness_mm", "width_mm", "length_mm", "produced", "reserved", "shipped"),
+              [(key, *dims, p, r, s) for key, (dims, p, r, s) in sizes.items()])
+    copy_rows(c, "batch_ledger", ("batch_id", "logs_in", "volume_in", "planks", "volume_out"),
+              [(b, *v) for b, v in batches.items()])
+
+
+def _read_inventory(c) -> tuple[dict, dict]:
+    c.execute("SELECT size_key, thickness_mm, width_mm, length_mm, produced, reserved, shipped FROM inventory")
+    sizes = {key: [(t, w, l), p, r, s] for key, t, w, l, p, r, s in c.fetchall()}
+    c.execute("SELECT batch_id, logs_in, volume_in, planks, volume_out FROM batch_ledger")
+    batches = {b: [logs, vin, planks, vout] for b, logs, vin, planks, vout in c.fetchall()}
+    return sizes, batches
+
+
+def load_inventory():
+    """Fill the in-memory inventory from its tables (startup, or first read)."""
+    with db_conn() as conn:
+        sizes, batches = _read_inventory(conn.cursor())
+    inventory.load(sizes, batches)
+    log.info("Loaded inventory: %s sizes, %s batches", len(sizes), len(batches))
+
+
+def rebuild_inventory() -> dict:
+    """Recompute the inventory and batch ledger from history (full scans; run off-peak)."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        sizes, batches = _compute_inventory(c)
+        _write_inventory(c, sizes, batches)
+    inventory.load(sizes, batches)
+    return {"sizes": len(sizes), "batches": len(batches)}
+
+
+def verify_inventory() -> dict:
+    """Compare stored inventory with a recomputation; returns {key: (stored, actual)} for mismatches."""
+    with db_conn() as conn:
+        c = conn.cursor()
+        actual_sizes, actual_batches = _compute_inventory(c)
+        stored_sizes, stored_batches = _read_inventory(c)
+    bad = {}
+    for key in set(actual_sizes) | set(stored_sizes):
+        stored = tuple(stored_sizes.get(key, [None, 0, 0, 0])[1:])
+        actual = tuple(actual_sizes.get(key, [None, 0, 0, 0])[1:])
+        if stored != actual:
+            bad[f"size {key}"] = (stored, actual)
+    for b in set(actual_batches) | set(stored_batches):
+        stored = stored_batches.get(b, [0, 0.0, 0, 0.0])
+        actual = actual_batches.get(b, [0, 0.0, 0, 0.0])
+        if any(abs((x or 0) - (y or 0)) > 1e-6 for x, y in zip(stored, actual)):
+            bad[f"batch {b}"] = (tuple(stored), tuple(actual))
+    return bad
+
+
+def inventory_stock(t: float | None = None, w: float | None = None, l: float | None = None):
+    """One size (or cross-section when ``l`` is None) as a dict, or every size when ``t`` is None."""
+    if not inventory.loaded:
+        load_inventory()
+    return inventory.all_stock() if t is None else inventory.stock(t, w, l)
+
+
+def batch_yield(batch_id: int | None = None) -> dict | None:
+    if not inventory.loaded:
+        load_inventory()
+    return inventory.batch(batch_id)
+
+
+def report_window(start: str | None, end: str | None) -> dict:
+    """Activity between canonical timestamps ``start`` (inclusive) and ``end`` (exclusive).
+
+    Each query is a range scan on the table's date index.
+    """
+    where, args = [], []
+    if start:
+        where.append("date >= ?")
+        args.append(start)
+    if end:
+        where.append("date < ?")
+        args.append(end)
+    cond = (" WHERE " + " AND ".join(where)) if where else ""
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT COALESCE(SUM(qty_logs),0), COALESCE(SUM(volume_cft),0) FROM stock_in{cond}", args)
+        logs, vol = c.fetchone()
+        c.execute(f"SELECT COALESCE(SUM(qty),0) FROM stock_out{cond}", args)
+        cut = c.fetchone()[0]
+        c.execute(f"SELECT COUNT(1) FROM orders{cond}", args)
+        new_orders = c.fetchone()[0]
+        c.execute(f"SELECT COUNT(1) FROM deliveries{cond}", args)
+        deliveries = c.fetchone()[0]
+        c.execute(f"SELECT COALESCE(SUM(amount),0) FROM payments{cond}", args)
+        paid = c.fetchone()[0]
+        c.execute("SELECT value FROM totals WHERE name='orders_pending'")
+        row = c.fetchone()
+    return {"logs_in": logs, "volume_in": vol, "planks_cut": cut, "new_orders": new_orders,
+            "deliveries": deliveries, "payments_received": paid,
+            "orders_pending": int(row[0]) if row else 0}
+
+
+def report_totals() -> dict:
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT name, value FROM totals")
+        stored = dict(c.fetchall())
+    out = {name: stored.get(name, 0) for name in TOTALS}
+    for name in ("logs_in", "planks_cut", "orders_pending"):
+        out[name] = int(out[name])
+    return out
+
+
+# exports: name -> (SELECT ... FROM ..., keyset column, date column or None).
+# The keyset column is always selected first; the *_full views carry names
+# next to the ids.
+EXPORTS = {
+    "suppliers": ("SELECT supplier_id, name, phone, address FROM suppliers", "supplier_id", None),
+    "customers": ("SELECT customer_id, name, phone, address FROM customers", "customer_id", None),
+    "stock_in": ("SELECT batch_id, supplier_id, qty_logs, volume_cft, date FROM stock_in", "batch_id", "date"),
+    "stock_out": ("SELECT id, batch_id, thickness_mm, width_mm, length_mm, qty, date FROM stock_out", "id", "date"),
+    "orders": ("SELECT order_id, customer_id, status, date FROM orders", "order_id", "date"),
+    "order_items": ("SELECT id, order_id, thickness_mm, width_mm, length_mm, size_label, qty FROM order_items",
+                    "id", None),
+    "deliveries": ("SELECT delivery_id, order_id, lorry_number, qty, status, date FROM deliveries", "delivery_id",
+                   "date"),
+    "payments": ("SELECT payment_id, order_id, amount, method, date FROM payments", "payment_id", "date"),
+    "inventory": ("SELECT size_key, thickness_mm, width_mm, length_mm, produced, reserved, shipped FROM inventory",
+                  "size_key", None),
+    "batch_ledger": ("SELECT batch_id, logs_in, volume_in, planks, volume_out FROM batch_ledger", "batch_id", None),
+    "order_state": ("""SELECT order_id, customer_id, qty_ordered, qty_delivered, deliveries, amount, amount_paid,
+                              status FROM order_state""", "order_id", None),
+    "stock_in_full": ("""SELECT i.batch_id, i.date, s.name AS supplier, i.qty_logs, i.volume_cft,
+                                b.planks, b.volume_out
+                         FROM stock_in i LEFT JOIN suppliers s ON s.supplier_id = i.supplier_id
+                         LEFT JOIN batch_ledger b ON b.batch_id = i.batch_id""", "i.batch_id", "i.date"),
+    "orders_full": ("""SELECT o.order_id, o.date, c.name AS customer, o.status, s.qty_ordered, s.qty_delivered,
+                              s.deliveries, s.amount, s.amount_paid
+                       FROM orders o LEFT JOIN customers c ON c.customer_id = o.customer_id
+                       LEFT JOIN order_state s ON s.order_id = o.order_id""", "o.order_id", "o.date"),
+    "order_items_full": ("""SELECT i.id AS item_id, i.order_id, o.date, c.name AS customer, i.size_label,
+                                   i.thickness_mm, i.width_mm, i.length_mm, i.qty, o.status
+                            FROM order_items i JOIN orders o ON o.order_id = i.order_id
+                            LEFT JOIN customers c ON c.customer_id = o.customer_id""", "i.id", None),
+    "deliveries_full": ("""SELECT d.delivery_id, d.date, d.order_id, c.name AS customer, d.lorry_number, d.qty,
+                                  d.status
+                           FROM deliveries d LEFT JOIN orders o ON o.order_id = d.order_id
+                           LEFT JOIN customers c ON c.customer_id = o.customer_id""", "d.delivery_id", "d.date"),
+    "payments_full": ("""SELECT p.payment_id, p.date, p.order_id, c.name AS customer, p.amount, p.method
+                         FROM payments p LEFT JOIN orders o ON o.order_id = p.order_id
+                         LEFT JOIN customers c ON c.customer_id = o.customer_id""", "p.payment_id", "p.date"),
+}
+
+
+def export_page(name: str, after=None, start: str | None = None, end: str | None = None, limit: int = 1000,
+                newest_first: bool = False) -> tuple[list, list]:
+    """One keyset page of an export: ``(columns, rows)`` with keys past ``after``, in key order.
+
+    Pass the last row's first column as ``after`` to get the next page. Each
+    page is its own short read, so no connection or snapshot is held across
+    a long download and concurrent writes (and WAL checkpoints) carry on.
+    ``start``/``end`` bound the date column (canonical, end exclusive).
+    """
+    sql, key, date_col = EXPORTS[name]
+    where, args = [], []
+    if after is not None:
+        where.append(f"{key} {'<' if newest_first else '>'} ?")
+        args.append(after)
+    if date_col and start:
+        where.append(f"{date_col} >= ?")
+        args.append(start)
+    if date_col and end:
+        where.append(f"{date_col} < ?")
+        args.append(end)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {key}{' DESC' if newest_first else ''} LIMIT ?"
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute(sql, args + [limit])
+        return [d[0] for d in c.description], c.fetchall()
+
+
+def table_names() -> list[str]:
+    with db_conn() as conn:
+        c = conn.cursor()
+        if USE_POSTGRES:
+            c.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema() "
+                      "ORDER BY 1")
+        else:
+            c.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY 1")
+        return [r[0] for r in c.fetchall()]
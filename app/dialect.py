@@ -0,0 +1,182 @@
+# app/dialect.py
+"""SQLite / Postgres differences in one place.
+
+The app writes SQLite-flavoured SQL: ``?`` placeholders, ``INSERT OR
+IGNORE`` / ``INSERT OR REPLACE`` and SQLite column types. On Postgres every
+connection is a PgConnection whose cursors rewrite that text once per
+distinct statement (``to_postgres``, cached): ``%s`` placeholders,
+``ON CONFLICT`` clauses and Postgres types in CREATE TABLE. Queries must
+therefore not contain a literal ``?`` or ``%``.
+
+What text rewriting cannot cover has explicit helpers with one branch per
+backend: generated ids (``insert_returning``), bulk loads (``copy_rows``,
+``insert_count``) and server-side prepared statements (``execute_prepared``).
+On Postgres ``cursor.executemany`` is batched, so its rowcount is not
+meaningful; use ``insert_count`` when the count matters.
+"""
+import io
+import re
+from functools import lru_cache
+
+from .config import settings
+
+POSTGRES = bool(settings.DATABASE_URL)
+
+# conflict target for INSERT OR REPLACE, per table
+UPSERT_KEYS = {"meta": ("key",), "totals": ("name",), "llm_cache": ("key",)}
+
+# generated primary key of each AUTOINCREMENT table (the RETURNING column)
+PRIMARY_KEYS = {"suppliers": "supplier_id", "customers": "customer_id", "stock_in": "batch_id",
+                "stock_out": "id", "orders": "order_id", "order_items": "id", "deliveries": "delivery_id",
+                "payments": "payment_id", "inbox": "id"}
+
+# SQLite's datetime('now') text, which updates_processed.ts is compared against
+_PG_NOW_TEXT = "(to_char(timezone('UTC', now()), 'YYYY-MM-DD HH24:MI:SS'))"
+
+_CREATE_TABLE = re.compile(r"^\s*CREATE\s+TABLE", re.I)
+_INSERT_OR = re.compile(r"^\s*INSERT\s+OR\s+(IGNORE|REPLACE)\s+INTO\s+(\w+)\s*\(([^)]*)\)", re.I)
+
+
+@lru_cache(maxsize=1024)
+def to_postgres(sql: str) -> str:
+    """Rewrite one SQLite-flavoured statement for Postgres."""
+    if _CREATE_TABLE.match(sql):
+        sql = sql.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "BIGSERIAL PRIMARY KEY")
+        sql = re.sub(r"\bINTEGER\b", "BIGINT", sql)
+        sql = re.sub(r"\bREAL\b", "DOUBLE PRECISION", sql)
+        sql = sql.replace("(datetime('now'))", _PG_NOW_TEXT)
+    m = _INSERT_OR.match(sql)
+    if m:
+        verb, table = m.group(1).upper(), m.group(2)
+        cols = [c.strip() for c in m.group(3).split(",")]
+        sql = f"INSERT INTO {table}({m.group(3)})" + sql[m.end():].rstrip().rstrip(";")
+        if verb == "IGNORE":
+            sql += " ON CONFLICT DO NOTHING"
+        else:
+            key = UPSERT_KEYS[table]
+            updates = ", ".join(f"{c}=EXCLUDED.{c}" for c in cols if c not in key)
+            sql += f" ON CONFLICT ({', '.join(key)}) DO UPDATE SET {updates}"
+    return sql.replace("?", "%s")
+
+
+try:
+    import psycopg2.extensions
+    import psycopg2.extras
+except ImportError:  # SQLite-only installs do not need psycopg2
+    if POSTGRES:
+        raise
+    psycopg2 = None
+
+if psycopg2 is not None:
+    def _cast_numeric(value, cur):
+        # SUM()/AVG() over BIGINT columns return numeric; hand back what SQLite would (int or float)
+        if value is None:
+            return None
+        return int(value) if value.lstrip("-").isdigit() else float(value)
+
+    # the schema has no NUMERIC columns, so only aggregates come back as numeric (Decimal by default)
+    NUMERIC = psycopg2.extensions.new_type((1700,), "SAWMILL_NUMERIC", _cast_numeric)
+
+    class PgCursor(psycopg2.extensions.cursor):
+        """Cursor that accepts the app's SQLite-flavoured SQL (see ``to_postgres``)."""
+
+        def execute(self, sql, args=None):
+            # bytes come pre-composed from psycopg2.extras helpers
+            return super().execute(to_postgres(sql) if isinstance(sql, str) else sql, args)
+
+        def executemany(self, sql, seq):
+            psycopg2.extras.execute_batch(self, to_postgres(sql), list(seq), page_size=settings.DB_BATCH_PAGE_SIZE)
+
+    class PgConnection(psycopg2.extensions.connection):
+        """psycopg2 connection handing out PgCursors; remembers its PREPAREd statement names."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.cursor_factory = PgCursor
+            psycopg2.extensions.register_type(NUMERIC, self)
+            self.prepared: set[str] = set()
+
+
+def insert_returning(c, table: str, cols: tuple, rows: list) -> list[int]:
+    """INSERT ``rows`` and return their generated ids in order.
+
+    Postgres: one multi-row ``INSERT ... RETURNING`` round trip. SQLite only
+    reports lastrowid for execute(), so for several rows we read the
+    AUTOINCREMENT high-water mark afterwards: the executemany holds the
+    write lock, so its ids are the contiguous run ending there.
+    """
+    if not rows:
+        return []
+    if POSTGRES:
+        sql = f"INSERT INTO {table}({','.join(cols)}) VALUES %s RETURNING {PRIMARY_KEYS[table]}"
+        return [r[0] for r in psycopg2.extras.execute_values(c, sql, rows, page_size=len(rows), fetch=True)]
+    sql = f"INSERT INTO {table}({','.join(cols)}) VALUES({','.join('?' * len(cols))})"
+    if len(rows) == 1:
+        c.execute(sql, rows[0])
+        return [c.lastrowid]
+    c.executemany(sql, rows)
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,))
+    last = c.fetchone()[0]
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def insert_count(c, table: str, cols: tuple, rows: list, ignore_conflicts: bool = False) -> int:
+    """INSERT ``rows`` (skipping conflicting ones if asked) and return how many were inserted."""
+    if not rows:
+        return 0
+    if POSTGRES:
+        sql = (f"INSERT INTO {table}({','.join(cols)}) VALUES %s"
+               + (" ON CONFLICT DO NOTHING" if ignore_conflicts else "") + " RETURNING 1")
+        return len(psycopg2.extras.execute_values(c, sql, rows, page_size=settings.DB_BATCH_PAGE_SIZE, fetch=True))
+    verb = "INSERT OR IGNORE" if ignore_conflicts else "INSERT"
+    c.executemany(f"{verb} INTO {table}({','.join(cols)}) VALUES({','.join('?' * len(cols))})", rows)
+    return c.rowcount
+
+
+def _copy_field(v) -> str:
+    if v is None:
+        return r"\N"
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(c, table: str, cols: tuple, rows: list) -> int:
+    """Bulk-load ``rows`` where ids are not needed back: COPY on Postgres, executemany on SQLite.
+
+    Below DB_COPY_MIN_ROWS a plain multi-row INSERT is cheaper than setting up a COPY.
+    """
+    if not rows:
+        return 0
+    if POSTGRES and len(rows) >= settings.DB_COPY_MIN_ROWS:
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(_copy_field(v) for v in row))
+            buf.write("\n")
+        buf.seek(0)
+        c.copy_expert(f"COPY {table}({','.join(cols)}) FROM STDIN", buf)
+        return len(rows)
+    return insert_count(c, table, cols, rows)
+
+
+def _numbered(sql: str) -> str:
+    n = iter(range(1, 10_000))
+    return re.sub(r"%s", lambda _m: f"${next(n)}", sql)
+
+
+def execute_prepared(c, name: str, sql: str, args: tuple = ()):
+    """Run a hot single statement; on Postgres it is PREPAREd once per connection, then EXECUTEd.
+
+    SQLite needs nothing extra: sqlite3 keeps its own per-connection
+    statement cache. DB_PREPARED_STATEMENTS=false turns this off on
+    Postgres, e.g. behind a transaction-mode pgbouncer.
+    """
+    if not (POSTGRES and settings.DB_PREPARED_STATEMENTS):
+        c.execute(sql, args)
+        return
+    conn = c.connection
+    if name not in conn.prepared:
+        c.execute(f"PREPARE {name} AS {_numbered(to_postgres(sql))}")
+        conn.prepared.add(name)
+    if args:
+        c.execute(f"EXECUTE {name}({', '.join('?' * len(args))})", args)
+    else:
+        c.execute(f"EXECUTE {name}")
@@ -1,23 +1,79 @@
 # app/main.py
+import asyncio
 import logging
 import sys
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
-from .db import init_db
+from .db import init_db, close_pool, warm_name_caches, load_inventory
+from .metrics import TraceFilter
 
 # basic logging configuration
 log = logging.getLogger("sawmill")
 level = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
 handler = logging.StreamHandler(sys.stdout)
-formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+if settings.LOG_TRACE_IDS:
+    # the filter sits on the handler so records from every sawmill.* logger get a trace_id
+    handler.addFilter(TraceFilter())
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s")
+else:
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
 handler.setFormatter(formatter)
 log.addHandler(handler)
 log.setLevel(level)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from .services.executor import shutdown_executors
+    from .services.telegram import start_client, close_client
+    from .services.send_queue import outbox
+    from .services import openai_parser
+    from .services.dedup import prune_forever
+    from .services.write_batcher import writes
+    from .services.inbox import inbox
+    from .services.poller import poller
+    from .services.importer import importer
+    from .routers.telegram import process_update
+
+    init_db()
+    warm_name_caches()
+    load_inventory()
+    await start_client()
+    await outbox.start()
+    pruner = asyncio.create_task(prune_forever(), name="updates-pruner")
+    if settings.INBOX_ENABLED:
+        await inbox.start(process_update)
+    if settings.TELEGRAM_INGEST_MODE == "polling":
+        await poller.start(process_update)
+    log.info("Bootstrap complete. environment=%s", settings.ENVIRONMENT)
+    # try to auto-register webhook (best-effort)
+    if not poller.running:
+        try:
+            from .services.telegram import set_webhook
+            set_webhook()
+        except Exception as e:
+            log.exception("Could not auto-register webhook on startup: %s", e)
+    try:
+        yield
+    finally:
+        await poller.stop()
+        await inbox.stop()
+        await importer.stop()
+        pruner.cancel()
+        await asyncio.gather(pruner, return_exceptions=True)
+        await writes.drain()
+        await outbox.stop()
+        await close_client()
+        await openai_parser.close_client()
+        shutdown_executors()
+        close_pool()
+
+
 # create FastAPI app instance first
-app = FastAPI(title="Sawmill Telegram ERP (Prod)")
+app = FastAPI(title="Sawmill Telegram ERP (Prod)", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,23 +93,18 @@ except Exception:
     debug_router = None
 from .routers.debug_token import router as debug_token_router
 app.include_router(debug_token_router)
+from .routers.imports import router as imports_router
+app.include_router(imports_router)
+from .routers.exports import router as exports_router
+app.include_router(exports_router)
+from .routers.metrics import router as metrics_router
+app.include_router(metrics_router)
 
 # include routers
 app.include_router(telegram_router)
 if debug_router is not None:
     app.include_router(debug_router)
 
-@app.on_event("startup")
-def bootstrap():
-    init_db()
-    log.info("Bootstrap complete. environment=%s", settings.ENVIRONMENT)
-    # try to auto-register webhook (best-effort)
-    try:
-        from .services.telegram import set_webhook
-        set_webhook()
-    except Exception as e:
-        log.exception("Could not auto-register webhook on startup: %s", e)
-
 @app.get("/")
 def health():
     return {"ok": True, "service": "Sawmill Telegram ERP", "env": settings.ENVIRONMENT}
@@ -0,0 +1,91 @@
+# app/manage.py
+"""Maintenance commands: ``python -m app.manage <command>``."""
+import argparse
+import logging
+import sys
+
+from .db import init_db, rebuild_totals, verify_totals, rebuild_inventory, verify_inventory, rebuild_order_state
+from .migrations import migration_status, check_plans
+
+
+def _rebuild_totals(args) -> int:
+    for name, value in rebuild_totals().items():
+        print(f"{name:<20} {value}")
+    return 0
+
+
+def _verify_totals(args) -> int:
+    bad = verify_totals()
+    if not bad:
+        print("totals OK")
+        return 0
+    for name, (stored, actual) in bad.items():
+        print(f"{name:<20} stored={stored} actual={actual}")
+    return 1
+
+
+def _rebuild_inventory(args) -> int:
+    for name, value in rebuild_inventory().items():
+        print(f"{name:<20} {value}")
+    return 0
+
+
+def _verify_inventory(args) -> int:
+    bad = verify_inventory()
+    if not bad:
+        print("inventory OK")
+        return 0
+    for name, (stored, actual) in sorted(bad.items()):
+        print(f"{name:<20} stored={stored} actual={actual}")
+    return 1
+
+
+def _rebuild_orders(args) -> int:
+    for status, n in sorted(rebuild_order_state().items()):
+        print(f"{status:<20} {n}")
+    return 0
+
+
+def _migrations(args) -> int:
+    # init_db() has already applied anything pending
+    for version, name, applied_at in migration_status():
+        print(f"{version:>4}  {name:<40} {applied_at or 'pending'}")
+    return 0
+
+
+def _check_plans(args) -> int:
+    bad = check_plans()
+    if not bad:
+        print("query plans OK")
+        return 0
+    for label, plan in bad.items():
+        print(f"{label}:")
+        for line in plan:
+            print(f"    {line}")
+    return 1
+
+
+COMMANDS = {
+    "migrate": (_migrations, "apply pending schema migrations and list every version"),
+    "check-plans": (_check_plans, "EXPLAIN the hot queries; exit 1 if any no longer uses its index"),
+    "rebuild-totals": (_rebuild_totals, "recompute running totals from history"),
+    "verify-totals": (_verify_totals, "check running totals against history (exit 1 on drift)"),
+    "rebuild-inventory": (_rebuild_inventory, "recompute stock by size and batch yield from history"),
+    "verify-inventory": (_verify_inventory, "check stock by size and batch yield against history (exit 1 on drift)"),
+    "rebuild-orders": (_rebuild_orders, "recompute per-order delivery/payment state and order status from history"),
+}
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s %(message)s")
+    ap = argparse.ArgumentParser(prog="python -m app.manage", description=__doc__)
+    sub = ap.add_subparsers(dest="command", required=True)
+    for name, (fn, help_text) in COMMANDS.items():
+        sub.add_parser(name, help=help_text).set_defaults(fn=fn)
+    args = ap.parse_args(argv)
+    init_db()
+    return args.fn(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# app/metrics.py
+"""Process metrics in the Prometheus text format, served on ``GET /metrics``.
+
+Latency histograms are the only thing recorded on the hot path: a bisect
+and three additions under a lock per observation. The counters and gauges
+the services already keep for ``/debug/stats`` (parse paths, LLM outcomes,
+duplicates, queue depths, ...) are not counted twice; ``render()`` reads
+them at scrape time.
+
+Trace ids: ``process_update`` sets ``trace_id`` for the update it handles.
+With LOG_TRACE_IDS on, TraceFilter stamps it on every log line of that
+update, including lines from DB threads (``run_db`` copies the context)
+and the reply's send task.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY: list = []
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Latency histogram; ``observe`` is safe from any thread."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = _LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labels, buckets
+        # label values -> [count per bucket (last one +Inf), sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, seconds: float, *labels):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 3)
+            s[i] += 1
+            s[-2] += seconds
+            s[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, s in sorted(series.items()):
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s):
+                acc += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {s[-2]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {s[-1]}")
+        return out
+
+
+class Counter:
+    """Monotonic counter for events no service already counts."""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return _family(self.name, "counter", self.help,
+                       [(dict(zip(self.labelnames, k)), v) for k, v in sorted(values.items())])
+
+
+class Gauge:
+    """Up/down gauge, e.g. work in flight."""
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self.value = 0
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def render(self) -> list[str]:
+        return _family(self.name, "gauge", self.help, [({}, self.value)])
+
+
+def _family(name: str, kind: str, help: str, samples: list) -> list[str]:
+    out = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        out.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value:g}")
+    return out
+
+
+# where the time goes between the webhook and the reply
+STAGE = Histogram("sawmill_stage_seconds", "Latency of each stage of handling an update.", ("stage",))
+DB_WRITE = Histogram("sawmill_db_write_seconds", "One writer call (executemany for a batch) per record type.",
+                     ("kind",))
+REPORT = Histogram("sawmill_report_seconds", "Building a REPORT reply, queries included.", ("kind",))
+SEND_ERRORS = Counter("sawmill_telegram_send_errors_total", "Failed Bot API sends by reason.", ("reason",))
+UPDATES_INFLIGHT = Gauge("sawmill_updates_inflight", "Updates being processed right now.")
+
+
+# --- trace ids ------------------------------------------------------------------
+
+trace_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_id", default=None)
+
+
+def start_trace(update_id: int | None) -> contextvars.Token:
+    """Tag the current task (and whatever it spawns) with an id for this update.
+
+    Returns the token for ``trace_id.reset`` once the update is done.
+    """
+    return trace_id.set(f"u{update_id}" if update_id else f"t{time.monotonic_ns() % 16**8:08x}")
+
+
+class TraceFilter(logging.Filter):
+    """Adds ``%(trace_id)s`` to records ("-" outside an update)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id.get() or "-"
+        return True
+
+
+# --- exposition ---------------------------------------------------------------
+
+def _service_families() -> list[str]:
+    """Counters and gauges the services keep anyway, read at scrape time."""
+    from .parsing import PARSE_STATS
+    from .services.dedup import dedup_stats
+    from .services.executor import executor_stats
+    from .services.inbox import inbox
+    from .services.openai_parser import llm_stats
+    from .services.send_queue import outbox
+    from .services.write_batcher import writes
+
+    out = []
+    paths = []
+    for key, n in sorted(PARSE_STATS.items()):
+        path, _, kind = key.partition(":")
+        paths.append(({"path": path, "type": kind or "-"}, n))
+    out += _family("sawmill_parse_total", "counter", "Messages by parse path (rule, nl, escalated to the LLM).", paths)
+
+    llm = llm_stats()
+    out += _family("sawmill_llm_requests_total", "counter", "OpenAI requests by outcome.",
+                   [({"outcome": k}, llm[k]) for k in ("ok", "failed", "timeouts", "short_circuited")])
+    out += _family("sawmill_llm_bad_answers_total", "counter", "Answers without usable JSON.",
+                   [({"kind": "bad_json"}, llm["bad_json"]), ({"kind": "batch_malformed"}, llm["batch_malformed"])])
+    out += _family("sawmill_llm_breaker_open", "gauge", "1 while the OpenAI circuit breaker is not closed.",
+                   [({}, int(llm["breaker"] != "closed"))])
+
+    dedup, ib = dedup_stats(), inbox.stats()
+    out += _family("sawmill_duplicate_updates_total", "counter", "Redelivered updates dropped, by where they were caught.",
+                   [({"where": "memory"}, dedup["dup_memory"]), ({"where": "db"}, dedup["dup_db"]),
+                    ({"where": "inbox"}, ib["duplicates"])])
+
+    ob = outbox.stats()
+    out += _family("sawmill_send_queue_total", "counter", "Send queue outcomes.",
+                   [({"outcome": k}, ob[k]) for k in ("sent", "retried", "rate_limited", "dropped", "coalesced")])
+
+    inflight = [({"what": "llm_requests"}, llm["inflight"]), ({"what": "llm_waiting"}, llm["waiting"]),
+                ({"what": "llm_coalesce_pending"}, llm["coalesce"]["pending"]),
+                ({"what": "send_queue"}, ob["pending"]), ({"what": "sends"}, ob["inflight"]),
+                ({"what": "inbox_backlog"}, ib["backlog"]), ({"what": "write_batch"}, writes.stats()["pending"])]
+    for lane, st in executor_stats().items():
+        inflight += [({"what": f"{lane}_running"}, st["running"]), ({"what": f"{lane}_queued"}, st["queued"])]
+    out += _family("sawmill_inflight", "gauge", "Work queued or in flight, by queue.", inflight)
+    return out
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines += metric.render()
+    lines += _service_families()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,358 @@
+# app/migrations.py
+"""Versioned schema migrations: ``init_db()`` runs ``migrate()`` on startup.
+
+Each entry in MIGRATIONS is applied once, in order, in its own transaction
+together with its ``schema_version`` row, so a failed step leaves the
+database at the previous version. The runner takes a write lock first
+(BEGIN IMMEDIATE on SQLite, a transaction-scoped advisory lock on
+Postgres) and re-reads the version under it, so two processes starting at
+once cannot both apply a step.
+
+Steps 1-5 reproduce what ``init_db`` used to run unconditionally; they are
+idempotent (IF NOT EXISTS, meta flags), so databases created before
+versioning simply walk through them. New changes go at the end: never
+edit a released step, add one.
+
+``check_plans()`` runs EXPLAIN over the hot lookups and report queries and
+names every one that no longer uses its index (``python -m app.manage
+check-plans``).
+"""
+import logging
+import time
+
+from . import db
+from .db import USE_POSTGRES, db_conn
+
+log = logging.getLogger("sawmill.migrations")
+
+# pg_advisory_xact_lock key; any constant shared by every app process
+_PG_LOCK_KEY = 52710318
+
+
+class MigrationError(RuntimeError):
+    """A migration step failed; the database stays at the previous version."""
+
+
+def _columns(c, table: str) -> set:
+    if USE_POSTGRES:
+        c.execute("SELECT column_name FROM information_schema.columns "
+                  "WHERE table_schema = current_schema() AND table_name=?", (table,))
+        return {r[0] for r in c.fetchall()}
+    c.execute(f"PRAGMA table_info({table})")
+    return {r[1] for r in c.fetchall()}
+
+
+def add_column(c, table: str, column: str, decl: str) -> bool:
+    """``ALTER TABLE ... ADD COLUMN`` unless the column exists; True if it was added."""
+    if column in _columns(c, table):
+        return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+
+def _meta_flag(c, key: str) -> bool:
+    c.execute("SELECT 1 FROM meta WHERE key=?", (key,))
+    return c.fetchone() is not None
+
+
+def _set_meta_flag(c, key: str):
+    c.execute("INSERT OR REPLACE INTO meta(key,value) VALUES(?,'1')", (key,))
+
+
+# --- steps ------------------------------------------------------------------
+
+def _v1_core_tables(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS suppliers(
+        supplier_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE, phone TEXT, address TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS customers(
+        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE, phone TEXT, address TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS stock_in(
+        batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        supplier_id INTEGER, qty_logs INTEGER, volume_cft REAL, date TEXT,
+        FOREIGN KEY(supplier_id) REFERENCES suppliers(supplier_id)
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS stock_out(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        batch_id INTEGER, thickness_mm REAL, width_mm REAL, length_mm REAL,
+        qty INTEGER, date TEXT,
+        FOREIGN KEY(batch_id) REFERENCES stock_in(batch_id)
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS orders(
+        order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER, status TEXT, date TEXT,
+        FOREIGN KEY(customer_id) REFERENCES customers(customer_id)
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS order_items(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER, thickness_mm REAL, width_mm REAL, length_mm REAL,
+        size_label TEXT, qty INTEGER,
+        FOREIGN KEY(order_id) REFERENCES orders(order_id)
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS deliveries(
+        delivery_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER, lorry_number TEXT, status TEXT, date TEXT,
+        FOREIGN KEY(order_id) REFERENCES orders(order_id)
+    )""")
+    # the v4/v5 backfills read deliveries.qty; databases already past v1 get it from v7
+    add_column(c, "deliveries", "qty", "INTEGER")
+    c.execute("""CREATE TABLE IF NOT EXISTS payments(
+        payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER, amount REAL, method TEXT, date TEXT,
+        FOREIGN KEY(order_id) REFERENCES orders(order_id)
+    )""")
+    # idempotency table to record processed Telegram update_id's
+    c.execute("""CREATE TABLE IF NOT EXISTS updates_processed(
+        update_id INTEGER PRIMARY KEY,
+        ts TEXT DEFAULT (datetime('now'))
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_updates_processed_ts ON updates_processed(ts)")
+    c.execute("""CREATE TABLE IF NOT EXISTS inbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        update_id INTEGER UNIQUE, payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+        received_at REAL, available_at REAL, claimed_at REAL, worker TEXT, last_error TEXT
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_inbox_status ON inbox(status, available_at, id)")
+    # persisted tier of the LLM parse cache (app.services.parse_cache)
+    c.execute("""CREATE TABLE IF NOT EXISTS llm_cache(
+        key TEXT PRIMARY KEY, result TEXT, created_at REAL, last_used REAL,
+        hits INTEGER DEFAULT 0
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS meta(
+        key TEXT PRIMARY KEY, value TEXT
+    )""")
+
+
+def _v2_canonical_dates(c):
+    # canonical local timestamps (app.dates) make these range-scannable
+    for table in db.DATED_TABLES:
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_date ON {table}(date)")
+    if not _meta_flag(c, "dates_normalized"):
+        db._backfill_dates(c)
+        _set_meta_flag(c, "dates_normalized")
+
+
+def _v3_running_totals(c):
+    # running totals kept in step with every insert_* (see db._bump)
+    c.execute("""CREATE TABLE IF NOT EXISTS totals(
+        name TEXT PRIMARY KEY, value REAL NOT NULL DEFAULT 0
+    )""")
+    c.execute("SELECT name FROM totals")
+    missing = set(db.TOTALS) - {r[0] for r in c.fetchall()}
+    if missing:
+        # first start with these totals: backfill them from existing history
+        db._write_totals(c, db._compute_totals(c, missing))
+
+
+def _v4_inventory(c):
+    # live inventory by plank size and per-batch yield (see db._move_stock)
+    c.execute("""CREATE TABLE IF NOT EXISTS inventory(
+        size_key TEXT PRIMARY KEY, thickness_mm REAL, width_mm REAL, length_mm REAL,
+        produced INTEGER NOT NULL DEFAULT 0, reserved INTEGER NOT NULL DEFAULT 0,
+        shipped INTEGER NOT NULL DEFAULT 0
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS batch_ledger(
+        batch_id INTEGER PRIMARY KEY, logs_in INTEGER NOT NULL DEFAULT 0, volume_in REAL NOT NULL DEFAULT 0,
+        planks INTEGER NOT NULL DEFAULT 0, volume_out REAL NOT NULL DEFAULT 0
+    )""")
+    if not _meta_flag(c, "inventory_built"):
+        db._write_inventory(c, *db._compute_inventory(c))
+        _set_meta_flag(c, "inventory_built")
+
+
+def _v5_order_state(c):
+    for table, col in db.FK_COLUMNS:
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{col} ON {table}({col})")
+    # per-order delivery and settlement state (see db._settle_orders)
+    c.execute("""CREATE TABLE IF NOT EXISTS order_state(
+        order_id INTEGER PRIMARY KEY, customer_id INTEGER,
+        qty_ordered INTEGER NOT NULL DEFAULT 0, qty_delivered INTEGER NOT NULL DEFAULT 0,
+        deliveries INTEGER NOT NULL DEFAULT 0, amount REAL, amount_paid REAL NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        FOREIGN KEY(order_id) REFERENCES orders(order_id)
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_state_status ON order_state(status, customer_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_state_customer ON order_state(customer_id, status)")
+    if not _meta_flag(c, "order_state_built"):
+        # orders.status and orders_pending were never advanced before order_state existed
+        db._rebuild_order_state(c)
+        db._write_totals(c, db._compute_totals(c, ["orders_pending"]))
+        _set_meta_flag(c, "order_state_built")
+
+
+def _v6_hot_path_indexes(c):
+    # orders_pending recount / status filters, and LLM cache expiry + LRU eviction
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+
+
+def _v7_delivery_qty(c):
+    # units per delivery; older rows stay NULL, which counts as "the rest of the order",
+    # so order_state and the inventory need no backfill
+    add_column(c, "deliveries", "qty", "INTEGER")
+
+
+# (version, name, step): append only
+MIGRATIONS = [
+    (1, "core tables", _v1_core_tables),
+    (2, "canonical dates", _v2_canonical_dates),
+    (3, "running totals", _v3_running_totals),
+    (4, "inventory", _v4_inventory),
+    (5, "order state and foreign-key indexes", _v5_order_state),
+    (6, "hot-path indexes", _v6_hot_path_indexes),
+    (7, "delivery quantities", _v7_delivery_qty),
+]
+
+
+# --- runner -----------------------------------------------------------------
+
+def _ensure_version_table():
+    with db_conn() as conn:
+        conn.cursor().execute("""CREATE TABLE IF NOT EXISTS schema_version(
+            version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL
+        )""")
+
+
+def _applied(c) -> set:
+    c.execute("SELECT version FROM schema_version")
+    return {r[0] for r in c.fetchall()}
+
+
+def current_version() -> int:
+    _ensure_version_table()
+    with db_conn() as conn:
+        applied = _applied(conn.cursor())
+    return max(applied, default=0)
+
+
+def _lock(conn, c):
+    if USE_POSTGRES:
+        c.execute("SELECT pg_advisory_xact_lock(?)", (_PG_LOCK_KEY,))
+    else:
+        # sqlite3 does not open a transaction before DDL; take the write lock explicitly
+        if conn.in_transaction:
+            conn.commit()
+        c.execute("BEGIN IMMEDIATE")
+
+
+def migrate(target: int | None = None) -> list[int]:
+    """Apply every pending migration up to ``target`` (default: all); returns the versions applied."""
+    _ensure_version_table()
+    done = []
+    for version, name, step in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        t0 = time.perf_counter()
+        try:
+            with db_conn() as conn:
+                c = conn.cursor()
+                _lock(conn, c)
+                if version in _applied(c):
+                    continue
+                step(c)
+                c.execute("INSERT INTO schema_version(version,name,applied_at) VALUES(?,?,?)",
+                          (version, name, time.strftime("%Y-%m-%d %H:%M:%S")))
+        except Exception as e:
+            raise MigrationError(f"migration {version} ({name}) failed: {e}") from e
+        done.append(version)
+        log.info("Applied migration %s (%s) in %.0f ms", version, name, (time.perf_counter() - t0) * 1000)
+    return done
+
+
+def migration_status() -> list[tuple[int, str, str | None]]:
+    """``[(version, name, applied_at or None), ...]`` for every known migration."""
+    _ensure_version_table()
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT version, applied_at FROM schema_version")
+        applied = dict(c.fetchall())
+    return [(v, name, applied.get(v)) for v, name, _step in MIGRATIONS]
+
+
+# --- query-plan checks ------------------------------------------------------
+
+_WINDOW = ("2024-01-01 00:00:00", "2024-02-01 00:00:00")
+
+# (label, query as the app runs it, sample args, index it must use; None = any index)
+PLAN_CHECKS = [
+    ("supplier by name", "SELECT supplier_id FROM suppliers WHERE name=?", ("Kumar",), None),
+    ("customer by name", "SELECT customer_id FROM customers WHERE name=?", ("Ravi",), None),
+    ("window stock_in", "SELECT COALESCE(SUM(qty_logs),0), COALESCE(SUM(volume_cft),0) FROM stock_in "
+                        "WHERE date >= ? AND date < ?", _WINDOW, "idx_stock_in_date"),
+    ("window stock_out", "SELECT COALESCE(SUM(qty),0) FROM stock_out WHERE date >= ? AND date < ?",
+     _WINDOW, "idx_stock_out_date"),
+    ("window orders", "SELECT COUNT(1) FROM orders WHERE date >= ? AND date < ?", _WINDOW, "idx_orders_date"),
+    ("window deliveries", "SELECT COUNT(1) FROM deliveries WHERE date >= ? AND date < ?",
+     _WINDOW, "idx_deliveries_date"),
+    ("window payments", "SELECT COALESCE(SUM(amount),0) FROM payments WHERE date >= ? AND date < ?",
+     _WINDOW, "idx_payments_date"),
+    ("batches by supplier", "SELECT batch_id FROM stock_in WHERE supplier_id=?", (1,), "idx_stock_in_supplier_id"),
+    ("cuts by batch", "SELECT qty FROM stock_out WHERE batch_id=?", (1,), "idx_stock_out_batch_id"),
+    ("orders by customer", "SELECT order_id FROM orders WHERE customer_id=?", (1,), "idx_orders_customer_id"),
+    ("items of order", "SELECT thickness_mm, width_mm, length_mm, qty FROM order_items WHERE order_id=?",
+     (1,), "idx_order_items_order_id"),
+    ("deliveries of order", "SELECT COUNT(1) FROM deliveries WHERE order_id=?", (1,), "idx_deliveries_order_id"),
+    ("payments of order", "SELECT COALESCE(SUM(amount),0) FROM payments WHERE order_id=?",
+     (1,), "idx_payments_order_id"),
+    ("pending orders count", "SELECT COUNT(1) FROM orders WHERE status='pending'", (), "idx_orders_status"),
+    ("open orders", "SELECT s.order_id, c.name FROM order_state s LEFT JOIN customers c "
+                    "ON c.customer_id = s.customer_id WHERE s.status='pending' ORDER BY s.order_id LIMIT ?",
+     (25,), "idx_order_state_status"),
+    ("customer dues", "SELECT COUNT(1), COALESCE(SUM(s.amount - s.amount_paid), 0) FROM order_state s "
+                      "WHERE s.status IN ('pending','delivered') AND s.customer_id=?",
+     (1,), "idx_order_state_customer"),
+    ("inbox claim", "SELECT id, payload, attempts FROM inbox WHERE status='pending' AND available_at <= ? "
+                    "ORDER BY id LIMIT 5", (0.0,), "idx_inbox_status"),
+    ("updates prune", "SELECT update_id FROM updates_processed WHERE ts < ? LIMIT ?",
+     ("2024-01-01 00:00:00", 1000), "idx_updates_processed_ts"),
+    ("llm cache expiry", "SELECT key FROM llm_cache WHERE created_at < ?", (0.0,), "idx_llm_cache_created"),
+    ("llm cache eviction", "SELECT key FROM llm_cache ORDER BY last_used ASC LIMIT ?",
+     (10,), "idx_llm_cache_last_used"),
+] + [
+    # keyset export pages (db.export_page) must seek on the key, never scan
+    (f"export {name}", f"{sql} WHERE {key} > ? ORDER BY {key} LIMIT ?", ("" if key == "size_key" else 0, 1000), None)
+    for name, (sql, key, _date_col) in db.EXPORTS.items()
+]
+
+
+def explain(c, sql: str, args=()) -> list[str]:
+    """Plan lines for ``sql``: EXPLAIN QUERY PLAN details on SQLite, EXPLAIN text on Postgres."""
+    if USE_POSTGRES:
+        c.execute("EXPLAIN " + sql, args)
+        return [r[0] for r in c.fetchall()]
+    c.execute("EXPLAIN QUERY PLAN " + sql, args)
+    return [r[-1] for r in c.fetchall()]
+
+
+def _uses_index(lines: list[str], index: str | None) -> bool:
+    text = "\n".join(lines)
+    if USE_POSTGRES:
+        scanned = "Seq Scan" in text
+    else:
+        # "SCAN t" is a full table scan; "SCAN t USING INDEX i" walks an index in order
+        scanned = any(line.startswith("SCAN ") and " USING " not in line for line in lines)
+    return not scanned and (index is None or index in text)
+
+
+def check_plans() -> dict[str, list[str]]:
+    """Run every PLAN_CHECKS query through EXPLAIN; returns {label: plan} for those not using their index.
+
+    On Postgres sequential scans are disabled for the check, so tiny tables
+    report whether an index *can* serve the query rather than whether the
+    planner prefers one at the current size.
+    """
+    bad = {}
+    with db_conn() as conn:
+        c = conn.cursor()
+        if USE_POSTGRES:
+            c.execute("SET LOCAL enable_seqscan = off")
+        for label, sql, args, index in PLAN_CHECKS:
+            lines = explain(c, sql, args)
+            if not _uses_index(lines, index):
+                bad[label] = lines
+    return bad
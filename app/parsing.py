@@ -1,42 +1,76 @@
+import logging
 import re
-from typing import Optional, Dict, Any
+from collections import Counter
+from typing import Optional, Dict, Any, Tuple, List, Iterable
+from .dates import parse_date
 from .schemas import StockIn, Production, Order, Delivery, Payment, ReportReq
 
+log = logging.getLogger("sawmill.parsing")
+
 INCH_MM, FOOT_MM = 25.4, 304.8
 
+# unit -> millimetres per unit
+UNIT_MM = {
+    "mm": 1.0, "cm": 10.0, "m": 1000.0,
+    "in": INCH_MM, "inch": INCH_MM, "inches": INCH_MM, '"': INCH_MM,
+    "ft": FOOT_MM, "foot": FOOT_MM, "feet": FOOT_MM, "'": FOOT_MM,
+}
+
 def _to_mm(v: float, u: Optional[str]) -> float:
     if not u:
         return v
-    u = u.lower()
-    if u == "mm": return v
-    if u == "cm": return v * 10
-    if u == "m": return v * 1000
-    if u in ("in", "inch", "inches", '"'): return v * INCH_MM
-    if u in ("ft", "foot", "feet", "'"): return v * FOOT_MM
-    raise ValueError(f"unknown unit: {u}")
+    try:
+        return v * UNIT_MM[u.lower()]
+    except KeyError:
+        raise ValueError(f"unknown unit: {u}") from None
+
+_SIZE_TOKEN = re.compile(r'(?P<n>\d+(?:\.\d+)?)(?P<u>mm|cm|m|in|inch|inches|ft|foot|feet|["\']?)', re.I)
+_SIZE_SEP = re.compile(r'[x×*]')
+# default units per position: thickness and width in inches, length in feet
+_SIZE_DEFAULT_UNITS = ("in", "in", "ft")
 
 def parse_size_to_mm(s: str):
-    token = re.compile(r'(?P<n>\d+(?:\.\d+)?)(?P<u>mm|cm|m|in|inch|inches|ft|foot|feet|["\']?)', re.I)
-    parts = re.split(r'[x×*]', s.replace(" ", ""))
+    parts = _SIZE_SEP.split(s.replace(" ", ""))
     if len(parts) not in (2, 3):
         raise ValueError("size must be 2 or 3 dimensions")
-    vals, units = [], []
-    for p in parts:
-        m = token.fullmatch(p)
+    out = []
+    for p, default in zip(parts, _SIZE_DEFAULT_UNITS):
+        m = _SIZE_TOKEN.fullmatch(p)
         if not m:
             raise ValueError(f"bad token: {p}")
-        vals.append(float(m.group('n')))
-        units.append(m.group('u'))
-    if len(vals) == 2:
-        tmm = _to_mm(vals[0], units[0] or "in")
-        wmm = _to_mm(vals[1], units[1] or "in")
-        return tmm, wmm, None
-    tmm = _to_mm(vals[0], units[0] or "in")
-    wmm = _to_mm(vals[1], units[1] or "in")
-    lmm = _to_mm(vals[2], units[2] or "ft")
-    return tmm, wmm, lmm
+        out.append(_to_mm(float(m.group('n')), m.group('u') or default))
+    if len(out) == 2:
+        out.append(None)
+    return tuple(out)
+
+
+def size_key(thickness_mm, width_mm, length_mm=None) -> str:
+    """Canonical inventory key for a plank size: millimetres to 0.1, e.g. ``50.8x101.6x3657.6``.
 
+    Float columns from different parses ("2x4" vs "50.8mm x 101.6mm") land on
+    the same key; an unknown length keeps a two-part key.
+    """
+    dims = [thickness_mm, width_mm] + ([length_mm] if length_mm else [])
+    return "x".join(f"{round(float(d), 1):g}" for d in dims)
+
+
+def _in_units(mm: float, per: float):
+    v = mm / per
+    return round(v * 4) / 4 if abs(v * 4 - round(v * 4)) < 0.02 else None
+
+
+def describe_size(thickness_mm, width_mm, length_mm=None) -> str:
+    """Human label in the units people type: ``2x4x12`` (inches, inches, feet) when exact, else mm."""
+    parts = [_in_units(thickness_mm, INCH_MM), _in_units(width_mm, INCH_MM)]
+    if length_mm:
+        parts.append(_in_units(length_mm, FOOT_MM))
+    if all(parts):
+        return "x".join(f"{p:g}" for p in parts)
+    return size_key(thickness_mm, width_mm, length_mm) + "mm"
+
+_REPORT_DATE_RE = re.compile(r'\b(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4})\b')
 KV = re.compile(r'([a-z_]+)\s*=\s*("(?:[^"]+)"|\'(?:[^\']+)\'|\S+)', re.I)
+_VOLUME = re.compile(r"(\d+(?:\.\d+)?)(?:cft)?")
 
 def kv(text: str) -> Dict[str, str]:
     out = {}
@@ -44,87 +78,454 @@ def kv(text: str) -> Dict[str, str]:
         out[k.lower()] = v.strip('"\'')
     return out
 
+
+def _rule_stockin(m: Dict[str, str], tokens: List[str]):
+    vol = None
+    if "volume" in m:
+        mv = _VOLUME.fullmatch(m["volume"].lower())
+        if not mv:
+            return None
+        vol = float(mv.group(1))
+
+    return StockIn(
+        supplier_name=m.get("supplier") or m.get("from") or "Unknown",
+        qty_logs=int(m.get("qty") or m.get("logs") or 0),
+        volume_cft=vol,
+        date_str=m.get("date")
+    )
+
+
+def _rule_production(m: Dict[str, str], tokens: List[str]):
+    if "size" in m:
+        tmm, wmm, lmm = parse_size_to_mm(m["size"])
+    else:
+        tmm = _to_mm(float(m["thickness"]), m.get("t_unit"))
+        wmm = _to_mm(float(m["width"]), m.get("w_unit"))
+        lmm = _to_mm(float(m["length"]), m.get("l_unit")) if "length" in m else None
+
+    return Production(
+        batch_id=int(m.get("batch") or 0),
+        thickness_mm=tmm,
+        width_mm=wmm,
+        length_mm=lmm,
+        qty=int(m.get("output") or m.get("qty") or 0),
+        date_str=m.get("date")
+    )
+
+
+def _rule_order(m: Dict[str, str], tokens: List[str]):
+    size_text = m.get("size") or m.get("item")
+    tmm = wmm = lmm = None
+    if size_text:
+        try:
+            tmm, wmm, lmm = parse_size_to_mm(size_text)
+        except ValueError:
+            pass
+    qty = int(m.get("qty") or 0)
+    amount = None
+    if "amount" in m:
+        amount = float(m["amount"].replace(",", ""))
+    elif "rate" in m:
+        amount = float(m["rate"].replace(",", "")) * qty
+    return Order(
+        customer_name=m.get("customer") or "",
+        qty=qty,
+        size_label=size_text,
+        thickness_mm=tmm,
+        width_mm=wmm,
+        length_mm=lmm,
+        amount=amount,
+        date_str=m.get("date")
+    )
+
+
+def _rule_delivery(m: Dict[str, str], tokens: List[str]):
+    return Delivery(
+        order_id=int(m.get("order") or 0),
+        lorry_number=m.get("lorry") or "",
+        qty=int(m["qty"]) if m.get("qty") else None,
+        date_str=m.get("date")
+    )
+
+
+def _rule_payment(m: Dict[str, str], tokens: List[str]):
+    return Payment(
+        order_id=int(m.get("order") or 0),
+        amount=float((m.get("amount") or "0").replace(",", "")),
+        method=m.get("method"),
+        date_str=m.get("date")
+    )
+
+
+def _rule_report(m: Dict[str, str], tokens: List[str]):
+    start = m.get("from") or m.get("start")
+    end = m.get("to") or m.get("end")
+    if not (start or end):
+        dates = _REPORT_DATE_RE.findall(" ".join(tokens[1:]))
+        if dates:
+            start, end = dates[0], dates[-1]
+    if start or end:
+        return ReportReq(kind="custom", start=start, end=end)
+    kind = (m.get("kind") or (tokens[1] if len(tokens) > 1 else "daily")).lower()
+    if kind in ("stock", "inventory"):
+        # report stock [size=]2x4x12
+        size = m.get("size") or next((t for t in tokens[2:] if _SIZE_RE.fullmatch(t)), None)
+        return ReportReq(kind="stock", size=size)
+    if kind == "yield":
+        # report yield [batch=]12
+        batch = m.get("batch") or next((t.lstrip("#") for t in tokens[2:] if t.lstrip("#").isdigit()), None)
+        return ReportReq(kind="yield", batch_id=int(batch) if batch else None)
+    if kind in ("orders", "pending"):
+        # report orders [order=]12
+        order = m.get("order") or next((t.lstrip("#") for t in tokens[2:] if t.lstrip("#").isdigit()), None)
+        return ReportReq(kind="orders", order_id=int(order) if order else None)
+    if kind in ("dues", "due", "outstanding"):
+        # report dues [customer=Ravi]
+        return ReportReq(kind="dues", customer_name=m.get("customer") or " ".join(tokens[2:]) or None)
+    return ReportReq(kind=kind)
+
+
+# first word of a structured command -> builder
+RULES = {
+    "stockin": _rule_stockin, "stock-in": _rule_stockin,
+    "produce": _rule_production, "production": _rule_production,
+    "order": _rule_order,
+    "deliver": _rule_delivery, "dispatch": _rule_delivery,
+    "payment": _rule_payment,
+    "report": _rule_report,
+}
+
+
 def rule_parse(text: str) -> Optional[Dict[str, Any]]:
     raw = text.strip()
     if not raw:
         return None
 
     tokens = raw.split()
-    head = tokens[0].lower()
-    m = kv(raw)
+    builder = RULES.get(tokens[0].lower())
+    if builder is None:
+        return None
 
     try:
-        if head in ("stockin", "stock-in"):
-            vol = None
-            if "volume" in m:
-                mv = re.fullmatch(r"(\d+(?:\.\d+)?)(?:cft)?", m["volume"].lower())
-                if not mv:
-                    return None
-                vol = float(mv.group(1))
-
-            return StockIn(
-                supplier_name=m.get("supplier") or m.get("from") or "Unknown",
-                qty_logs=int(m.get("qty") or m.get("logs") or 0),
-                volume_cft=vol,
-                date_str=m.get("date")
-            ).dict()
-
-        if head in ("produce", "production"):
-            if "size" in m:
-                tmm, wmm, lmm = parse_size_to_mm(m["size"])
-            else:
-                tmm = _to_mm(float(m["thickness"]), m.get("t_unit"))
-                wmm = _to_mm(float(m["width"]), m.get("w_unit"))
-                lmm = _to_mm(float(m["length"]), m.get("l_unit")) if "length" in m else None
-
-            return Production(
-                batch_id=int(m.get("batch") or 0),
-                thickness_mm=tmm,
-                width_mm=wmm,
-                length_mm=lmm,
-                qty=int(m.get("output") or m.get("qty") or 0),
-                date_str=m.get("date")
-            ).dict()
-
-        if head == "order":
-            size_text = m.get("size") or m.get("item")
-            tmm = wmm = lmm = None
-            if size_text:
-                try:
-                    tmm, wmm, lmm = parse_size_to_mm(size_text)
-                except Exception:
-                    pass
-            return Order(
-                customer_name=m.get("customer") or "",
-                qty=int(m.get("qty") or 0),
-                size_label=size_text,
-                thickness_mm=tmm,
-                width_mm=wmm,
-                length_mm=lmm,
-                date_str=m.get("date")
-            ).dict()
-
-        if head in ("deliver", "dispatch"):
-            return Delivery(
-                order_id=int(m.get("order") or 0),
-                lorry_number=m.get("lorry") or "",
-                date_str=m.get("date")
-            ).dict()
-
-        if head == "payment":
-            return Payment(
-                order_id=int(m.get("order") or 0),
-                amount=float(m.get("amount") or 0),
-                method=m.get("method"),
-                date_str=m.get("date")
-            ).dict()
-
-        if head == "report":
-            kind = m.get("kind") or (tokens[1] if len(tokens) > 1 else "daily")
-            return ReportReq(kind=kind).dict()
-
+        model = builder(kv(raw), tokens)
     except Exception as e:
-        print("rule_parse error:", e)
+        log.debug("rule_parse error: %s", e)
         return None
+    return model.model_dump() if model is not None else None
+
+
+# --- bulk import records ----------------------------------------------------
+# One CSV row / JSONL object per write (app.services.importer). Columns are
+# the schema field names or the rule-parser keys (supplier, qty, size, ...).
+
+IMPORT_MODELS = {"STOCK_IN": StockIn, "PRODUCTION": Production, "ORDER": Order, "DELIVERY": Delivery,
+                 "PAYMENT": Payment}
+_IMPORT_TYPES = {"stockin": "STOCK_IN", "stock_in": "STOCK_IN", "production": "PRODUCTION", "order": "ORDER",
+                 "delivery": "DELIVERY", "deliver": "DELIVERY", "dispatch": "DELIVERY", "payment": "PAYMENT"}
+_IMPORT_COLUMNS = {"supplier": "supplier_name", "from": "supplier_name", "customer": "customer_name",
+                   "logs": "qty_logs", "volume": "volume_cft", "batch": "batch_id", "order": "order_id",
+                   "lorry": "lorry_number", "output": "qty", "date": "date_str"}
+
+
+def import_type(name: Any) -> Optional[str]:
+    """Write type for a ``type`` column value or caption word ("stockin", "STOCK_IN", ...)."""
+    return _IMPORT_TYPES.get(str(name or "").strip().lower())
+
+
+def parse_record(record: Dict[str, Any], default_type: Optional[str] = None) -> Dict[str, Any]:
+    """Validate one imported record into a write payload; raises ValueError on bad rows."""
+    m: Dict[str, Any] = {}
+    for k, v in record.items():
+        # csv.DictReader files surplus cells under the key None
+        if k is None or v is None or (isinstance(v, str) and not v.strip()):
+            continue
+        k = str(k).strip().lower()
+        m[_IMPORT_COLUMNS.get(k, k)] = v.strip() if isinstance(v, str) else v
+    kind = import_type(m.pop("type", None)) or default_type
+    if kind not in IMPORT_MODELS:
+        raise ValueError("missing or unknown type")
+    if "size" in m:
+        size = str(m.pop("size"))
+        m["thickness_mm"], m["width_mm"], m["length_mm"] = parse_size_to_mm(size)
+        if kind == "ORDER":
+            m.setdefault("size_label", size)
+    for k in ("amount", "rate", "volume_cft"):
+        if isinstance(m.get(k), str):
+            m[k] = m[k].replace(",", "")
+    if kind == "ORDER" and "amount" not in m and "rate" in m:
+        m["amount"] = float(m["rate"]) * int(m.get("qty") or 0)
+    # the writer would stamp an unreadable date with "now"; a ledger row must keep its own date
+    if "date_str" in m and parse_date(str(m["date_str"])) is None:
+        raise ValueError(f"unreadable date {m['date_str']!r}")
+    return IMPORT_MODELS[kind](**m).model_dump()
+
+
+# --- natural-language fast path ---------------------------------------------
+# Deterministic extractors for the common free-text phrasings of each type.
+# Each returns (payload, confidence); only text that no extractor is confident
+# about needs to go to the LLM.
+
+_NUM = r'(\d[\d,]*(?:\.\d+)?)'
+_SIZE_RE = re.compile(
+    r'(\d+(?:\.\d+)?\s*(?:mm|cm|m|in|inch|inches|ft|foot|feet|["\'])?'
+    r'(?:\s*[x×*]\s*\d+(?:\.\d+)?\s*(?:mm|cm|m|in|inch|inches|ft|foot|feet|["\'])?){1,2})(?![\w.])',
+    re.I)
+_LOGS_RE = re.compile(_NUM + r'\s*(?:nos\.?\s*)?logs?\b', re.I)
+_CFT_RE = re.compile(_NUM + r'\s*(?:cft|cu\.?\s*ft|cubic\s*f(?:ee|oo)t)\b', re.I)
+_FROM_RE = re.compile(r"\bfrom\s+([A-Za-z][\w.&'-]*(?:\s+[A-Z][\w.&'-]*)*)")
+_SUPPLIER_VERB_RE = re.compile(
+    r"^\s*([A-Za-z][\w.&'-]*(?:\s+[A-Z][\w.&'-]*)*)\s+(?:has\s+)?(?:sent|delivered|supplied|brought|dropped)\b")
+_BATCH_RE = re.compile(r'\bbatch\s*(?:no\.?|number|#)?\s*(\d+)\b', re.I)
+_PIECES_RE = re.compile(_NUM + r'\s*(?:planks?|pcs\.?|pieces?|nos\.?|boards?|beams?|battens?)\b', re.I)
+_CUT_RE = re.compile(r'\b(?:cut|sawn|sawed|sawing|produced|made|milled|processed)\b', re.I)
+_ORDER_VERB_RE = re.compile(
+    r"^\s*([A-Za-z][\w.&'-]*(?:\s+[A-Z][\w.&'-]*)*)\s+(?:has\s+)?(?:ordered|wants|needs|booked|placed an order for)\b")
+_ORDER_FOR_RE = re.compile(r"\border\s+(?:from|for|by)\s+([A-Za-z][\w.&'-]*(?:\s+[A-Z][\w.&'-]*)*)", re.I)
+_ORDER_ID_RE = re.compile(r'\border\s*(?:no\.?|number|id)?\s*#?\s*(\d+)\b', re.I)
+_LORRY_RE = re.compile(
+    r'\b(?:lorry|truck|vehicle|tempo)\s*(?:no\.?|number|#)?\s*[:\-]?\s*'
+    r'([A-Z]{2}[\s-]?\d{1,2}[\s-]?[A-Z]{0,3}[\s-]?\d{1,4})\b', re.I)
+_DISPATCH_RE = re.compile(r'\b(?:dispatch(?:ed)?|deliver(?:ed|y)?|sent|shipped|loaded)\b', re.I)
+_AMOUNT_RE = re.compile(r'(?:rs\.?|inr|₹)\s*' + _NUM + r'|' + _NUM + r'\s*(?:rs\.?|rupees|inr|/-)', re.I)
+# a per-piece price: "at Rs 300 each", "300/- per plank", "rate 300", "@ 300"
+_RATE_RE = re.compile(
+    r'(?:\brate\s*(?:of|is|:|=)?|@)\s*(?:rs\.?|inr|₹)?\s*' + _NUM +
+    r'|(?:(?:rs\.?|inr|₹)\s*)?' + _NUM + r'\s*(?:rs\.?|rupees|inr|/-)?\s*'
+    r'(?:each|apiece|a piece|per\s+(?:piece|pc|plank|board|beam|batten|no)s?|/\s*(?:pcs?|piece|plank|no))\b', re.I)
+_PER_UNIT_RE = re.compile(r'\b(?:each|apiece|per|rate)\b|@', re.I)
+_PAID_RE = re.compile(r'\b(?:paid|received|receipt|payment|got)\b(?:\s+(?:of|rs\.?|inr|₹))*\s*' + _NUM, re.I)
+_METHOD_RE = re.compile(r'\b(cash|upi|gpay|phonepe|paytm|cheque|check|neft|rtgs|imps|bank|card)\b', re.I)
+_REPORT_RE = re.compile(r'\b(report|summary|status|totals?|how many|stock position)\b', re.I)
+_KIND_RE = re.compile(r'\b(daily|today|weekly|week|monthly|month|stock|inventory|yield)\b', re.I)
+_STOCK_Q_RE = re.compile(r'\b(how many|in stock|stock|on hand|available|free|left|inventory)\b', re.I)
+_YIELD_RE = re.compile(r'\byield\b', re.I)
+_OPEN_ORDERS_RE = re.compile(r'\b(?:pending|open|undelivered|outstanding)\s+orders?\b', re.I)
+_DUES_RE = re.compile(r'\b(?:dues?|owes?|owing|outstanding|balance)\b', re.I)
+_DUES_FOR_RE = re.compile(r"\b(?:dues?|balance|outstanding)\s+(?:of|for|from)\s+([A-Za-z][\w.&'-]*(?:\s+[A-Z][\w.&'-]*)*)")
+_OWES_RE = re.compile(r"^\s*(?:how much (?:does|do)\s+)?([A-Za-z][\w.&'-]*(?:\s+[A-Z][\w.&'-]*)*)\s+(?:owes?|still owes?)\b")
+_DATE_RE = re.compile(r'\b(\d{4}-\d{2}-\d{2})\b')
+_NAME_STOP = {"today", "yesterday", "batch", "order", "the", "our", "us", "me", "we", "i", "lorry", "truck"}
+
+_KINDS = {"daily": "daily", "today": "daily", "weekly": "weekly", "week": "weekly",
+          "monthly": "monthly", "month": "monthly", "stock": "stock", "inventory": "stock", "yield": "yield"}
+
+
+def _num(s: str) -> float:
+    return float(s.replace(",", ""))
+
+
+def _name(m) -> Optional[str]:
+    if not m:
+        return None
+    words = m.group(1).split()
+    while words and words[-1].lower() in _NAME_STOP:
+        words.pop()
+    if not words or words[0].lower() in _NAME_STOP:
+        return None
+    return " ".join(words).strip(".,")
+
+
+def _date(text: str) -> Optional[str]:
+    m = _DATE_RE.search(text)
+    return m.group(1) if m else None
+
+
+def _nl_stockin(text: str):
+    m = _LOGS_RE.search(text)
+    if not m:
+        return None
+    supplier = _name(_FROM_RE.search(text)) or _name(_SUPPLIER_VERB_RE.search(text))
+    cft = _CFT_RE.search(text)
+    payload = StockIn(
+        supplier_name=supplier or "Unknown",
+        qty_logs=int(_num(m.group(1))),
+        volume_cft=_num(cft.group(1)) if cft else None,
+        date_str=_date(text),
+    ).model_dump()
+    return payload, 0.95 if supplier else 0.6
+
+
+def _nl_production(text: str):
+    size = _SIZE_RE.search(text)
+    qty = _PIECES_RE.search(text)
+    batch = _BATCH_RE.search(text)
+    if not (size and qty) or not (_CUT_RE.search(text) or batch):
+        return None
+    tmm, wmm, lmm = parse_size_to_mm(size.group(1))
+    payload = Production(
+        batch_id=int(batch.group(1)) if batch else 0,
+        thickness_mm=tmm, width_mm=wmm, length_mm=lmm,
+        qty=int(_num(qty.group(1))),
+        date_str=_date(text),
+    ).model_dump()
+    # production without a batch cannot be traced back to a stock_in row
+    return payload, 0.95 if batch else 0.5
+
+
+def _nl_order(text: str):
+    customer = _name(_ORDER_VERB_RE.search(text)) or _name(_ORDER_FOR_RE.search(text))
+    if not customer:
+        return None
+    qty = _PIECES_RE.search(text)
+    size = _SIZE_RE.search(text)
+    if not qty:
+        # "Ravi ordered 100 2x4": first number that is not part of the size
+        rest = _SIZE_RE.sub(" ", text)
+        qty = re.search(r'\b' + _NUM + r'\b', rest)
+    if not qty:
+        return None
+    tmm = wmm = lmm = None
+    size_label = size.group(1).replace(" ", "") if size else None
+    if size_label:
+        tmm, wmm, lmm = parse_size_to_mm(size_label)
+    n = int(_num(qty.group(1)))
+    # the order total, as _rule_order does for rate=: a per-piece price is
+    # multiplied out; per-unit wording we cannot pin to a number sets nothing
+    rate = _RATE_RE.search(text)
+    amt = _AMOUNT_RE.search(text)
+    amount = None
+    if rate:
+        amount = _num(rate.group(1) or rate.group(2)) * n
+    elif amt and not _PER_UNIT_RE.search(text):
+        amount = _num(amt.group(1) or amt.group(2))
+    payload = Order(
+        customer_name=customer,
+        qty=n,
+        size_label=size_label,
+        thickness_mm=tmm, width_mm=wmm, length_mm=lmm,
+        amount=amount,
+        date_str=_date(text),
+    ).model_dump()
+    return payload, 0.9 if size_label else 0.75
+
+
+def _nl_delivery(text: str):
+    lorry = _LORRY_RE.search(text)
+    order = _ORDER_ID_RE.search(text)
+    if not (lorry and order and _DISPATCH_RE.search(text)):
+        return None
+    qty = _PIECES_RE.search(text)
+    payload = Delivery(
+        order_id=int(order.group(1)),
+        lorry_number=re.sub(r'[\s-]', '', lorry.group(1)).upper(),
+        qty=int(_num(qty.group(1))) if qty else None,
+        date_str=_date(text),
+    ).model_dump()
+    return payload, 0.95
+
+
+def _nl_payment(text: str):
+    amt = _AMOUNT_RE.search(text)
+    amount = (amt.group(1) or amt.group(2)) if amt else None
+    if amount is None:
+        paid = _PAID_RE.search(text)
+        amount = paid.group(1) if paid else None
+    if amount is None:
+        return None
+    order = _ORDER_ID_RE.search(text)
+    method = _METHOD_RE.search(text)
+    if not order and not (amt or method):
+        return None
+    payload = Payment(
+        order_id=int(order.group(1)) if order else 0,
+        amount=_num(amount),
+        method=method.group(1).lower() if method else None,
+        date_str=_date(text),
+    ).model_dump()
+    # an unattached payment needs a human (or the LLM) to pick the order
+    return payload, 0.9 if order else 0.5
+
+
+def _nl_report(text: str):
+    if not _REPORT_RE.search(text):
+        return None
+    dates = _REPORT_DATE_RE.findall(text)
+    if dates:
+        return ReportReq(kind="custom", start=dates[0], end=dates[-1]).model_dump(), 0.9
+    if re.search(r'\d', text):
+        return None
+    kind = _KIND_RE.search(text)
+    payload = ReportReq(kind=_KINDS[kind.group(1).lower()] if kind else "daily").model_dump()
+    return payload, 0.9
+
+
+def _nl_inventory(text: str):
+    """"how many 2x4x12 do we have free", "yield of batch 12"."""
+    if _YIELD_RE.search(text):
+        batch = _BATCH_RE.search(text)
+        return ReportReq(kind="yield", batch_id=int(batch.group(1)) if batch else None).model_dump(), 0.95
+    size = _SIZE_RE.search(text)
+    if not (size and _STOCK_Q_RE.search(text)):
+        return None
+    parse_size_to_mm(size.group(1))
+    payload = ReportReq(kind="stock", size=size.group(1).replace(" ", "")).model_dump()
+    # a piece count or cut verb reads more like an order or production line
+    rest = _SIZE_RE.sub(" ", text)
+    return payload, 0.6 if (_PIECES_RE.search(rest) or _CUT_RE.search(rest)) else 0.9
+
+
+def _nl_orders(text: str):
+    """"pending orders", "dues of Ravi", "how much does Ravi owe"."""
+    if re.search(r'\d', text):
+        return None
+    if _OPEN_ORDERS_RE.search(text):
+        return ReportReq(kind="orders").model_dump(), 0.9
+    if not _DUES_RE.search(text):
+        return None
+    customer = _name(_DUES_FOR_RE.search(text)) or _name(_OWES_RE.search(text))
+    if customer and customer.lower() in ("who", "what", "how", "much"):
+        customer = None
+    return ReportReq(kind="dues", customer_name=customer).model_dump(), 0.9
+
+
+# order matters: "logs" wins over delivery verbs ("Kumar delivered 40 logs"),
+# and lorry/order-number delivery wins over the payment amount heuristics
+_NL_EXTRACTORS = (_nl_stockin, _nl_delivery, _nl_production, _nl_payment, _nl_order, _nl_inventory, _nl_orders, _nl_report)
+
+
+def nl_parse(text: str) -> Optional[Tuple[Dict[str, Any], float]]:
+    """Best natural-language match as (payload, confidence), or None."""
+    best = None
+    for extract in _NL_EXTRACTORS:
+        try:
+            res = extract(text)
+        except Exception:
+            # schema validation / size errors just mean "not this type"
+            continue
+        if res and (best is None or res[1] > best[1]):
+            best = res
+            if best[1] >= 0.95:
+                break
+    return best
+
+
+PARSE_STATS: Counter = Counter()
+
+
+def fast_parse(text: str, min_confidence: float = 0.75) -> Tuple[Optional[Dict[str, Any]], float]:
+    """Structured commands first, then the NL extractors; (None, conf) means "ask the LLM".
+
+    Per-type hit counters land in PARSE_STATS (see parse_stats()).
+    """
+    parsed = rule_parse(text)
+    if parsed:
+        PARSE_STATS["rule:" + parsed["type"]] += 1
+        return parsed, 1.0
+    res = nl_parse(text)
+    if res and res[1] >= min_confidence:
+        PARSE_STATS["nl:" + res[0]["type"]] += 1
+        return res
+    PARSE_STATS["escalated"] += 1
+    return None, res[1] if res else 0.0
+
+
+def parse_stats() -> Dict[str, Any]:
+    total = sum(PARSE_STATS.values())
+    absorbed = total - PARSE_STATS["escalated"]
+    return {"total": total, "fast_path_ratio": round(absorbed / total, 4) if total else None,
+            "by_path": dict(PARSE_STATS)}
+
 
-    return None
+def parse_batch(texts: Iterable[str], min_confidence: float = 0.75) -> List[Tuple[Optional[Dict[str, Any]], float]]:
+    """fast_parse over many messages in one call (e.g. a pasted multi-line message)."""
+    return [fast_parse(t, min_confidence) for t in texts]
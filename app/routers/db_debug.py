@@ -1,5 +1,4 @@
 # app/routers/debug_db.py
-import sqlite3
 from fastapi import APIRouter, Request, HTTPException
 from ..config import settings
 import logging
@@ -9,27 +8,53 @@ log = logging.getLogger("sawmill.debug")
 router = APIRouter(prefix="/debug", tags=["debug"])
 
 @router.get("/db")
-def debug_db(request: Request):
+async def debug_db(request: Request):
     # protect with the same secret as the webhook
     secret = request.headers.get("X-Debug-Secret")
     if settings.TELEGRAM_WEBHOOK_SECRET and secret != settings.TELEGRAM_WEBHOOK_SECRET:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    # Use the DB path from settings
-    db_path = getattr(settings, "DB_PATH", "sawmill_mvp.db")
+    # through the app's pool, so DATABASE_URL is honoured; full ledgers are under /export
+    from ..db import USE_POSTGRES, export_page, table_names
+    from ..services.executor import run_db
     try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        # show latest 10 stock_in entries and basic table list
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [r[0] for r in cur.fetchall()]
-        cur.execute("PRAGMA table_info(stock_in)")
-        schema = cur.fetchall()
-        cur.execute("SELECT batch_id, supplier_id, qty_logs, volume_cft, date FROM stock_in ORDER BY batch_id DESC LIMIT 10")
-        rows = cur.fetchall()
-        conn.close()
+        tables = await run_db(table_names)
+        cols, rows = await run_db(export_page, "stock_in", limit=10, newest_first=True)
     except Exception as e:
         log.exception("debug_db read error: %s", e)
         raise HTTPException(status_code=500, detail="DB read error")
 
-    return {"db_path": db_path, "tables": tables, "stock_in_schema": schema, "stock_in_rows": rows}
+    return {"backend": "postgres" if USE_POSTGRES else "sqlite", "db_path": None if USE_POSTGRES else settings.DB_PATH,
+            "tables": tables, "stock_in_columns": cols, "stock_in_rows": rows}
+
+
+@router.get("/stats")
+def debug_stats(request: Request):
+    secret = request.headers.get("X-Debug-Secret")
+    if settings.TELEGRAM_WEBHOOK_SECRET and secret != settings.TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    from ..services.executor import executor_stats
+    from ..services.send_queue import outbox
+    from ..services.parse_cache import parse_cache
+    from ..services.openai_parser import llm_stats
+    from ..parsing import parse_stats
+    from ..services.dedup import dedup_stats
+    from ..services.write_batcher import writes
+    from ..services.inbox import inbox
+    from ..services.poller import poller
+    from ..services.importer import importer
+    return {"executors": executor_stats(), "send_queue": outbox.stats(), "parse_cache": parse_cache.stats(),
+            "llm": llm_stats(), "parsing": parse_stats(), "dedup": dedup_stats(), "writes": writes.stats(),
+            "inbox": inbox.stats(), "poller": poller.stats(), "imports": importer.stats()}
+
+
+@router.get("/inbox")
+async def debug_inbox(request: Request):
+    """Inbox depth by status and how long the oldest pending update has waited."""
+    secret = request.headers.get("X-Debug-Secret")
+    if settings.TELEGRAM_WEBHOOK_SECRET and secret != settings.TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    from ..services.inbox import inbox
+    return await inbox.lag()
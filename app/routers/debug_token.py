@@ -1,7 +1,7 @@
 # app/routers/debug_token.py
-import httpx
 from fastapi import APIRouter, Request, HTTPException
 from ..config import settings
+from ..services.telegram import tg_call
 import logging
 
 log = logging.getLogger("sawmill.debug_token")
@@ -15,13 +15,11 @@ async def debug_getme(request: Request):
     token = (settings.TELEGRAM_BOT_TOKEN or "").strip()
     if not token:
         return {"ok": False, "error": "token-empty"}
-    api = f"https://api.telegram.org/bot{token}"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(f"{api}/getMe")
-        try:
-            body = r.json()
-        except Exception:
-            body = r.text
+    r = await tg_call("getMe", timeout=10.0)
+    try:
+        body = r.json()
+    except Exception:
+        body = r.text
     return {"status_code": r.status_code, "body": body, "masked_token": (token[:6] + "..." + token[-4:]) if len(token) > 8 else token, "token_len": len(token)}
 
 @router.post("/test_send")
@@ -35,11 +33,9 @@ async def debug_test_send(request: Request):
     token = (settings.TELEGRAM_BOT_TOKEN or "").strip()
     if not token:
         return {"ok": False, "error": "token-empty"}
-    api = f"https://api.telegram.org/bot{token}"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.post(f"{api}/sendMessage", json={"chat_id": chat_id, "text": text})
-        try:
-            body = r.json()
-        except Exception:
-            body = r.text
+    r = await tg_call("sendMessage", {"chat_id": chat_id, "text": text}, timeout=10.0)
+    try:
+        body = r.json()
+    except Exception:
+        body = r.text
     return {"status_code": r.status_code, "body": body, "masked_token": (token[:6] + "..." + token[-4:]) if len(token) > 8 else token, "token_len": len(token)}
@@ -0,0 +1,75 @@
+# app/routers/exports.py
+import csv
+import hmac
+import io
+import json
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from ..config import settings
+from ..db import EXPORTS, export_page
+from ..dates import BadDate, report_window
+from ..services.executor import run_export
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+
+
+def _authorize(request: Request):
+    token = (settings.EXPORT_API_TOKEN or "").strip()
+    header = request.headers.get("Authorization") or ""
+    if not token or not hmac.compare_digest(header.encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+def _encode(fmt: str, cols: list, rows: list) -> bytes:
+    if fmt == "jsonl":
+        return "".join(json.dumps(dict(zip(cols, r)), ensure_ascii=False, default=str) + "\n"
+                       for r in rows).encode()
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode()
+
+
+async def _stream(name: str, fmt: str, start: str | None, end: str | None):
+    """Yield the export page by page; the next page is read only once the client has taken this one."""
+    after, first = None, True
+    while True:
+        cols, rows = await run_export(export_page, name, after, start, end, settings.EXPORT_PAGE_ROWS)
+        if first and fmt == "csv":
+            yield _encode(fmt, cols, [cols])
+        first = False
+        if rows:
+            yield _encode(fmt, cols, rows)
+        if len(rows) < settings.EXPORT_PAGE_ROWS:
+            return
+        after = rows[-1][0]
+
+
+@router.get("")
+def list_exports(request: Request):
+    _authorize(request)
+    return {"exports": sorted(EXPORTS), "formats": sorted(MEDIA_TYPES),
+            "dated": sorted(name for name, (_sql, _key, date_col) in EXPORTS.items() if date_col)}
+
+
+@router.get("/{name}")
+async def export_ledger(name: str, request: Request, format: str = "csv", start: str | None = None,
+                        end: str | None = None):
+    """Stream a table or joined view as CSV / JSONL; ``start``/``end`` (inclusive) filter dated exports."""
+    _authorize(request)
+    if name not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"unknown export {name!r}")
+    fmt = format.lower()
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+    lo = hi = None
+    if start or end:
+        if EXPORTS[name][2] is None:
+            raise HTTPException(status_code=400, detail=f"{name} has no date column")
+        try:
+            _label, lo, hi = report_window("custom", start, end)
+        except BadDate as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(_stream(name, fmt, lo, hi), media_type=MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'})
@@ -0,0 +1,44 @@
+# app/routers/imports.py
+import hmac
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import FileResponse
+from ..config import settings
+from ..parsing import import_type
+from ..services.importer import importer, detect_format
+
+router = APIRouter(prefix="/import", tags=["import"])
+
+
+def _authorize(request: Request):
+    token = (settings.IMPORT_API_TOKEN or "").strip()
+    header = request.headers.get("Authorization") or ""
+    if not token or not hmac.compare_digest(header.encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@router.post("")
+async def import_ledger(request: Request, format: str | None = None, type: str | None = None):
+    """Import a CSV / JSONL body streamed as-is (not multipart), e.g.
+    ``curl --data-binary @ledger.csv -H "Content-Type: text/csv" .../import?type=stockin``."""
+    _authorize(request)
+    fmt = detect_format(format, request.headers.get("Content-Type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="send text/csv or application/x-ndjson, or pass ?format=")
+    default_type = import_type(type)
+    if type and default_type is None:
+        raise HTTPException(status_code=400, detail=f"unknown type {type!r}")
+    job = await importer.run(request.stream(), fmt, default_type)
+    summary = job.summary()
+    if job.rejected:
+        summary["error_report"] = f"/import/{job.id}/errors"
+    return summary
+
+
+@router.get("/{import_id}/errors")
+def import_errors(import_id: str, request: Request):
+    """Rejected rows of an import as CSV: line, error, record."""
+    _authorize(request)
+    path = importer.report_path(import_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="no error report for this import")
+    return FileResponse(path, media_type="text/csv", filename=f"import-{import_id}-errors.csv")
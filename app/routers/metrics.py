@@ -0,0 +1,19 @@
+# app/routers/metrics.py
+import hmac
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import PlainTextResponse
+from ..config import settings
+from ..metrics import render
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+def metrics(request: Request):
+    """Prometheus scrape endpoint; needs ``Authorization: Bearer $METRICS_TOKEN`` when that is set."""
+    token = (settings.METRICS_TOKEN or "").strip()
+    if token:
+        header = request.headers.get("Authorization") or ""
+        if not hmac.compare_digest(header.encode(), f"Bearer {token}".encode()):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,45 +1,246 @@
+import asyncio
 import logging
 from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
 from ..config import settings
-from ..parsing import rule_parse
+from ..parsing import fast_parse, parse_batch, parse_size_to_mm
 from ..services.openai_parser import llm_parse_free_text
+from ..services.parse_cache import cached_llm_parse
 from ..services.telegram import tg_send, tg_send_sync
-from ..db import (
-    insert_stockin, insert_production, insert_order,
-    insert_delivery, insert_payment, is_update_processed, mark_update_processed, db_conn
-)
+from ..services.executor import run_db
+from ..services import dedup
+from ..services.write_batcher import writes
+from ..services.inbox import inbox
+from ..services.importer import importer
+from ..db import apply_batch, report_totals, report_window, inventory_stock, batch_yield, order_summary, open_orders, customer_dues
+from ..dates import BadDate, report_window as report_bounds, describe_window
+from ..metrics import REPORT, STAGE, UPDATES_INFLIGHT, start_trace, trace_id
 
 log = logging.getLogger("sawmill.router")
 
 router = APIRouter(prefix="/tg", tags=["telegram"])
 
 
-def parse_text_sync(text: str) -> dict:
-    parsed = rule_parse(text)
-    if not parsed:
-        parsed = llm_parse_free_text(text)
+def _checked_payload(parsed) -> dict:
     # normalize type key safety
     t = parsed.get("type") if isinstance(parsed, dict) else None
     if t not in {"STOCK_IN", "PRODUCTION", "ORDER", "DELIVERY", "PAYMENT", "REPORT"}:
         # return a safe REPORT fallback instead of raising
-        log.warning("parse_text_sync: unrecognized or missing type in parser output (%r). Falling back to REPORT.", parsed)
+        log.warning("parse_text: unrecognized or missing type in parser output (%r). Falling back to REPORT.", parsed)
         return {"type": "REPORT", "kind": "daily"}
     return parsed
 
 
-async def process_update(update: dict):
-    """Background processing of a Telegram update. Called async."""
+async def parse_text(text: str) -> dict:
+    """Rule/NL fast path on the loop (microseconds); otherwise the cached async LLM path."""
+    with STAGE.time("rule_parse"):
+        parsed, _confidence = fast_parse(text, settings.NL_MIN_CONFIDENCE)
+    if not parsed:
+        parsed = await cached_llm_parse(text)
+    return _checked_payload(parsed)
+
+
+async def stock_report(size: str | None) -> str:
+    if not size:
+        rows = await run_db(inventory_stock)
+        rows = [r for r in rows if r["on_hand"] or r["reserved"]]
+        if not rows:
+            return "No planks in stock."
+        lines = [f"{r['size']}: {r['on_hand']} on hand, {r['free']} free" for r in rows[:25]]
+        more = f"\n… and {len(rows) - 25} more sizes" if len(rows) > 25 else ""
+        return "Stock by size\n" + "\n".join(lines) + more
     try:
-        update_id = update.get("update_id")
-        if update_id and is_update_processed(update_id):
-            log.info("Skipping duplicate update %s", update_id)
-            return
+        t, w, l = parse_size_to_mm(size)
+    except ValueError:
+        return f"Could not read the size {size!r}. Try: report stock 2x4x12"
+    r = await run_db(inventory_stock, t, w, l)
+    if r is None:
+        return f"No {size} planks on record."
+    return (f"Stock {r['size']}\nOn hand: {r['on_hand']} | Reserved: {r['reserved']} | Free: {r['free']}\n"
+            f"Produced: {r['produced']} | Shipped: {r['shipped']}")
+
+
+async def yield_report(batch_id: int | None) -> str:
+    y = await run_db(batch_yield, batch_id)
+    if y is None:
+        return f"No record of batch #{batch_id}." if batch_id else "No batches recorded yet."
+    head = f"Batch #{batch_id} yield" if batch_id else "Yield (all batches)"
+    pct = f"{y['yield_pct']:g}%" if y["yield_pct"] is not None else "n/a"
+    return (f"{head}\nLogs in: {y['logs_in']} ({y['volume_in']:g} cft)\n"
+            f"Planks cut: {y['planks']} ({y['volume_out']:g} cft)\nYield: {pct} | Remaining: {y['remaining']:g} cft")
+
+
+def _money(v) -> str:
+    return f"{v:,.2f}".rstrip("0").rstrip(".") if v is not None else "n/a"
+
+
+async def orders_report(order_id: int | None) -> str:
+    if order_id:
+        o = await run_db(order_summary, order_id)
+        if o is None:
+            return f"No record of order #{order_id}."
+        return (f"Order #{o['order_id']} ({o['customer']}): {o['status']}\n"
+                f"Qty: {o['qty_ordered']} | Delivered: {o['qty_delivered']}\n"
+                f"Amount: {_money(o['amount'])} | Paid: {_money(o['amount_paid'])} | Due: {_money(o['due'])}")
+    rows = await run_db(open_orders)
+    if not rows:
+        return "No pending orders."
+    return "Pending orders\n" + "\n".join(f"#{o['order_id']} {o['customer']}: {o['qty_ordered']} pcs" for o in rows)
+
+
+async def dues_report(customer_name: str | None) -> str:
+    rows = await run_db(customer_dues, customer_name)
+    if not rows:
+        return f"Nothing outstanding for {customer_name}." if customer_name else "Nothing outstanding."
+    lines = [f"{r['customer']}: {_money(r['due'])} due over {r['open_orders']} open order(s)" for r in rows[:25]]
+    return "Customer dues\n" + "\n".join(lines)
+
+
+REPORT_KINDS = ("orders", "dues", "stock", "yield")
+
+
+async def build_report(payload: dict) -> str:
+    kind = (payload.get("kind") or "").lower()
+    # the window kinds (daily, weekly, custom, ...) share one series
+    with REPORT.time(kind if kind in REPORT_KINDS else "totals"):
+        return await _build_report(kind, payload)
+
+
+async def _build_report(kind: str, payload: dict) -> str:
+    if kind == "orders":
+        return await orders_report(payload.get("order_id"))
+    if kind == "dues":
+        return await dues_report(payload.get("customer_name"))
+    if kind == "stock":
+        return await stock_report(payload.get("size"))
+    if kind == "yield":
+        return await yield_report(payload.get("batch_id"))
+    try:
+        label, start, end = report_bounds(payload.get("kind"), payload.get("start"), payload.get("end"))
+    except BadDate as e:
+        what = f"the date {e.value!r}" if e.value else "the dates for that report"
+        return (f"Couldn't read {what}. Give the range as YYYY-MM-DD or DD/MM/YYYY, "
+                "e.g. report from=01/04/2024 to=30/04/2024")
+    if start is None and end is None:
+        totals = await run_db(report_totals)
+        return (f"All-time report\nLogs in: {totals['logs_in']} ({totals['volume_in']:g} cft)\n"
+                f"Planks cut: {totals['planks_cut']}\nOrders pending: {totals['orders_pending']}\n"
+                f"Payments received: {totals['payments_received']:g}")
+    w = await run_db(report_window, start, end)
+    return (f"{label} report ({describe_window(start, end)})\nLogs in: {w['logs_in']} ({w['volume_in']:g} cft)\n"
+            f"Planks cut: {w['planks_cut']}\nNew orders: {w['new_orders']} | Deliveries: {w['deliveries']}\n"
+            f"Payments received: {w['payments_received']:g}\nOrders pending (now): {w['orders_pending']}")
+
+
+WRITE_TYPES = ("STOCK_IN", "PRODUCTION", "ORDER", "DELIVERY", "PAYMENT")
+_BATCH_LABELS = {"STOCK_IN": "Stock in", "PRODUCTION": "Production", "ORDER": "Orders",
+                 "DELIVERY": "Deliveries", "PAYMENT": "Payments"}
+# field summed per type in the batch reply, and its unit
+_BATCH_TOTALS = {"STOCK_IN": ("qty_logs", "logs"), "PRODUCTION": ("qty", "pcs"), "ORDER": ("qty", "pcs"),
+                 "PAYMENT": ("amount", "paid")}
+
+
+async def parse_lines(text: str):
+    """``(lines, payloads)`` for a multi-line message, or None to treat it as one message.
+
+    All lines go through the rule/NL fast path in one ``parse_batch`` call;
+    only the lines it cannot read go to the LLM, concurrently and through
+    the parse cache. If no line parses on the fast path the text is more
+    likely one wrapped free-text message, so it is left to the normal path.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return None
+    with STAGE.time("rule_parse_batch"):
+        payloads = [p for p, _conf in parse_batch(lines, settings.NL_MIN_CONFIDENCE)]
+    if not any(payloads):
+        return None
+    todo = [i for i, p in enumerate(payloads) if not p]
+    results = await asyncio.gather(*(cached_llm_parse(lines[i]) for i in todo), return_exceptions=True)
+    for i, res in zip(todo, results):
+        if isinstance(res, Exception):
+            log.warning("LLM parse of batch line %s failed: %s", i + 1, res)
+        else:
+            payloads[i] = _checked_payload(res)
+    return lines, payloads
+
+
+def _id_range(ids: list) -> str:
+    ids = sorted(ids)
+    if len(ids) > 2 and ids[-1] - ids[0] == len(ids) - 1:
+        return f"#{ids[0]}–#{ids[-1]}"
+    more = f" +{len(ids) - 5} more" if len(ids) > 5 else ""
+    return ", ".join(f"#{i}" for i in ids[:5]) + more
+
+
+def batch_summary(lines: list, payloads: list, entries: list, ids: list) -> str:
+    """One reply for a whole multi-line message: per-type counts and ids, then the lines left out."""
+    by_type: dict[str, list] = {}
+    for (_n, p), rid in zip(entries, ids):
+        by_type.setdefault(p["type"], []).append((p, rid))
+    out = [f"✅ Recorded {len(entries)} of {len(lines)} lines" if entries else "Nothing recorded"]
+    for t in WRITE_TYPES:
+        if t not in by_type:
+            continue
+        rows = by_type[t]
+        detail = _id_range([rid for _p, rid in rows])
+        if t in _BATCH_TOTALS:
+            field, unit = _BATCH_TOTALS[t]
+            total = sum(p.get(field) or 0 for p, _rid in rows)
+            detail += f", {_money(total) if t == 'PAYMENT' else total} {unit}"
+        out.append(f"{_BATCH_LABELS[t]}: {len(rows)} ({detail})")
+    recorded = {n for n, _p in entries}
+    skipped = [(n, line, payloads[n]) for n, line in enumerate(lines) if n not in recorded]
+    if skipped:
+        out.append("Not recorded:")
+        for n, line, p in skipped[:10]:
+            why = "not a ledger entry" if p else "not understood"
+            out.append(f"{n + 1}: {line[:40]!r} ({why})")
+        if len(skipped) > 10:
+            out.append(f"… and {len(skipped) - 10} more")
+    return "\n".join(out)
+
+
+async def apply_batch_message(chat_id: int, message_id: int | None, lines: list, payloads: list,
+                              inbox_id: int | None = None):
+    """Write every ledger line of a multi-line message in one transaction and send one summary."""
+    entries = [(n, p) for n, p in enumerate(payloads) if p and p.get("type") in WRITE_TYPES]
+    ids = await run_db(apply_batch, [(p["type"], p) for _n, p in entries], inbox_id) if entries else []
+    await tg_send(chat_id, batch_summary(lines, payloads, entries, ids), reply_to_message_id=message_id)
+
+
+async def process_update(update: dict, inbox_id: int | None = None, final_attempt: bool = True):
+    """Process one Telegram update (inbox worker or background task).
+
+    Writes delete ``inbox_id`` in their own transaction. On failure the
+    claim is released and, on the final attempt, the user is told; inbox
+    workers (``inbox_id`` set) also get the exception back so they can
+    retry or dead-letter the row. Log lines of the update carry its trace
+    id (LOG_TRACE_IDS).
+    """
+    token = start_trace(update.get("update_id"))
+    UPDATES_INFLIGHT.inc()
+    try:
+        with STAGE.time("update"):
+            await _process_update(update, inbox_id, final_attempt)
+    finally:
+        UPDATES_INFLIGHT.dec()
+        trace_id.reset(token)
+
+
+async def _process_update(update: dict, inbox_id: int | None, final_attempt: bool):
+    update_id = update.get("update_id")
+    claimed = notified = False
+    try:
+        # claim up front: concurrent redeliveries of the same update cannot both pass
+        if update_id:
+            if not await dedup.claim(update_id):
+                log.info("Skipping duplicate update %s", update_id)
+                return
+            claimed = True
 
         msg = update.get("message") or update.get("edited_message")
         if not msg:
             log.debug("No message found in update: %s", update)
-            if update_id:
-                mark_update_processed(update_id)
             return
 
         # source ids
@@ -52,64 +253,66 @@ async def process_update(update: dict):
                  update_id, chat_id, from_user, incoming_msg_id,
                  (msg.get("text") or "")[:80])
 
+        if msg.get("document"):
+            # bulk import runs in the background and replies with a summary when done
+            await importer.accept_document(chat_id, incoming_msg_id, msg["document"], msg.get("caption"))
+            return
+
         text = (msg.get("text") or "").strip()
         if not text:
             await tg_send(chat_id, "Empty message received.", reply_to_message_id=incoming_msg_id)
-            if update_id:
-                mark_update_processed(update_id)
+            return
+
+        # a pasted shift report: one entry per line, committed together, one reply
+        batch = await parse_lines(text)
+        if batch is not None:
+            await apply_batch_message(chat_id, incoming_msg_id, *batch, inbox_id=inbox_id)
             return
 
         # try fast rule-based parse; fallback to LLM if needed
         payload = None
         try:
-            payload = parse_text_sync(text)
+            payload = await parse_text(text)
         except Exception as e:
-            log.exception("parse_text_sync raised exception; falling back to LLM: %s", e)
-            payload = llm_parse_free_text(text)
+            log.exception("parse_text raised exception; falling back to LLM: %s", e)
+            payload = await llm_parse_free_text(text)
 
         if not isinstance(payload, dict):
             log.warning("Parser returned non-dict payload: %r. Using REPORT fallback.", payload)
             payload = {"type": "REPORT", "kind": "daily"}
 
         t = payload.get("type")
-        # perform action per type (all DB writes are synchronous but quick)
+        # perform action per type (writes are group-committed on the DB pool)
         try:
             if t == "STOCK_IN":
-                batch_id = insert_stockin(payload)
+                batch_id = await writes.submit("STOCK_IN", payload, inbox_id=inbox_id)
                 reply = f"✅ Stock recorded. Batch #{batch_id} | Supplier: {payload.get('supplier_name')} | Logs: {payload.get('qty_logs')}"
                 await tg_send(chat_id, reply, reply_to_message_id=incoming_msg_id)
 
             elif t == "PRODUCTION":
-                rec_id = insert_production(payload)
-                reply = f"✅ Production logged. Batch {payload.get('batch_id')} | Qty {payload.get('qty')}"
+                rec_id = await writes.submit("PRODUCTION", payload, inbox_id=inbox_id)
+                reply = f"✅ Production #{rec_id} logged. Batch {payload.get('batch_id')} | Qty {payload.get('qty')}"
                 await tg_send(chat_id, reply, reply_to_message_id=incoming_msg_id)
 
             elif t == "ORDER":
-                order_id = insert_order(payload)
+                order_id = await writes.submit("ORDER", payload, inbox_id=inbox_id)
                 reply = f"✅ Order #{order_id} created for {payload.get('customer_name')} | Qty {payload.get('qty')}"
                 await tg_send(chat_id, reply, reply_to_message_id=incoming_msg_id)
 
             elif t == "DELIVERY":
-                did = insert_delivery(payload)
+                did = await writes.submit("DELIVERY", payload, inbox_id=inbox_id)
                 reply = f"✅ Delivery #{did} created for Order #{payload.get('order_id')} | Lorry {payload.get('lorry_number')}"
+                if payload.get("qty"):
+                    reply += f" | Qty {payload['qty']}"
                 await tg_send(chat_id, reply, reply_to_message_id=incoming_msg_id)
 
             elif t == "PAYMENT":
-                pid = insert_payment(payload)
+                pid = await writes.submit("PAYMENT", payload, inbox_id=inbox_id)
                 reply = f"✅ Payment #{pid} recorded for Order #{payload.get('order_id')} | Amount {payload.get('amount')}"
                 await tg_send(chat_id, reply, reply_to_message_id=incoming_msg_id)
 
             elif t == "REPORT":
-                with db_conn() as conn:
-                    c = conn.cursor()
-                    # use COALESCE for SQLite compatibility
-                    c.execute("SELECT COALESCE(SUM(qty_logs),0) FROM stock_in")
-                    logs = c.fetchone()[0]
-                    c.execute("SELECT COALESCE(SUM(qty),0) FROM stock_out")
-                    cut = c.fetchone()[0]
-                    c.execute("SELECT COUNT(1) FROM orders WHERE status='pending'")
-                    pending = c.fetchone()[0]
-                report = f"Daily report\nLogs in (all time): {logs}\nPlanks cut (all time): {cut}\nOrders pending: {pending}"
+                report = await build_report(payload)
                 await tg_send(chat_id, report, reply_to_message_id=incoming_msg_id)
 
             else:
@@ -117,20 +320,31 @@ async def process_update(update: dict):
                 log.warning("Unhandled payload type=%r payload=%r", t, payload)
                 await tg_send(chat_id, "I understood your message but couldn't classify it precisely. Please send a structured line like:\nstockin supplier=Kumar qty=50", reply_to_message_id=incoming_msg_id)
 
-            # mark processed only after successfully reaching this point
-            if update_id:
-                mark_update_processed(update_id)
-                log.info("Marked update %s processed", update_id)
-
         except Exception as e:
             log.exception("Error applying payload type=%s: %s", t, e)
+            # the write rolled back; let a redelivery try again
+            if claimed:
+                claimed = False
+                await dedup.release(update_id)
+            if not final_attempt:
+                raise
             # attempt best-effort notification to user
             try:
                 await tg_send(chat_id, "Could not apply the action due to an internal error.", reply_to_message_id=incoming_msg_id)
             except Exception:
                 log.exception("Failed to notify user about apply error")
+            notified = True
+            if inbox_id is not None:
+                raise
 
     except Exception as e:
+        if claimed:
+            try:
+                await dedup.release(update_id)
+            except Exception:
+                log.exception("Failed to release claim on update %s", update_id)
+        if not final_attempt or notified:
+            raise
         log.exception("Error processing update: %s", e)
         try:
             chat = update.get("message", {}).get("chat", {})
@@ -139,10 +353,17 @@ async def process_update(update: dict):
                 await tg_send(chat_id, "Could not process your message. Try: stockin supplier=Kumar qty=50", reply_to_message_id=update.get("message", {}).get("message_id"))
         except Exception:
             log.exception("Failed to notify user of processing error")
+        if inbox_id is not None:
+            raise
 
 
 @router.post("/webhook")
 async def tg_webhook(request: Request, background_tasks: BackgroundTasks):
+    with STAGE.time("webhook"):
+        return await _accept_webhook(request, background_tasks)
+
+
+async def _accept_webhook(request: Request, background_tasks: BackgroundTasks):
     # verify secret header quickly
     if settings.TELEGRAM_WEBHOOK_SECRET:
         header = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
@@ -150,6 +371,12 @@ async def tg_webhook(request: Request, background_tasks: BackgroundTasks):
             raise HTTPException(status_code=401, detail="bad secret")
 
     update = await request.json()
+    if settings.INBOX_ENABLED and inbox.running:
+        # persist before acknowledging; a 503 makes Telegram hold and retry the update
+        if inbox.saturated():
+            raise HTTPException(status_code=503, detail="inbox full")
+        await inbox.append(update)
+        return {"ok": True}
     # schedule background processing and return 200 fast
     background_tasks.add_task(process_update, update)
     return {"ok": True}
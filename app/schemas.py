@@ -25,12 +25,16 @@ class Order(BaseModel):
     thickness_mm: Optional[float] = Field(default=None, gt=0)
     width_mm: Optional[float] = Field(default=None, gt=0)
     length_mm: Optional[float] = Field(default=None, gt=0)
+    # agreed order value; what customer dues are measured against
+    amount: Optional[float] = Field(default=None, ge=0)
     date_str: Optional[str] = None
 
 class Delivery(BaseModel):
     type: str = "DELIVERY"
     order_id: int
     lorry_number: str
+    # units shipped; None delivers the rest of the order
+    qty: Optional[int] = Field(None, gt=0)
     date_str: Optional[str] = None
 
 class Payment(BaseModel):
@@ -43,3 +47,12 @@ class Payment(BaseModel):
 class ReportReq(BaseModel):
     type: str = "REPORT"
     kind: str = "daily"
+    # custom range bounds (any format app.dates.parse_date accepts); end is inclusive
+    start: Optional[str] = None
+    end: Optional[str] = None
+    # kind="stock": optional plank size ("2x4", "2x4x12"); kind="yield": optional batch
+    size: Optional[str] = None
+    batch_id: Optional[int] = None
+    # kind="orders": optional single order; kind="dues": optional customer
+    order_id: Optional[int] = None
+    customer_name: Optional[str] = None
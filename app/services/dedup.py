@@ -0,0 +1,102 @@
+# app/services/dedup.py
+"""Update de-duplication: atomic DB claim fronted by an in-memory recent-ID filter.
+
+Telegram redelivers an update until it gets a 200, and retry storms repeat the
+same few IDs. The recent set answers those without touching the DB; the
+``updates_processed`` claim stays authoritative across processes and
+restarts. A background pruner keeps that table from growing forever.
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from ..config import settings
+from ..db import claim_update, release_update, prune_updates_processed
+from .executor import run_db
+
+log = logging.getLogger("sawmill.dedup")
+
+
+class RecentIds:
+    """Bounded insertion-ordered set of recently claimed update IDs."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._ids: OrderedDict[int, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, update_id: int) -> bool:
+        with self._lock:
+            return update_id in self._ids
+
+    def add(self, update_id: int):
+        with self._lock:
+            self._ids[update_id] = None
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+    def discard(self, update_id: int):
+        with self._lock:
+            self._ids.pop(update_id, None)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+recent = RecentIds(settings.RECENT_UPDATES_SIZE)
+_stats = {"claimed": 0, "dup_memory": 0, "dup_db": 0, "released": 0, "pruned": 0}
+
+
+def dedup_stats() -> dict:
+    return {**_stats, "recent_size": len(recent)}
+
+
+async def claim(update_id: int) -> bool:
+    """True if this process now owns ``update_id``; False for a duplicate."""
+    if update_id in recent:
+        _stats["dup_memory"] += 1
+        return False
+    if not await run_db(claim_update, update_id):
+        recent.add(update_id)
+        _stats["dup_db"] += 1
+        return False
+    recent.add(update_id)
+    _stats["claimed"] += 1
+    return True
+
+
+async def release(update_id: int):
+    recent.discard(update_id)
+    await run_db(release_update, update_id)
+    _stats["released"] += 1
+
+
+async def prune_once() -> int:
+    """Delete expired claims in UPDATES_PRUNE_BATCH chunks, yielding between chunks
+    so webhook writes never wait behind one long delete."""
+    # ts is SQLite datetime('now'), i.e. naive UTC
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=settings.UPDATES_TTL_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+    total = 0
+    while True:
+        n = await run_db(prune_updates_processed, cutoff, settings.UPDATES_PRUNE_BATCH)
+        total += n
+        if n < settings.UPDATES_PRUNE_BATCH:
+            break
+        await asyncio.sleep(0.05)
+    if total:
+        _stats["pruned"] += total
+        log.info("Pruned %s processed-update claims older than %s", total, cutoff)
+    return total
+
+
+async def prune_forever():
+    while True:
+        try:
+            await prune_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("updates_processed prune failed")
+        await asyncio.sleep(settings.UPDATES_PRUNE_INTERVAL_SECONDS)
@@ -0,0 +1,108 @@
+# app/services/executor.py
+"""Dedicated thread pool for blocking DB work.
+
+``process_update`` runs on the event loop; anything that blocks (sqlite3 /
+psycopg2 calls) goes through ``run_db`` so a slow query cannot stall other
+webhooks or ``tg_send`` calls. OpenAI calls are native async and bounded by
+their own semaphore in ``openai_parser``. Exports read on their own small
+lane (``run_export``) so a long download never takes a worker a webhook
+write is waiting for. Lanes keep simple queue-depth counters for
+``/debug/stats``, and run each call in a copy of the caller's context so
+the update's trace id follows it onto the worker thread.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..config import settings
+
+log = logging.getLogger("sawmill.executor")
+
+
+class Lane:
+    """A named ThreadPoolExecutor that tracks queued/running/completed work."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self._pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix=f"sawmill-{self.name}")
+        return self._pool
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        loop = asyncio.get_running_loop()
+        try:
+            ctx = contextvars.copy_context()
+            fut = loop.run_in_executor(self._executor(), functools.partial(ctx.run, self._call, fn, args, kwargs))
+        except RuntimeError:
+            # executor already shut down: undo the queued count we just added
+            with self._lock:
+                self.queued -= 1
+            raise
+        return await fut
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "queued": self.queued, "running": self.running,
+                    "completed": self.completed, "failed": self.failed, "max_queued": self.max_queued}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+db_lane = Lane("db", settings.DB_WORKERS)
+export_lane = Lane("export", settings.EXPORT_WORKERS)
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking ``app.db`` call on the DB pool."""
+    return await db_lane.run(fn, *args, **kwargs)
+
+
+async def run_export(fn, *args, **kwargs):
+    """Run one export page read on the export lane."""
+    return await export_lane.run(fn, *args, **kwargs)
+
+
+def executor_stats() -> dict:
+    return {"db": db_lane.stats(), "export": export_lane.stats()}
+
+
+def shutdown_executors():
+    db_lane.shutdown()
+    export_lane.shutdown()
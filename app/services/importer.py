@@ -0,0 +1,280 @@
+# app/services/importer.py
+"""Bulk import of historical ledgers from CSV or JSONL files.
+
+A file arrives as a Telegram document (caption e.g. "import stockin") or as
+the raw body of ``POST /import``. It is decoded as a byte stream and split
+into records as it arrives; every IMPORT_CHUNK_ROWS records are validated
+(``parsing.parse_record``) and written by ``db.apply_writes`` in one
+transaction, one executemany per type. Only the current chunk is held in
+memory and rejected rows go straight to an error-report CSV on disk, so
+memory stays flat however long the file is.
+
+Every row carries its type in a ``type`` column, or the whole file takes
+the type named in the caption / ``?type=``. Imports run one at a time.
+"""
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import Counter
+
+from ..config import settings
+from ..db import apply_writes
+from ..parsing import parse_record, import_type
+from .executor import run_db
+from .telegram import tg_send, tg_send_document, tg_stream_file
+
+log = logging.getLogger("sawmill.importer")
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+_CONTENT_TYPES = {"text/csv": "csv", "application/x-ndjson": "jsonl", "application/jsonl": "jsonl",
+                  "application/json-lines": "jsonl"}
+# one record (a CSV row, quoted newlines included, or a JSON line) may not exceed this
+_MAX_RECORD_CHARS = 1 << 20
+_IMPORT_ID = re.compile(r"[0-9a-f]{12}")
+
+
+def detect_format(name: str | None = None, content_type: str | None = None) -> str | None:
+    """"csv" / "jsonl" from an explicit format, a file name or a Content-Type."""
+    name = (name or "").strip().lower()
+    if name in ("csv", "jsonl"):
+        return name
+    fmt = FORMATS.get(os.path.splitext(name)[1])
+    if fmt is None and content_type:
+        fmt = _CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+    return fmt
+
+
+def caption_type(caption: str | None) -> str | None:
+    """First word of a document caption that names a write type ("import orders" -> ORDER)."""
+    for word in (caption or "").split():
+        kind = import_type(word.rstrip("s")) or import_type(word)
+        if kind:
+            return kind
+    return None
+
+
+async def _lines(chunks):
+    """Decode a byte stream into lines (newline stripped) without holding more than one line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buf = ""
+    async for chunk in chunks:
+        buf += decoder.decode(chunk)
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+        if len(buf) > _MAX_RECORD_CHARS:
+            raise ValueError("line too long")
+    buf += decoder.decode(b"", final=True)
+    if buf:
+        yield buf.rstrip("\r")
+
+
+async def _records(chunks, fmt: str):
+    """Yield ``(line_no, raw, record)``; ``record`` is a dict or the exception that made it unreadable."""
+    if fmt == "jsonl":
+        n = 0
+        async for line in _lines(chunks):
+            n += 1
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+                if not isinstance(rec, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as e:
+                rec = e
+            yield n, line, rec
+        return
+    header, pending, start, n = None, [], 0, 0
+    async for line in _lines(chunks):
+        n += 1
+        if not pending:
+            start = n
+        pending.append(line)
+        # an odd number of quotes so far means a quoted field runs onto the next line
+        raw = "\n".join(pending)
+        if raw.count('"') % 2:
+            if len(raw) > _MAX_RECORD_CHARS:
+                raise ValueError(f"unterminated quote at line {start}")
+            continue
+        pending = []
+        if not raw.strip():
+            continue
+        try:
+            row = next(csv.reader([raw]))
+        except csv.Error as e:
+            yield start, raw, e
+            continue
+        if header is None:
+            header = [h.strip().lower() for h in row]
+            continue
+        rec = dict(zip(header, row))
+        if len(row) > len(header):
+            rec = ValueError(f"{len(row)} cells for {len(header)} columns")
+        yield start, raw, rec
+    if pending:
+        yield start, "\n".join(pending), ValueError("unterminated quote")
+
+
+class ImportJob:
+    """Counters and the error report of one import."""
+
+    def __init__(self, source: str, fmt: str, default_type: str | None = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.source, self.fmt, self.default_type = source, fmt, default_type
+        self.accepted = self.rejected = 0
+        self.by_type: Counter = Counter()
+        self.error: str | None = None
+        self.started = time.time()
+        self.finished: float | None = None
+        self._report = None
+        self._writer = None
+
+    @property
+    def report_path(self) -> str:
+        return os.path.join(settings.IMPORT_DIR, f"{self.id}-errors.csv")
+
+    def reject(self, line_no: int, raw: str, error):
+        if self._writer is None:
+            os.makedirs(settings.IMPORT_DIR, exist_ok=True)
+            self._report = open(self.report_path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._report)
+            self._writer.writerow(["line", "error", "record"])
+        self._writer.writerow([line_no, str(error) or type(error).__name__, raw])
+        self.rejected += 1
+
+    def apply(self, chunk: list):
+        """Validate and write one chunk of ``(line_no, raw, record)`` (runs on the DB lane)."""
+        ops, rows = [], []
+        for line_no, raw, rec in chunk:
+            try:
+                if isinstance(rec, Exception):
+                    raise rec
+                payload = parse_record(rec, self.default_type)
+            except Exception as e:
+                self.reject(line_no, raw, e)
+                continue
+            ops.append((payload["type"], payload))
+            rows.append((line_no, raw))
+        if not ops:
+            return
+        for (kind, _p), (line_no, raw), res in zip(ops, rows, apply_writes(ops)):
+            if isinstance(res, Exception):
+                self.reject(line_no, raw, res)
+            else:
+                self.accepted += 1
+                self.by_type[kind] += 1
+
+    def close(self):
+        self.finished = time.time()
+        if self._report is not None:
+            self._report.close()
+            self._report = None
+
+    def summary(self) -> dict:
+        return {"import_id": self.id, "source": self.source, "format": self.fmt, "accepted": self.accepted,
+                "rejected": self.rejected, "by_type": dict(self.by_type), "error": self.error,
+                "seconds": round((self.finished or time.time()) - self.started, 2),
+                "error_report": self.report_path if self.rejected else None}
+
+    def describe(self) -> str:
+        head = "Import stopped early" if self.error else "Import finished"
+        text = f"{head}: {self.accepted} rows accepted, {self.rejected} rejected."
+        if self.by_type:
+            text += "\n" + " | ".join(f"{k} {v}" for k, v in sorted(self.by_type.items()))
+        if self.error:
+            text += f"\nStopped: {self.error}"
+        return text
+
+
+class Importer:
+    def __init__(self):
+        self._lock: asyncio.Lock | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.current: ImportJob | None = None
+        self.imports = self.rows_accepted = self.rows_rejected = self.failed = 0
+
+    async def run(self, chunks, fmt: str, default_type: str | None = None, source: str = "http") -> ImportJob:
+        """Stream ``chunks`` (an async iterable of bytes) into the ledger; returns the finished job."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        job = ImportJob(source, fmt, default_type)
+        async with self._lock:
+            self.current = job
+            chunk = []
+            try:
+                async for rec in _records(chunks, fmt):
+                    chunk.append(rec)
+                    if len(chunk) >= settings.IMPORT_CHUNK_ROWS:
+                        await run_db(job.apply, chunk)
+                        chunk = []
+                if chunk:
+                    await run_db(job.apply, chunk)
+            except asyncio.CancelledError:
+                job.error = "cancelled"
+                raise
+            except Exception as e:
+                # chunks already written stay committed; the summary says where it stopped
+                log.warning("import %s stopped: %s", job.id, e)
+                job.error = str(e) or type(e).__name__
+                self.failed += 1
+            finally:
+                await run_db(job.close)
+                self.current = None
+                self.imports += 1
+                self.rows_accepted += job.accepted
+                self.rows_rejected += job.rejected
+        log.info("import %s (%s): %s accepted, %s rejected in %.1fs", job.id, source, job.accepted, job.rejected,
+                 job.finished - job.started)
+        return job
+
+    def report_path(self, import_id: str) -> str | None:
+        """Error report of a finished import, if it had rejected rows."""
+        if not _IMPORT_ID.fullmatch(import_id or ""):
+            return None
+        path = os.path.join(settings.IMPORT_DIR, f"{import_id}-errors.csv")
+        return path if os.path.exists(path) else None
+
+    async def accept_document(self, chat_id: int, message_id: int | None, document: dict, caption: str | None):
+        """Start importing a document sent to the bot; the summary is sent when it finishes."""
+        name = document.get("file_name") or ""
+        fmt = detect_format(name, document.get("mime_type"))
+        if fmt is None:
+            await tg_send(chat_id, "To import, send a .csv or .jsonl file (caption: the row type if the file "
+                                   "has no type column, e.g. stockin).", reply_to_message_id=message_id)
+            return
+        await tg_send(chat_id, f"Importing {name or 'file'}…", reply_to_message_id=message_id)
+        task = asyncio.create_task(self._from_telegram(chat_id, message_id, document["file_id"], fmt,
+                                                       caption_type(caption)), name=f"import-{name}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _from_telegram(self, chat_id: int, message_id: int | None, file_id: str, fmt: str,
+                             default_type: str | None):
+        job = await self.run(tg_stream_file(file_id), fmt, default_type, source="telegram")
+        text = job.describe()
+        if job.rejected:
+            if await tg_send_document(chat_id, job.report_path, f"import-{job.id}-errors.csv",
+                                      caption=text, reply_to_message_id=message_id):
+                return
+            text += "\n(The error report could not be attached.)"
+        await tg_send(chat_id, text, reply_to_message_id=message_id)
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"running": self.current.summary() if self.current else None, "imports": self.imports,
+                "rows_accepted": self.rows_accepted, "rows_rejected": self.rows_rejected, "failed": self.failed}
+
+
+importer = Importer()
@@ -0,0 +1,195 @@
+# app/services/inbox.py
+"""Durable inbox in front of ``process_update``.
+
+The webhook only appends the raw update to the ``inbox`` table and returns
+200, so an update Telegram has handed over survives a restart. A pool of
+async workers claims rows oldest-first and runs the handler. Rows stuck in
+'processing' (crash, lost worker) go back to 'pending' once they are older
+than INBOX_VISIBILITY_TIMEOUT, at startup and from the sweeper. Younger
+ones may belong to another live process (a second uvicorn worker, the old
+instance during a redeploy), so they are left alone. Failures retry with
+backoff and end up 'dead' after INBOX_MAX_ATTEMPTS.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+from ..config import settings
+from ..db import inbox_append, inbox_append_many, inbox_claim, inbox_done, inbox_retry, inbox_dead, inbox_recover, inbox_status
+from . import dedup
+from .executor import run_db
+
+log = logging.getLogger("sawmill.inbox")
+
+
+class Inbox:
+    def __init__(self):
+        self._handler = None
+        self._workers: list[asyncio.Task] = []
+        self._sweeper: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._stopping = False
+        # estimate of queued rows for backpressure; re-synced from the table by the sweeper
+        self.backlog = 0
+        self.appended = self.duplicates = self.done = self.retried = self.dead = self.recovered = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def saturated(self) -> bool:
+        return self.backlog >= settings.INBOX_MAX_PENDING
+
+    async def append(self, update: dict) -> bool:
+        """Persist an update for the workers; False if it is a known duplicate."""
+        update_id = update.get("update_id")
+        if update_id and update_id in dedup.recent:
+            self.duplicates += 1
+            return False
+        if not await run_db(inbox_append, update_id, json.dumps(update, ensure_ascii=False)):
+            self.duplicates += 1
+            return False
+        self.appended += 1
+        self.backlog += 1
+        if self._wake is not None:
+            self._wake.set()
+        return True
+
+    async def append_many(self, updates: list) -> int:
+        """Persist a batch (e.g. one getUpdates page) in a single transaction."""
+        rows = [(u.get("update_id"), json.dumps(u, ensure_ascii=False)) for u in updates
+                if not (u.get("update_id") and u.get("update_id") in dedup.recent)]
+        added = await run_db(inbox_append_many, rows) if rows else 0
+        self.appended += added
+        self.duplicates += len(updates) - added
+        self.backlog += added
+        if added and self._wake is not None:
+            self._wake.set()
+        return added
+
+    async def start(self, handler):
+        """Recover rows left 'processing' past the visibility timeout, then start the workers.
+
+        ``handler(update, inbox_id=..., final_attempt=...)`` must raise on a
+        failure that should be retried.
+        """
+        if self._workers:
+            return
+        self._handler = handler
+        self._stopping = False
+        self._wake = asyncio.Event()
+        # a row claimed just before we started may be another live process's; same rule as the sweeper
+        await self._recover(time.time() - settings.INBOX_VISIBILITY_TIMEOUT)
+        status = await run_db(inbox_status)
+        self.backlog = status["pending"]
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self._workers = [asyncio.create_task(self._work(f"{prefix}-{n}"), name=f"inbox-worker-{n}")
+                         for n in range(max(1, settings.INBOX_WORKERS))]
+        self._sweeper = asyncio.create_task(self._sweep(), name="inbox-sweeper")
+        log.info("Inbox started: %s workers, %s pending", len(self._workers), self.backlog)
+
+    async def stop(self, timeout: float = 10.0):
+        """Let workers finish their current update; anything cut off is recovered after the visibility timeout."""
+        if not self._workers:
+            return
+        self._stopping = True
+        self._wake.set()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        tasks = self._workers + ([self._sweeper] if self._sweeper else [])
+        _done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers, self._sweeper = [], None
+
+    async def _recover(self, older_than: float):
+        update_ids = await run_db(inbox_recover, older_than)
+        for update_id in update_ids:
+            if update_id is not None:
+                dedup.recent.discard(update_id)
+        if update_ids:
+            self.recovered += len(update_ids)
+            log.warning("Recovered %s inbox rows stuck in processing", len(update_ids))
+            self._wake.set()
+
+    async def _sweep(self):
+        interval = min(60.0, settings.INBOX_VISIBILITY_TIMEOUT / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._recover(time.time() - settings.INBOX_VISIBILITY_TIMEOUT)
+                self.backlog = (await run_db(inbox_status))["pending"]
+            except Exception:
+                log.exception("inbox sweep failed")
+
+    async def _work(self, name: str):
+        while not self._stopping:
+            try:
+                row = await run_db(inbox_claim, name)
+            except Exception:
+                log.exception("inbox claim failed")
+                row = None
+            if row is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), settings.INBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            await self._handle(*row)
+
+    async def _handle(self, inbox_id: int, payload: str, attempts: int):
+        attempts += 1
+        try:
+            update = json.loads(payload)
+        except ValueError as e:
+            await self._finish(inbox_dead, inbox_id, attempts, f"bad payload: {e}")
+            self.dead += 1
+            self.backlog = max(0, self.backlog - 1)
+            return
+        final = attempts >= settings.INBOX_MAX_ATTEMPTS
+        try:
+            await self._handler(update, inbox_id=inbox_id, final_attempt=final)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if final:
+                log.error("Inbox row %s (update %s) dead after %s attempts: %s",
+                          inbox_id, update.get("update_id"), attempts, error)
+                await self._finish(inbox_dead, inbox_id, attempts, error)
+                self.dead += 1
+                self.backlog = max(0, self.backlog - 1)
+            else:
+                delay = settings.INBOX_RETRY_BACKOFF * (2 ** (attempts - 1))
+                log.warning("Inbox row %s failed (attempt %s), retrying in %.1fs: %s", inbox_id, attempts, delay, error)
+                await self._finish(inbox_retry, inbox_id, attempts, delay, error)
+                self.retried += 1
+            return
+        # writes already deleted their row in the same transaction; this covers the rest
+        await self._finish(inbox_done, inbox_id)
+        self.done += 1
+        self.backlog = max(0, self.backlog - 1)
+
+    async def _finish(self, fn, inbox_id: int, *args):
+        try:
+            await run_db(fn, inbox_id, *args)
+        except Exception:
+            # the row stays 'processing' and is picked up again after the visibility timeout
+            log.exception("Could not update inbox row %s", inbox_id)
+
+    def stats(self) -> dict:
+        return {"enabled": settings.INBOX_ENABLED, "workers": len(self._workers), "backlog": self.backlog,
+                "appended": self.appended, "duplicates": self.duplicates, "done": self.done,
+                "retried": self.retried, "dead": self.dead, "recovered": self.recovered}
+
+    async def lag(self) -> dict:
+        status = await run_db(inbox_status)
+        oldest = status.pop("oldest_pending_at")
+        return {"rows": status, "lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+                "workers": self.stats()}
+
+
+inbox = Inbox()
@@ -1,7 +1,11 @@
 # app/services/openai_parser.py
+import asyncio
 import json
 import logging
+import re
+import time
 from ..config import settings
+from ..metrics import STAGE
 
 log = logging.getLogger("sawmill.openai")
 
@@ -9,113 +13,278 @@ SYSTEM_PROMPT = """You are a strict data extractor for a sawmill ERP.
 Given a free-form message, output EXACTLY one JSON object describing one of these types:
 - STOCK_IN, PRODUCTION, ORDER, DELIVERY, PAYMENT, REPORT
 The JSON must use keys expected by the ERP (supplier_name, qty_logs, batch_id, thickness_mm, width_mm, qty, order_id, amount, etc).
+DELIVERY has order_id, lorry_number and qty (units shipped; omit it when the whole order went out).
+REPORT "kind" is daily, weekly, monthly, custom (with start/end), stock (optional "size" like "2x4x12") or yield (optional batch_id).
 If unsure, return a REPORT object: {"type":"REPORT","kind":"daily"}.
 Output must be valid JSON only.
 """
 
-def _extract_text_from_response(resp) -> str:
-    """
-    Accept multiple response shapes and return the best string content available.
-    Handles Responses API and older ChatCompletion-like shapes defensively.
+# coalesced requests (LLMDispatcher): one system prompt for several messages
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+Batch mode: the user message is a JSON array of N separate messages. Answer with one JSON object
+{"results": [...]} holding exactly N objects, one per message and in the same order, each following the rules above.
+"""
+
+FALLBACK = {"type": "REPORT", "kind": "daily"}
+_JSON_OBJ = re.compile(r"\{.*\}", re.S)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open probe -> closed.
+
+    After LLM_BREAKER_FAILURES failures or timeouts in a row the breaker opens
+    and calls short-circuit to the fallback. After LLM_BREAKER_RESET_SECONDS a
+    single probe call is let through; success closes it, failure re-opens it.
     """
-    # 1) new Responses API: resp.output -> list(...) containing 'content' pieces
-    try:
-        if hasattr(resp, "output") and resp.output:
-            pieces = []
-            for item in resp.output:
-                # item may be a dict-like or object
-                content = None
-                if isinstance(item, dict):
-                    # item['content'] might be a list of dicts with 'type' and 'text'
-                    cont = item.get("content")
-                    if isinstance(cont, list):
-                        for c in cont:
-                            if isinstance(c, dict) and ("text" in c or "type" in c and c.get("type") == "output_text"):
-                                pieces.append(c.get("text") or c.get("content") or "")
-                    elif isinstance(cont, str):
-                        pieces.append(cont)
-                else:
-                    # pydantic/object style
-                    try:
-                        cont = getattr(item, "content", None)
-                        if cont:
-                            for c in cont:
-                                pieces.append(getattr(c, "text", "") or getattr(c, "content", ""))
-                    except Exception:
-                        pass
-            if pieces:
-                return "\n".join(filter(None, pieces))
-    except Exception:
-        pass
 
-    # 2) older chat completion shape: resp.choices[0].message.content
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        # a probe that never reported back (cancelled) is retried after reset_after too
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            log.info("OpenAI circuit half-open; probing")
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            log.info("OpenAI circuit closed")
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.trips += 1
+                log.warning("OpenAI circuit open after %s consecutive failures", self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_SECONDS)
+_client = None
+_sem: asyncio.Semaphore | None = None
+_stats = {"calls": 0, "ok": 0, "failed": 0, "timeouts": 0, "short_circuited": 0, "bad_json": 0,
+          "inflight": 0, "waiting": 0, "batch_malformed": 0}
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        # import lazily so library not required for other flows
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL or None,
+                              timeout=settings.LLM_TIMEOUT_SECONDS, max_retries=0)
+    return _client
+
+
+def _get_sem() -> asyncio.Semaphore:
+    global _sem
+    if _sem is None:
+        _sem = asyncio.Semaphore(settings.LLM_CONCURRENCY)
+    return _sem
+
+
+async def close_client():
+    global _client, _sem
+    await dispatcher.drain()
+    client, _client, _sem = _client, None, None
+    if client is not None:
+        await client.close()
+
+
+def llm_stats() -> dict:
+    return {**_stats, "breaker": breaker.state, "breaker_trips": breaker.trips, "coalesce": dispatcher.stats()}
+
+
+def _extract_json(content: str | None) -> dict | None:
+    if not content:
+        return None
     try:
-        if isinstance(resp, dict) and "choices" in resp and resp["choices"]:
-            maybe = resp["choices"][0]
-            # choice may have 'message' or 'text'
-            if isinstance(maybe, dict):
-                if "message" in maybe and isinstance(maybe["message"], dict):
-                    return maybe["message"].get("content", "")
-                if "text" in maybe:
-                    return maybe.get("text", "")
+        obj = json.loads(content)
     except Exception:
-        pass
+        # try to extract a JSON substring
+        m = _JSON_OBJ.search(content)
+        if not m:
+            return None
+        try:
+            obj = json.loads(m.group(0))
+        except Exception:
+            return None
+    return obj if isinstance(obj, dict) else None
 
-    # 3) fallback: stringify the whole response
+
+def _extract_batch(content: str | None, n: int) -> list | None:
+    """The ``n`` per-message results of a batch answer (non-objects become None), or None if malformed."""
+    obj = _extract_json(content)
+    results = obj.get("results") if obj is not None else None
+    if not isinstance(results, list) or len(results) != n:
+        return None
+    return [r if isinstance(r, dict) else None for r in results]
+
+
+async def _complete(text: str, system: str = SYSTEM_PROMPT, max_tokens: int = 800) -> str | None:
+    sem = _get_sem()
+    _stats["waiting"] += 1
     try:
-        return json.dumps(resp) if not isinstance(resp, str) else resp
-    except Exception:
-        return str(resp)
+        await sem.acquire()
+    finally:
+        _stats["waiting"] -= 1
+    _stats["inflight"] += 1
+    try:
+        resp = await _get_client().chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=[{"role": "system", "content": system}, {"role": "user", "content": text}],
+            temperature=0.0, max_tokens=max_tokens,
+        )
+        return resp.choices[0].message.content if resp.choices else None
+    finally:
+        _stats["inflight"] -= 1
+        sem.release()
+
 
+async def llm_parse(text: str) -> dict | None:
+    """Ask OpenAI for one JSON object within the LLM_TIMEOUT_SECONDS budget.
 
-def llm_parse_free_text(text: str) -> dict:
-    """Call OpenAI (Responses API) and extract JSON object from response text."""
+    Returns None when the key is unset, the breaker is open, the call fails or
+    times out, or no JSON comes back, so callers (and the parse cache) can tell
+    a real answer from the fallback. With LLM_COALESCE_ENABLED the request may
+    share one completion with other messages arriving at the same moment.
+    """
+    if not settings.OPENAI_API_KEY:
+        return None
+    with STAGE.time("llm_parse"):
+        if settings.LLM_COALESCE_ENABLED:
+            return await dispatcher.submit(text)
+        return await _parse_one(text)
+
+
+async def _call(text: str, system: str = SYSTEM_PROMPT, max_tokens: int = 800) -> tuple[bool, str | None]:
+    """One completion under the breaker and the timeout budget: (ok, content)."""
+    if not breaker.allow():
+        _stats["short_circuited"] += 1
+        return False, None
+    _stats["calls"] += 1
     try:
-        if not settings.OPENAI_API_KEY:
-            return {"type": "REPORT", "kind": "daily"}
+        # the budget covers waiting for a concurrency slot as well as the call
+        content = await asyncio.wait_for(_complete(text, system, max_tokens), timeout=settings.LLM_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        _stats["timeouts"] += 1
+        breaker.record_failure()
+        log.warning("OpenAI request exceeded %.1fs budget", settings.LLM_TIMEOUT_SECONDS)
+        return False, None
+    except Exception as e:
+        _stats["failed"] += 1
+        breaker.record_failure()
+        log.warning("OpenAI request failed: %s", e)
+        return False, None
+    breaker.record_success()
+    _stats["ok"] += 1
+    return True, content
 
-        # import lazily so library not required for other flows
-        try:
-            # new OpenAI client
-            from openai import OpenAI
-        except Exception as e:
-            log.exception("OpenAI client import failed: %s", e)
-            return {"type": "REPORT", "kind": "daily"}
 
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+async def _parse_one(text: str) -> dict | None:
+    ok, content = await _call(text)
+    if not ok:
+        return None
+    obj = _extract_json(content)
+    if obj is None:
+        _stats["bad_json"] += 1
+    return obj
 
-        prompt = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": text}
-        ]
 
-        # 1) Try Chat Completions (some newer clients expose client.chat.completions)
-        try:
-            if hasattr(client, "chat") and hasattr(client.chat, "completions"):
-                resp = client.chat.completions.create(model="gpt-4o-mini", messages=prompt, temperature=0.0, max_tokens=800)
-                content = _extract_text_from_response(resp)
-            else:
-                # 2) Fallback to Responses API (preferred modern interface)
-                resp = client.responses.create(model="gpt-4o-mini", input=prompt, temperature=0.0, max_tokens=800)
-                content = _extract_text_from_response(resp)
-        except Exception as e:
-            log.exception("OpenAI request failed: %s", e)
-            return {"type": "REPORT", "kind": "daily"}
-
-        # try parse JSON directly
+async def _parse_many(texts: list[str]) -> list[dict | None]:
+    """One completion for several messages; malformed answers fall back to one call per message."""
+    ok, content = await _call(json.dumps(texts, ensure_ascii=False), BATCH_SYSTEM_PROMPT,
+                              max_tokens=min(800 * len(texts), 4000))
+    if not ok:
+        return [None] * len(texts)
+    results = _extract_batch(content, len(texts))
+    if results is None:
+        _stats["batch_malformed"] += 1
+        log.warning("Malformed batch answer for %s messages; asking one by one", len(texts))
+        results = [None] * len(texts)
+    redo = [i for i, r in enumerate(results) if r is None]
+    for i, r in zip(redo, await asyncio.gather(*(_parse_one(texts[i]) for i in redo))):
+        results[i] = r
+    return results
+
+
+class LLMDispatcher:
+    """Coalesces free-text parses from concurrent updates into one completion.
+
+    Parses submitted within LLM_COALESCE_WINDOW_MS of each other (up to
+    LLM_COALESCE_MAX) go out as one request carrying a JSON array of the
+    messages, so the system prompt is paid once per batch instead of once
+    per message. Each caller gets its own result back; a lone message is
+    sent the ordinary way.
+    """
+
+    def __init__(self):
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = self.messages = self.max_batch = 0
+
+    def stats(self) -> dict:
+        return {"enabled": settings.LLM_COALESCE_ENABLED, "pending": len(self._pending), "batches": self.batches,
+                "messages": self.messages, "max_batch": self.max_batch,
+                "avg_batch": round(self.messages / self.batches, 2) if self.batches else None}
+
+    async def submit(self, text: str) -> dict | None:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= settings.LLM_COALESCE_MAX:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(settings.LLM_COALESCE_WINDOW_MS / 1000, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending, []
+        if not items:
+            return
+        task = asyncio.get_running_loop().create_task(self._dispatch(items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, items):
+        self.batches += 1
+        self.messages += len(items)
+        self.max_batch = max(self.max_batch, len(items))
+        texts = [t for t, _f in items]
         try:
-            return json.loads(content)
+            results = [await _parse_one(texts[0])] if len(texts) == 1 else await _parse_many(texts)
         except Exception:
-            # try to extract a JSON substring
-            import re
-            m = re.search(r"\{.*\}", content, re.S)
-            if m:
-                try:
-                    return json.loads(m.group(0))
-                except Exception:
-                    pass
+            log.exception("coalesced LLM parse failed")
+            results = [None] * len(items)
+        for (_t, fut), res in zip(items, results):
+            if not fut.done():
+                fut.set_result(res)
+
+    async def drain(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+dispatcher = LLMDispatcher()
 
-    except Exception as e:
-        log.exception("llm_parse_free_text error: %s", e)
 
-    return {"type": "REPORT", "kind": "daily"}
+async def llm_parse_free_text(text: str) -> dict:
+    return await llm_parse(text) or dict(FALLBACK)
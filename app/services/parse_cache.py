@@ -0,0 +1,237 @@
+# app/services/parse_cache.py
+"""Two-tier cache of LLM parse results keyed on normalized message text.
+
+Keys are lowercased, whitespace-collapsed text. Where it is safe, numbers are
+templated out so "got 50 logs from kumar" and "Got 80 logs from Kumar" share
+one entry: the cached result stores which number in the message each numeric
+field came from and is re-filled from the new message on a hit. Templating is
+skipped (and the literal text is used as key) whenever the mapping would be
+ambiguous, e.g. a result value derived from the text rather than copied, or
+any string field containing digits.
+
+Tier 1 is an in-process LRU; tier 2 is the ``llm_cache`` table, which
+survives restarts. Both honour LLM_CACHE_TTL_SECONDS.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from ..config import settings
+from ..db import db_conn
+from ..dialect import execute_prepared
+from .executor import run_db
+from .openai_parser import llm_parse, FALLBACK
+
+log = logging.getLogger("sawmill.parse_cache")
+
+_NUM = re.compile(r"\d+(?:\.\d+)?")
+_WS = re.compile(r"\s+")
+VALID_TYPES = {"STOCK_IN", "PRODUCTION", "ORDER", "DELIVERY", "PAYMENT", "REPORT"}
+
+
+def normalize(text: str) -> str:
+    return _WS.sub(" ", text.strip().lower()).strip(" .!?")
+
+
+def _template(norm: str, result: dict) -> dict | None:
+    """Return the result with numbers replaced by {"$n": i} refs, or None if unsafe."""
+    nums = [float(n) for n in _NUM.findall(norm)]
+    out = {}
+    for k, v in result.items():
+        if isinstance(v, bool) or v is None:
+            out[k] = v
+        elif isinstance(v, (int, float)):
+            idx = [i for i, n in enumerate(nums) if n == float(v)]
+            if len(idx) != 1:
+                return None
+            out[k] = {"$n": idx[0], "int": isinstance(v, int)}
+        elif isinstance(v, str):
+            if any(ch.isdigit() for ch in v):
+                return None
+            out[k] = v
+        else:
+            return None
+    return out
+
+
+def _fill(tmpl: dict, norm: str) -> dict | None:
+    nums = _NUM.findall(norm)
+    out = {}
+    for k, v in tmpl.items():
+        if isinstance(v, dict) and "$n" in v:
+            if v["$n"] >= len(nums):
+                return None
+            n = float(nums[v["$n"]])
+            out[k] = int(n) if v.get("int") else n
+        else:
+            out[k] = v
+    return out
+
+
+def _restore_case(result: dict, text: str) -> dict:
+    # names come back in the casing of the message that was cached; prefer the
+    # casing the operator used this time when the value appears in the text
+    lowered = text.lower()
+    for k, v in result.items():
+        if k.endswith("_name") and isinstance(v, str) and v:
+            i = lowered.find(v.lower())
+            if i >= 0:
+                result[k] = text[i:i + len(v)]
+    return result
+
+
+class ParseCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._mem: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores_since_prune = 0
+        self.hits_memory = self.hits_db = self.misses = self.stores = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._mem), "hits_memory": self.hits_memory, "hits_db": self.hits_db,
+                    "misses": self.misses, "stores": self.stores,
+                    "llm_calls_saved": self.hits_memory + self.hits_db}
+
+    # tier 1
+    def _mem_get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if time.time() - created > self.ttl:
+                del self._mem[key]
+                return None
+            self._mem.move_to_end(key)
+            return value
+
+    def _mem_put(self, key: str, value: dict, created: float):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._mem[key] = (created, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.maxsize:
+                self._mem.popitem(last=False)
+
+    # tier 2
+    def _db_get(self, key: str) -> dict | None:
+        with db_conn() as conn:
+            c = conn.cursor()
+            execute_prepared(c, "llm_cache_get", "SELECT result, created_at FROM llm_cache WHERE key=?", (key,))
+            row = c.fetchone()
+            if not row:
+                return None
+            if time.time() - row[1] > self.ttl:
+                c.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                return None
+            c.execute("UPDATE llm_cache SET hits=hits+1, last_used=? WHERE key=?", (time.time(), key))
+        value = json.loads(row[0])
+        self._mem_put(key, value, row[1])
+        return value
+
+    def _db_put(self, key: str, value: dict, created: float):
+        with db_conn() as conn:
+            c = conn.cursor()
+            c.execute("""INSERT OR REPLACE INTO llm_cache(key,result,created_at,last_used,hits)
+                         VALUES(?,?,?,?,0)""", (key, json.dumps(value), created, created))
+        with self._lock:
+            self._stores_since_prune += 1
+            due = self._stores_since_prune >= 100
+            if due:
+                self._stores_since_prune = 0
+        # prune outside the lock: it is a DB round trip
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows, then the least recently used beyond LLM_CACHE_MAX_ROWS."""
+        with db_conn() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            c.execute("SELECT COUNT(1) FROM llm_cache")
+            excess = c.fetchone()[0] - settings.LLM_CACHE_MAX_ROWS
+            if excess > 0:
+                c.execute("""DELETE FROM llm_cache WHERE key IN
+                             (SELECT key FROM llm_cache ORDER BY last_used ASC LIMIT ?)""", (excess,))
+
+    def _lookup(self, key: str, use_db: bool) -> dict | None:
+        value = self._mem_get(key)
+        if value is not None:
+            with self._lock:
+                self.hits_memory += 1
+            return value
+        if not use_db:
+            return None
+        value = self._db_get(key)
+        if value is not None:
+            with self._lock:
+                self.hits_db += 1
+        return value
+
+    def get(self, text: str, use_db: bool = True) -> dict | None:
+        """Look ``text`` up; ``use_db=False`` checks only the in-process tier (never blocks)."""
+        norm = normalize(text)
+        tmpl = self._lookup("t:" + _NUM.sub("#", norm), use_db)
+        if tmpl is not None:
+            result = _fill(tmpl, norm)
+            if result is not None:
+                return _restore_case(result, text)
+        exact = self._lookup("x:" + norm, use_db)
+        if exact is not None:
+            return _restore_case(dict(exact), text)
+        if use_db:
+            with self._lock:
+                self.misses += 1
+        return None
+
+    def put(self, text: str, result: dict):
+        if not isinstance(result, dict) or result.get("type") not in VALID_TYPES:
+            return
+        norm = normalize(text)
+        created = time.time()
+        tmpl = _template(norm, result)
+        if tmpl is not None:
+            key, value = "t:" + _NUM.sub("#", norm), tmpl
+        else:
+            key, value = "x:" + norm, result
+        self._mem_put(key, value, created)
+        try:
+            self._db_put(key, value, created)
+        except Exception:
+            log.exception("parse cache persist failed")
+        with self._lock:
+            self.stores += 1
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+        with db_conn() as conn:
+            conn.cursor().execute("DELETE FROM llm_cache")
+
+
+parse_cache = ParseCache(settings.LLM_CACHE_SIZE, settings.LLM_CACHE_TTL_SECONDS)
+
+
+async def cached_llm_parse(text: str) -> dict:
+    """llm_parse_free_text with the parse cache in front. Failures are never cached."""
+    if settings.LLM_CACHE_ENABLED:
+        try:
+            hit = parse_cache.get(text, use_db=False) or await run_db(parse_cache.get, text)
+        except Exception:
+            log.exception("parse cache lookup failed")
+            hit = None
+        if hit is not None:
+            return hit
+    result = await llm_parse(text)
+    if result is None:
+        return dict(FALLBACK)
+    if settings.LLM_CACHE_ENABLED:
+        await run_db(parse_cache.put, text, result)
+    return result
@@ -0,0 +1,153 @@
+# app/services/poller.py
+"""Long-polling ingestion (``TELEGRAM_INGEST_MODE=polling``).
+
+Pulls up to TELEGRAM_POLL_LIMIT updates per ``getUpdates`` call instead of
+waiting for one webhook request per update, so the bot runs behind NAT and
+drains a backlog in pages. Each page is made durable first (one inbox
+transaction, or processed through the handler when the inbox is off) and
+only then is the offset advanced; Telegram re-sends anything past the last
+confirmed offset, and the ``updates_processed`` claims absorb the overlap.
+
+Without the inbox the offset stops at the first update whose handler
+failed: it and everything after it are fetched again after a backoff (the
+ones that did succeed are dropped as duplicates). Like an inbox row, an
+update gets INBOX_MAX_ATTEMPTS tries; the last one tells the user and the
+poller moves on.
+"""
+import asyncio
+import logging
+
+from ..config import settings
+from ..db import meta_get, meta_set
+from .executor import run_db
+from .inbox import inbox
+from .telegram import tg_call
+
+log = logging.getLogger("sawmill.poller")
+
+OFFSET_KEY = "tg_poll_offset"
+
+
+class Poller:
+    def __init__(self):
+        self._handler = None
+        self._task: asyncio.Task | None = None
+        self.offset: int | None = None
+        self.polls = self.batches = self.updates = self.errors = self.max_batch = 0
+        self.failed = 0
+        # update_id -> failed attempts, for updates held back by the offset (inbox off)
+        self._attempts: dict[int, int] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self, handler):
+        """``handler(update, final_attempt=...)`` processes one update when the inbox is disabled.
+
+        It must raise on a failure that is not the final attempt, so the
+        update can be fetched and retried.
+        """
+        if self._task is not None:
+            return
+        self._handler = handler
+        stored = await run_db(meta_get, OFFSET_KEY)
+        self.offset = int(stored) if stored else None
+        self._task = asyncio.create_task(self._run(), name="tg-poller")
+        log.info("Polling getUpdates from offset %s", self.offset)
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self):
+        # getUpdates answers 409 while a webhook is registered
+        try:
+            await tg_call("deleteWebhook", {"drop_pending_updates": False})
+        except Exception as e:
+            log.warning("deleteWebhook failed: %s", e)
+        delay = 1.0
+        while True:
+            if inbox.running and inbox.saturated():
+                await asyncio.sleep(settings.INBOX_POLL_SECONDS)
+                continue
+            try:
+                updates = await self._fetch()
+                if updates and not await self._handle(updates):
+                    # the offset stopped at a failed update; give it time before fetching it again
+                    attempts = max(self._attempts.values(), default=1)
+                    await asyncio.sleep(settings.INBOX_RETRY_BACKOFF * (2 ** (attempts - 1)))
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                log.warning("getUpdates failed (%s); retrying in %.0fs", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _fetch(self) -> list:
+        payload = {"timeout": settings.TELEGRAM_POLL_TIMEOUT, "limit": settings.TELEGRAM_POLL_LIMIT}
+        if self.offset is not None:
+            payload["offset"] = self.offset
+        self.polls += 1
+        r = await tg_call("getUpdates", payload, timeout=settings.TELEGRAM_POLL_TIMEOUT + settings.TELEGRAM_READ_TIMEOUT)
+        body = r.json()
+        if r.status_code == 429:
+            retry_after = (body.get("parameters") or {}).get("retry_after", 1)
+            log.warning("getUpdates rate limited; sleeping %ss", retry_after)
+            await asyncio.sleep(retry_after)
+            return []
+        if r.status_code >= 300 or not body.get("ok"):
+            raise RuntimeError(f"getUpdates {r.status_code}: {body.get('description')}")
+        return body.get("result") or []
+
+    async def _handle(self, updates: list) -> bool:
+        """Make a page durable and advance the offset past what was; False if an update failed."""
+        updates = sorted(updates, key=lambda u: u["update_id"])
+        if inbox.running:
+            await inbox.append_many(updates)
+            done = updates
+        else:
+            done = await self._process(updates)
+        if done:
+            self.offset = done[-1]["update_id"] + 1
+            await run_db(meta_set, OFFSET_KEY, str(self.offset))
+        self.batches += 1
+        self.updates += len(done)
+        self.max_batch = max(self.max_batch, len(updates))
+        return len(done) == len(updates)
+
+    async def _process(self, updates: list) -> list:
+        """Run the handler over a page (inbox off); returns the updates before the first failure."""
+        finals = [self._attempts.get(u["update_id"], 0) + 1 >= settings.INBOX_MAX_ATTEMPTS for u in updates]
+        # the page shares one write-batcher window
+        results = await asyncio.gather(*(self._handler(u, final_attempt=final) for u, final in zip(updates, finals)),
+                                       return_exceptions=True)
+        first_failed = len(updates)
+        for i, (u, final, res) in enumerate(zip(updates, finals, results)):
+            update_id = u["update_id"]
+            if not isinstance(res, Exception):
+                self._attempts.pop(update_id, None)
+            elif final:
+                # the user has been told; do not hold the chat up any longer
+                self._attempts.pop(update_id, None)
+                log.error("Update %s failed after %s attempts, skipping it: %s",
+                          update_id, settings.INBOX_MAX_ATTEMPTS, res)
+            else:
+                self._attempts[update_id] = self._attempts.get(update_id, 0) + 1
+                self.failed += 1
+                first_failed = min(first_failed, i)
+                log.warning("Update %s failed (attempt %s); polling again from it: %s",
+                            update_id, self._attempts[update_id], res)
+        return updates[:first_failed]
+
+    def stats(self) -> dict:
+        return {"running": self.running, "offset": self.offset, "polls": self.polls, "batches": self.batches,
+                "updates": self.updates, "max_batch": self.max_batch, "errors": self.errors,
+                "failed": self.failed}
+
+
+poller = Poller()
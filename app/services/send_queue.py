@@ -0,0 +1,293 @@
+# app/services/send_queue.py
+"""Outbound Telegram send scheduler.
+
+Replies are queued per chat and dispatched under two token buckets: one per
+chat (RATE_LIMIT_PER_MINUTE) and one global (TELEGRAM_GLOBAL_RATE). A 429
+holds back every send for the ``retry_after`` Telegram asks for (it may be a
+bot-wide flood limit) and does not count toward TELEGRAM_SEND_MAX_RETRIES;
+5xx and network errors retry with exponential backoff up to that limit.
+With TELEGRAM_COALESCE on, replies queued for the same chat are merged into
+one message.
+
+On shutdown the queue drains for up to TELEGRAM_SEND_DRAIN_SECONDS; every
+reply still unsent after that is logged with its chat id and dropped.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import httpx
+
+from ..config import settings
+from ..metrics import SEND_ERRORS, STAGE, trace_id
+from .telegram import tg_call
+
+log = logging.getLogger("sawmill.send_queue")
+
+MAX_TEXT = 4096
+
+
+class TokenBucket:
+    """Classic token bucket; single-threaded (event loop) use only."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class _Pending:
+    chat_id: int
+    text: str
+    reply_to_message_id: int | None = None
+    attempts: int = 0
+    queued_at: float = field(default_factory=time.monotonic)
+    trace: str | None = field(default_factory=trace_id.get)
+
+
+class SendQueue:
+    def __init__(self):
+        self._chats: dict[int, deque[_Pending]] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+        self._blocked_until: dict[int, float] = {}
+        # set by a 429: nothing is sent to any chat before this
+        self._global_blocked_until = 0.0
+        self._inflight: dict[int, _Pending] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._global: TokenBucket | None = None
+        self._wake: asyncio.Event | None = None
+        self._runner: asyncio.Task | None = None
+        self.sent = self.retried = self.rate_limited = self.dropped = self.coalesced = 0
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None and not self._runner.done()
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self._chats.values())
+
+    def stats(self) -> dict:
+        return {"pending": self.depth(), "chats": len(self._chats), "inflight": len(self._inflight),
+                "sent": self.sent, "retried": self.retried, "rate_limited": self.rate_limited,
+                "dropped": self.dropped, "coalesced": self.coalesced}
+
+    def enqueue(self, chat_id: int, text: str, reply_to_message_id: int | None = None):
+        self._chats.setdefault(chat_id, deque()).append(_Pending(chat_id, text[:MAX_TEXT], reply_to_message_id))
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        if self.running:
+            return
+        if settings.TELEGRAM_GLOBAL_RATE > 0:
+            self._global = TokenBucket(settings.TELEGRAM_GLOBAL_RATE, settings.TELEGRAM_GLOBAL_RATE)
+        self._wake = asyncio.Event()
+        self._runner = asyncio.create_task(self._run(), name="tg-send-queue")
+
+    def drain_estimate(self) -> float:
+        """Seconds the current backlog needs under the per-chat and global rate limits."""
+        sends = {cid: (1 if settings.TELEGRAM_COALESCE else len(q)) for cid, q in self._chats.items() if q}
+        per_chat = max(sends.values(), default=0) * 60.0 / settings.RATE_LIMIT_PER_MINUTE \
+            if settings.RATE_LIMIT_PER_MINUTE > 0 else 0.0
+        total = sum(sends.values()) / settings.TELEGRAM_GLOBAL_RATE if settings.TELEGRAM_GLOBAL_RATE > 0 else 0.0
+        return max(per_chat, total)
+
+    async def stop(self, drain_timeout: float | None = None):
+        """Give queued replies up to ``drain_timeout`` seconds (TELEGRAM_SEND_DRAIN_SECONDS) to go out, then stop.
+
+        Replies still queued or in flight after that are logged one by one and dropped.
+        """
+        if not self.running:
+            return
+        if drain_timeout is None:
+            drain_timeout = settings.TELEGRAM_SEND_DRAIN_SECONDS
+        needed = self.drain_estimate()
+        if needed > drain_timeout:
+            log.warning("Send queue backlog of %s replies needs ~%.0fs to drain, only waiting %.1fs "
+                        "(TELEGRAM_SEND_DRAIN_SECONDS)", self.depth(), needed, drain_timeout)
+        deadline = time.monotonic() + drain_timeout
+        while (self._chats or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._runner.cancel()
+        for t in list(self._tasks):
+            t.cancel()
+        # _deliver forgets its item once cancelled; note what is still out first
+        inflight = list(self._inflight.values())
+        await asyncio.gather(self._runner, *self._tasks, return_exceptions=True)
+        self._runner = None
+        self._drop_unsent(inflight)
+
+    def _drop_unsent(self, inflight: list):
+        now = time.monotonic()
+        unsent = [(item, "send cancelled, may not have arrived") for item in inflight]
+        unsent += [(item, "still queued") for q in self._chats.values() for item in q]
+        for item, why in unsent:
+            self.dropped += 1
+            log.error("Dropping reply to chat %s at shutdown (%s, queued %.1fs ago, reply_to=%s): %r",
+                      item.chat_id, why, now - item.queued_at, item.reply_to_message_id, item.text[:200])
+        if unsent:
+            log.warning("Send queue stopped with %s undelivered replies", len(unsent))
+        self._chats.clear()
+        self._blocked_until.clear()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket | None:
+        if settings.RATE_LIMIT_PER_MINUTE <= 0:
+            return None
+        b = self._buckets.get(chat_id)
+        if b is None:
+            b = self._buckets[chat_id] = TokenBucket(settings.RATE_LIMIT_PER_MINUTE / 60.0, 1)
+        return b
+
+    def _take(self, q: deque) -> _Pending:
+        item = q.popleft()
+        if not settings.TELEGRAM_COALESCE:
+            return item
+        parts = [item.text]
+        size = len(item.text)
+        while q and size + 2 + len(q[0].text) <= MAX_TEXT:
+            nxt = q.popleft()
+            parts.append(nxt.text)
+            size += 2 + len(nxt.text)
+            item.attempts = max(item.attempts, nxt.attempts)
+            self.coalesced += 1
+        if len(parts) > 1:
+            item = _Pending(item.chat_id, "\n\n".join(parts), item.reply_to_message_id, item.attempts,
+                            item.queued_at, item.trace)
+        return item
+
+    def _dispatch_ready(self, now: float) -> float | None:
+        """Start every send allowed right now; return seconds until the next one could be."""
+        next_wake = None
+        for chat_id in list(self._chats):
+            q = self._chats[chat_id]
+            if not q:
+                del self._chats[chat_id]
+                continue
+            if chat_id in self._inflight:
+                continue
+            bucket = self._chat_bucket(chat_id)
+            wait = max(self._blocked_until.get(chat_id, 0.0) - now, self._global_blocked_until - now,
+                       bucket.wait_time(now) if bucket else 0.0)
+            if wait <= 0 and self._global is not None:
+                wait = self._global.wait_time(now)
+            if wait > 0:
+                next_wake = wait if next_wake is None else min(next_wake, wait)
+                continue
+            if bucket:
+                bucket.consume()
+            if self._global is not None:
+                self._global.consume()
+            self._blocked_until.pop(chat_id, None)
+            item = self._take(q)
+            # rotate so busy chats do not starve quiet ones
+            del self._chats[chat_id]
+            if q:
+                self._chats[chat_id] = q
+            self._inflight[chat_id] = item
+            task = asyncio.create_task(self._deliver(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if len(self._buckets) > 1024:
+            for cid in [c for c, b in self._buckets.items() if c not in self._chats and b.full(now)]:
+                del self._buckets[cid]
+        return next_wake
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                next_wake = self._dispatch_ready(time.monotonic())
+            except Exception:
+                log.exception("send queue dispatch failed")
+                next_wake = 1.0
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=next_wake)
+            except asyncio.TimeoutError:
+                pass
+
+    def _retry(self, item: _Pending, delay: float, reason: str):
+        item.attempts += 1
+        if item.attempts > settings.TELEGRAM_SEND_MAX_RETRIES:
+            self.dropped += 1
+            log.error("Dropping reply to chat %s after %s attempts (%s)", item.chat_id, item.attempts, reason)
+            return
+        self.retried += 1
+        log.warning("Retrying reply to chat %s in %.2fs (%s)", item.chat_id, delay, reason)
+        self._requeue(item, delay)
+
+    def _requeue(self, item: _Pending, delay: float):
+        self._blocked_until[item.chat_id] = time.monotonic() + delay
+        self._chats.setdefault(item.chat_id, deque()).appendleft(item)
+
+    def _rate_limited(self, item: _Pending, retry_after: float):
+        """A 429: wait as asked, for every chat, and try again without using up a retry."""
+        self.rate_limited += 1
+        until = time.monotonic() + retry_after
+        if until > self._global_blocked_until:
+            log.warning("Telegram rate limit (chat %s); holding all sends for %.1fs", item.chat_id, retry_after)
+            self._global_blocked_until = until
+        self._requeue(item, retry_after)
+
+    def _backoff(self, attempts: int) -> float:
+        base = settings.TELEGRAM_SEND_BACKOFF * (2 ** attempts)
+        return min(30.0, base) * (0.5 + random.random() / 2)
+
+    async def _deliver(self, item: _Pending):
+        trace_id.set(item.trace)
+        payload = {"chat_id": item.chat_id, "text": item.text, "disable_web_page_preview": True}
+        if item.reply_to_message_id:
+            payload["reply_to_message_id"] = item.reply_to_message_id
+        try:
+            with STAGE.time("telegram_send"):
+                r = await tg_call("sendMessage", payload)
+            try:
+                body = r.json()
+            except Exception:
+                body = r.text
+            if r.status_code >= 300:
+                SEND_ERRORS.inc(str(r.status_code))
+            if r.status_code == 429:
+                params = body.get("parameters", {}) if isinstance(body, dict) else {}
+                self._rate_limited(item, float(params.get("retry_after") or 1))
+            elif r.status_code >= 500:
+                self._retry(item, self._backoff(item.attempts), f"HTTP {r.status_code}")
+            elif r.status_code >= 300:
+                self.dropped += 1
+                log.error("Telegram send error %s %s", r.status_code, body)
+            else:
+                self.sent += 1
+                STAGE.observe(time.monotonic() - item.queued_at, "send_queue")
+        except httpx.HTTPError as e:
+            SEND_ERRORS.inc(type(e).__name__)
+            self._retry(item, self._backoff(item.attempts), type(e).__name__)
+        except Exception:
+            SEND_ERRORS.inc("error")
+            self.dropped += 1
+            log.exception("tg send failed for chat %s", item.chat_id)
+        finally:
+            self._inflight.pop(item.chat_id, None)
+            self._wake.set()
+
+
+outbox = SendQueue()
@@ -1,11 +1,16 @@
-# app/services/telegram.py  (DEBUG - remove after fix)
+# app/services/telegram.py
 import asyncio
 import httpx
 import logging
 from ..config import settings
+from ..metrics import SEND_ERRORS, STAGE
 
 log = logging.getLogger("sawmill.telegram")
 
+# one keep-alive client for every Bot API call; opened/closed in the app lifespan
+_client: httpx.AsyncClient | None = None
+
+
 def _masked_token(t: str) -> str:
     if not t:
         return "<EMPTY>"
@@ -14,37 +19,102 @@ def _masked_token(t: str) -> str:
         return t
     return t[:6] + "..." + t[-4:]
 
-async def tg_send(chat_id: int, text: str, reply_to_message_id: int | None = None):
+
+def _http2_enabled() -> bool:
+    if not settings.TELEGRAM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        log.warning("TELEGRAM_HTTP2 is set but the 'h2' package is missing; using HTTP/1.1")
+        return False
+    return True
+
+
+def _new_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.TELEGRAM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.TELEGRAM_MAX_KEEPALIVE,
+        keepalive_expiry=settings.TELEGRAM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=settings.TELEGRAM_CONNECT_TIMEOUT,
+        read=settings.TELEGRAM_READ_TIMEOUT,
+        write=settings.TELEGRAM_READ_TIMEOUT,
+        pool=settings.TELEGRAM_CONNECT_TIMEOUT,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=_http2_enabled())
+
+
+async def start_client():
+    global _client
+    if _client is None:
+        _client = _new_client()
+
+
+async def close_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client; created lazily when used outside the app lifespan."""
+    global _client
+    if _client is None:
+        _client = _new_client()
+    return _client
+
+
+def api_url(method: str, token: str | None = None) -> str:
     # Read token at runtime (avoid stale import-time value)
-    token = (settings.TELEGRAM_BOT_TOKEN or "").strip()
-    API = f"https://api.telegram.org/bot{token}"
+    token = (token if token is not None else settings.TELEGRAM_BOT_TOKEN or "").strip()
+    return f"{settings.TELEGRAM_API_BASE.rstrip('/')}/bot{token}/{method}"
+
 
+async def tg_call(method: str, payload: dict | None = None, timeout: float | None = None) -> httpx.Response:
+    """POST a Bot API method on the shared client."""
+    kwargs = {"json": payload or {}}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    return await get_client().post(api_url(method), **kwargs)
+
+
+async def tg_send(chat_id: int, text: str, reply_to_message_id: int | None = None):
+    """Queue a reply on the rate-limited send queue, or send directly if it is not running."""
+    token = (settings.TELEGRAM_BOT_TOKEN or "").strip()
     if not token:
-        log.error("TELEGRAM_BOT_TOKEN is empty in runtime settings. API=%s", API)
+        log.error("TELEGRAM_BOT_TOKEN is empty in runtime settings")
         return
 
-    # Safe debug: show masked token so we can verify which token the process has
-    log.info("tg_send using token (masked): %s", _masked_token(token))
-    log.debug("tg_send API url: %s/sendMessage", "https://api.telegram.org/bot<masked>")
+    from .send_queue import outbox
+    if outbox.running:
+        outbox.enqueue(chat_id, text, reply_to_message_id)
+        return
+
+    log.debug("tg_send using token (masked): %s", _masked_token(token))
 
     payload = {"chat_id": chat_id, "text": text[:4096], "disable_web_page_preview": True}
     if reply_to_message_id:
         payload["reply_to_message_id"] = reply_to_message_id
 
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.post(f"{API}/sendMessage", json=payload)
-            # try parse JSON body for helpful debug info
-            try:
-                body = r.json()
-            except Exception:
-                body = r.text
-
-            if r.status_code >= 300:
-                log.error("Telegram send error %s %s", r.status_code, body)
-            else:
-                log.info("Telegram send OK message_id=%s", body.get("result", {}).get("message_id") if isinstance(body, dict) else None)
+        with STAGE.time("telegram_send"):
+            r = await tg_call("sendMessage", payload)
+        # try parse JSON body for helpful debug info
+        try:
+            body = r.json()
+        except Exception:
+            body = r.text
+
+        if r.status_code >= 300:
+            SEND_ERRORS.inc(str(r.status_code))
+            log.error("Telegram send error %s %s", r.status_code, body)
+        else:
+            log.debug("Telegram send OK message_id=%s", body.get("result", {}).get("message_id") if isinstance(body, dict) else None)
     except Exception as e:
+        SEND_ERRORS.inc(type(e).__name__ if isinstance(e, httpx.HTTPError) else "error")
         log.exception("tg_send exception: %s", e)
 
 def tg_send_sync(chat_id: int, text: str, reply_to_message_id: int | None = None):
@@ -54,3 +124,41 @@ def tg_send_sync(chat_id: int, text: str, reply_to_message_id: int | None = None
         asyncio.run(tg_send(chat_id, text, reply_to_message_id))
         return
     asyncio.ensure_future(tg_send(chat_id, text, reply_to_message_id))
+
+
+def file_url(file_path: str) -> str:
+    """Download URL for a ``getFile`` result's file_path."""
+    token = (settings.TELEGRAM_BOT_TOKEN or "").strip()
+    return f"{settings.TELEGRAM_API_BASE.rstrip('/')}/file/bot{token}/{file_path}"
+
+
+async def tg_stream_file(file_id: str):
+    """Yield a document's bytes as they arrive (getFile, then a streamed download)."""
+    r = await tg_call("getFile", {"file_id": file_id})
+    body = r.json()
+    if r.status_code >= 300 or not body.get("ok"):
+        raise RuntimeError(f"getFile {r.status_code}: {body.get('description')}")
+    async with get_client().stream("GET", file_url(body["result"]["file_path"])) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            yield chunk
+
+
+async def tg_send_document(chat_id: int, path: str, filename: str, caption: str | None = None,
+                           reply_to_message_id: int | None = None) -> bool:
+    """Upload a file from disk with sendDocument (bypasses the text send queue)."""
+    data = {"chat_id": str(chat_id)}
+    if caption:
+        data["caption"] = caption[:1024]
+    if reply_to_message_id:
+        data["reply_to_message_id"] = str(reply_to_message_id)
+    try:
+        with open(path, "rb") as fh:
+            r = await get_client().post(api_url("sendDocument"), data=data, files={"document": (filename, fh)})
+        if r.status_code >= 300:
+            log.error("Telegram sendDocument error %s %s", r.status_code, r.text[:200])
+            return False
+        return True
+    except Exception as e:
+        log.exception("tg_send_document exception: %s", e)
+        return False
@@ -0,0 +1,86 @@
+"""Synthetic but realistic sawmill chat traffic, generated deterministically.
+
+``messages(n, seed)`` returns ``(text, expected_type)`` pairs. ``expected_type``
+is None for chatter that should not parse as anything.
+"""
+import random
+
+SUPPLIERS = ["Kumar", "Ravi Timber", "Sri Balaji Woods", "Murugan", "Anand Saw Logs", "Joseph"]
+CUSTOMERS = ["Ravi", "Suresh", "Lakshmi Furniture", "Ganesh Traders", "Priya Interiors", "Mohan"]
+SIZES = ["2x4", "2x6", "1x4", "3x3", "2x4x12", "1x6x10", "4x4x8", "50mmx100mm", "25mm x 150mm x 3m"]
+METHODS = ["cash", "UPI", "cheque", "NEFT", "gpay"]
+LORRIES = ["KA01AB1234", "TN 09 AB 4321", "KL-07-CD-881", "AP16TX9090"]
+
+STOCK_IN = [
+    "stockin supplier={s} qty={n} volume={v}",
+    "stockin supplier=\"{s}\" qty={n}",
+    "Got {n} logs from {s} today, about {v} cft",
+    "received {n} logs from {s}",
+    "{s} delivered {n} logs, {v} cft",
+    "{n} logs came in from {s} this morning",
+    "unloaded {n} logs from {s} - approx {v} cu ft",
+]
+PRODUCTION = [
+    "produce batch={b} size=\"{z}\" qty={n}",
+    "We cut {n} planks size {z} from batch {b}",
+    "cut {n} pcs {z} batch {b}",
+    "batch {b}: sawn {n} boards of {z}",
+    "produced {n} planks of {z} from batch #{b}",
+]
+ORDER = [
+    "order customer=\"{c}\" qty={n} size=\"{z}\"",
+    "{c} ordered {n} planks of {z}",
+    "{c} wants {n} pcs {z}",
+    "new order from {c}: {n} pieces {z}",
+    "{c} needs {n} boards {z} by friday",
+]
+DELIVERY = [
+    "deliver order={o} lorry={l}",
+    "dispatched order {o} on lorry {l}",
+    "order #{o} loaded in truck {l}",
+    "sent order no {o} via lorry {l}",
+]
+PAYMENT = [
+    "payment order={o} amount={a} method={m}",
+    "Received Rs {a} for order #{o} by {m}",
+    "order {o} paid {a} {m}",
+    "got payment of Rs.{a} against order {o}",
+]
+REPORT = [
+    "report",
+    "report weekly",
+    "send today's report",
+    "monthly summary please",
+    "what is the stock status",
+    "how many {z} do we have free",
+    "report yield batch={b}",
+    "what's the yield of batch {b}",
+]
+CHATTER = [
+    "good morning",
+    "ok thanks",
+    "call me when the saw is fixed",
+    "Kumar says rain delayed the logs, will confirm count tomorrow",
+    "can we do the 2x4 order cheaper?",
+]
+
+_BY_TYPE = [("STOCK_IN", STOCK_IN, 30), ("PRODUCTION", PRODUCTION, 30), ("ORDER", ORDER, 15),
+            ("DELIVERY", DELIVERY, 8), ("PAYMENT", PAYMENT, 8), ("REPORT", REPORT, 5), (None, CHATTER, 4)]
+
+
+def _fill(tmpl: str, rng: random.Random) -> str:
+    return tmpl.format(
+        s=rng.choice(SUPPLIERS), c=rng.choice(CUSTOMERS), z=rng.choice(SIZES), m=rng.choice(METHODS),
+        l=rng.choice(LORRIES), n=rng.randint(5, 400), v=rng.randint(50, 900), b=rng.randint(1, 500),
+        o=rng.randint(1, 2000), a=f"{rng.randint(1, 200) * 500:,}",
+    )
+
+
+def messages(n: int = 1000, seed: int = 7) -> list[tuple[str, str | None]]:
+    rng = random.Random(seed)
+    weights = [w for _, _, w in _BY_TYPE]
+    out = []
+    for _ in range(n):
+        kind, templates, _w = rng.choices(_BY_TYPE, weights)[0]
+        out.append((_fill(rng.choice(templates), rng), kind))
+    return out
@@ -0,0 +1,56 @@
+"""Inserts/sec for the STOCK_IN write path with and without connection pooling.
+
+Usage (from the repo root):
+
+    python -m bench.db_inserts --n 2000
+    DATABASE_URL=postgresql://... python -m bench.db_inserts --n 2000
+
+Each iteration mirrors what process_update does for one STOCK_IN message:
+dedup check, supplier upsert + stock_in insert, mark processed.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="sawmill-bench-"), "bench.db"))
+
+from app import db  # noqa: E402
+from app.config import settings  # noqa: E402
+
+
+def _run(n: int, pool_size: int, start_id: int) -> float:
+    settings.DB_POOL_SIZE = pool_size
+    db.close_pool()
+    db.init_db()
+    t0 = time.perf_counter()
+    for i in range(n):
+        update_id = start_id + i
+        if db.is_update_processed(update_id):
+            continue
+        db.insert_stockin({"supplier_name": f"Supplier {i % 20}", "qty_logs": 10 + i % 40, "volume_cft": 100.0})
+        db.mark_update_processed(update_id)
+    elapsed = time.perf_counter() - t0
+    db.close_pool()
+    return n / elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--n", type=int, default=2000, help="messages per run")
+    ap.add_argument("--pool-size", type=int, default=settings.DB_POOL_SIZE or 8)
+    args = ap.parse_args()
+
+    backend = "postgres" if db.USE_POSTGRES else f"sqlite ({settings.DB_PATH})"
+    print(f"backend: {backend}  n={args.n}")
+    base = int(time.time() * 1000) * 10
+    before = _run(args.n, 0, base)
+    after = _run(args.n, args.pool_size, base + args.n)
+    print(f"connect-per-call : {before:10.1f} inserts/s")
+    print(f"pooled (size={args.pool_size:<3}): {after:10.1f} inserts/s")
+    print(f"speedup          : {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
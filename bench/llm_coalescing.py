@@ -0,0 +1,76 @@
+"""Free-text parse throughput with and without cross-update LLM coalescing.
+
+Usage (from the repo root):
+
+    python -m bench.llm_coalescing --n 400 --rps 100 --latency-ms 400
+
+Fires ``--n`` distinct free-text parses at ``--rps`` against a local fake
+OpenAI server, once with LLM_COALESCE_ENABLED off and once on, and reports
+upstream requests, estimated prompt tokens, messages/sec and latency
+percentiles. ``--malformed-rate`` makes the stub break some batch answers
+to exercise the per-message fallback.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from app.config import settings  # noqa: E402
+from app.services import openai_parser  # noqa: E402
+from bench.stubs import StubServer, openai_stub  # noqa: E402
+
+
+async def _one(i: int, samples: list[float], wrong: list[int]):
+    t0 = time.perf_counter()
+    res = await openai_parser.llm_parse_free_text(f"got {i} logs from kumar")
+    samples.append((time.perf_counter() - t0) * 1000)
+    if res.get("qty_logs") != i:
+        wrong.append(i)
+
+
+async def _run(n: int, rps: float):
+    samples: list[float] = []
+    wrong: list[int] = []
+    tasks = []
+    t0 = time.perf_counter()
+    for i in range(1, n + 1):
+        tasks.append(asyncio.create_task(_one(i, samples, wrong)))
+        await asyncio.sleep(1 / rps)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+    await openai_parser.close_client()
+    return samples, wrong, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--n", type=int, default=400)
+    ap.add_argument("--rps", type=float, default=100.0)
+    ap.add_argument("--latency-ms", type=float, default=400.0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0)
+    ap.add_argument("--window-ms", type=float, default=settings.LLM_COALESCE_WINDOW_MS)
+    ap.add_argument("--max-batch", type=int, default=settings.LLM_COALESCE_MAX)
+    args = ap.parse_args()
+
+    settings.LLM_COALESCE_WINDOW_MS = args.window_ms
+    settings.LLM_COALESCE_MAX = args.max_batch
+    print(f"n={args.n} rps={args.rps} upstream latency={args.latency_ms}ms concurrency={settings.LLM_CONCURRENCY}")
+    for enabled in (False, True):
+        settings.LLM_COALESCE_ENABLED = enabled
+        stub = openai_stub(args.latency_ms, malformed_rate=args.malformed_rate, seed=1)
+        with StubServer(stub) as server:
+            settings.OPENAI_BASE_URL = server.url + "/v1"
+            samples, wrong, elapsed = asyncio.run(_run(args.n, args.rps))
+        qs = statistics.quantiles(samples, n=100)
+        print(f"coalesce {'on ' if enabled else 'off'}  {args.n / elapsed:7.1f} msg/s  requests {stub.state.calls:5d}  "
+              f"prompt tokens ~{stub.state.prompt_tokens:7d}  p50 {qs[49]:7.1f} ms  p95 {qs[94]:7.1f} ms  "
+              f"wrong {len(wrong)}")
+    print("dispatcher", openai_parser.dispatcher.stats(), "malformed batches",
+          openai_parser.llm_stats()["batch_malformed"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""LLM parse latency when OpenAI degrades: timeout budget + circuit breaker.
+
+Usage (from the repo root):
+
+    python -m bench.llm_resilience --n 200 --latency-ms 3000 --error-rate 0.3
+
+Fires ``--n`` free-text parses at ``--rps`` against a local fake OpenAI server
+and reports end-to-end latency percentiles, how many calls hit the upstream,
+and how many the breaker short-circuited.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from app.config import settings  # noqa: E402
+from app.services import openai_parser  # noqa: E402
+from bench.stubs import StubServer, openai_stub  # noqa: E402
+
+
+async def _one(i: int, samples: list[float]):
+    t0 = time.perf_counter()
+    await openai_parser.llm_parse_free_text(f"got {i} logs from kumar")
+    samples.append((time.perf_counter() - t0) * 1000)
+
+
+async def _run(n: int, rps: float):
+    samples: list[float] = []
+    tasks = []
+    for i in range(n):
+        tasks.append(asyncio.create_task(_one(i, samples)))
+        await asyncio.sleep(1 / rps)
+    await asyncio.gather(*tasks)
+    await openai_parser.close_client()
+    return samples
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--rps", type=float, default=50.0)
+    ap.add_argument("--latency-ms", type=float, default=200.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--timeout", type=float, default=settings.LLM_TIMEOUT_SECONDS)
+    args = ap.parse_args()
+
+    stub = openai_stub(args.latency_ms, args.jitter_ms, args.error_rate, seed=1)
+    with StubServer(stub) as server:
+        settings.OPENAI_BASE_URL = server.url + "/v1"
+        settings.LLM_TIMEOUT_SECONDS = args.timeout
+        samples = asyncio.run(_run(args.n, args.rps))
+
+    qs = statistics.quantiles(samples, n=100)
+    stats = openai_parser.llm_stats()
+    print(f"n={args.n} upstream latency={args.latency_ms}ms error_rate={args.error_rate} budget={args.timeout}s")
+    print(f"latency ms  p50 {qs[49]:8.1f}  p95 {qs[94]:8.1f}  p99 {qs[98]:8.1f}  max {max(samples):8.1f}")
+    print(f"upstream calls {stub.state.calls}  ok {stats['ok']}  failed {stats['failed']}  "
+          f"timeouts {stats['timeouts']}  short-circuited {stats['short_circuited']}  trips {stats['breaker_trips']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""End-to-end load test: the real app behind /tg/webhook, fake Telegram and OpenAI.
+
+Usage (from the repo root):
+
+    python -m bench.load_test --rps 50 --duration 30
+    DATABASE_URL=postgresql://... python -m bench.load_test --backend both
+
+Starts the FastAPI app (lifespan included: inbox workers, send queue, write
+batcher) on a local port, with TELEGRAM_API_BASE and OPENAI_BASE_URL
+pointing at the stubs in ``bench/stubs.py``. Updates from ``bench/corpus.py``
+are POSTed to the webhook open-loop at ``--rps``. The mix covers rule-parsable
+commands, free text that needs the NL parser or the LLM, reports and chatter.
+``--dup-rate`` of them are redeliveries of an earlier update_id. An update
+counts as done when its reply reaches the Telegram stub. Redeliveries must not
+get a reply. The test reports sustained updates/sec, webhook-ack and
+end-to-end latency percentiles, per-stage means from ``/metrics`` and the
+rows each table gained.
+
+The Bot API rate limits are off by default because the stub is not
+Telegram; ``--telegram-limits`` keeps them. ``--backend both`` runs
+SQLite and then the Postgres in DATABASE_URL, each in its own process.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SECRET = "bench-secret"
+
+
+def _configure_env(backend: str, telegram_limits: bool):
+    if backend == "sqlite":
+        os.environ.pop("DATABASE_URL", None)
+        os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="sawmill-load-"), "load.db")
+    elif not os.environ.get("DATABASE_URL"):
+        sys.exit("--backend postgres needs DATABASE_URL")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench-token")
+    os.environ["TELEGRAM_WEBHOOK_SECRET"] = SECRET
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not telegram_limits:
+        os.environ["RATE_LIMIT_PER_MINUTE"] = "0"
+        os.environ["TELEGRAM_GLOBAL_RATE"] = "0"
+
+
+def _row_counts() -> dict[str, int]:
+    from app import db
+    counts = {}
+    with db.db_conn() as conn:
+        c = conn.cursor()
+        for table in db.table_names():
+            c.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = c.fetchone()[0]
+    return counts
+
+
+def _stage_means(text: str) -> dict[str, tuple[float, int]]:
+    """``stage -> (mean ms, count)`` from the ``sawmill_stage_seconds`` sum/count lines."""
+    sums, counts = {}, {}
+    for name, stage, value in re.findall(r'^sawmill_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', text, re.M):
+        (sums if name == "sum" else counts)[stage] = float(value)
+    return {s: (sums[s] / counts[s] * 1000, int(counts[s])) for s in counts if counts[s]}
+
+
+def _percentiles(label: str, samples: list[float]) -> str:
+    if len(samples) < 2:
+        return f"{label:<14} n={len(samples)}"
+    qs = statistics.quantiles(samples, n=100)
+    return (f"{label:<14} p50 {qs[49]:8.1f} ms  p95 {qs[94]:8.1f} ms  p99 {qs[98]:8.1f} ms  "
+            f"max {max(samples):8.1f} ms")
+
+
+async def _drive(url: str, args, replied: dict[int, float]) -> dict:
+    """POST the update mix at ``args.rps`` and wait for the replies; returns the raw timings."""
+    import httpx
+    from bench.corpus import messages
+
+    rng = random.Random(args.seed)
+    n = int(args.rps * args.duration)
+    corpus = messages(n, seed=args.seed)
+    base = int(time.time() * 1000) * 10
+    sent: dict[int, float] = {}
+    acks: list[float] = []
+    statuses: dict[int, int] = {}
+    history: list[dict] = []
+    tasks = []
+
+    async def post(client, update: dict, original: bool):
+        t0 = time.perf_counter()
+        try:
+            r = await client.post(f"{url}/tg/webhook", json=update,
+                                  headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            status = r.status_code
+        except httpx.HTTPError:
+            status = 0
+        acks.append((time.perf_counter() - t0) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+        if original and status != 200:
+            sent.pop(update["message"]["message_id"], None)
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        t0 = time.perf_counter()
+        for i in range(n):
+            delay = t0 + i / args.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if history and rng.random() < args.dup_rate:
+                update, original = rng.choice(history), False
+            else:
+                msg_id = i + 1
+                update = {"update_id": base + i, "message": {
+                    "message_id": msg_id, "date": int(time.time()), "text": corpus[i][0],
+                    "chat": {"id": 1000 + i % args.chats, "type": "private"},
+                    "from": {"id": 1000 + i % args.chats, "is_bot": False, "first_name": "Load"}}}
+                history.append(update)
+                sent[msg_id] = time.perf_counter()
+                original = True
+            tasks.append(asyncio.create_task(post(client, update, original)))
+        await asyncio.gather(*tasks)
+        offered_for = time.perf_counter() - t0
+
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline and any(m not in replied for m in sent):
+            await asyncio.sleep(0.05)
+        metrics = (await client.get(f"{url}/metrics")).text
+    return {"n": n, "sent": sent, "acks": acks, "statuses": statuses, "t0": t0, "offered_for": offered_for,
+            "duplicates": n - len(history), "metrics": metrics}
+
+
+def run(args):
+    _configure_env(args.backend, args.telegram_limits)
+
+    from app import db
+    from app.config import settings
+    from app.main import app
+    from bench.stubs import StubServer, openai_stub, telegram_stub
+
+    tg = telegram_stub(args.tg_latency_ms, error_rate=args.tg_error_rate, rate_limit_rate=args.tg_429_rate,
+                       seed=args.seed)
+    llm = openai_stub(args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, error_rate=args.llm_error_rate,
+                      seed=args.seed)
+    replied: dict[int, float] = {}
+    # the first reply to a message is its end-to-end time (a coalesced reply answers only its first message)
+    tg.state.on_send = lambda body: replied.setdefault(body.get("reply_to_message_id"), time.perf_counter())
+
+    with StubServer(tg) as tg_server, StubServer(llm) as llm_server:
+        settings.TELEGRAM_API_BASE = tg_server.url
+        settings.OPENAI_BASE_URL = llm_server.url + "/v1"
+        with StubServer(app, lifespan="on") as server:
+            before = _row_counts()
+            res = asyncio.run(_drive(server.url, args, replied))
+            after = _row_counts()
+
+    sent = res["sent"]
+    done = [m for m in sent if m in replied]
+    e2e = [(replied[m] - sent[m]) * 1000 for m in done]
+    span = max((replied[m] for m in done), default=res["t0"]) - res["t0"]
+    backend = "postgres" if db.USE_POSTGRES else f"sqlite ({settings.DB_PATH})"
+    print(f"backend: {backend}")
+    print(f"offered  {res['n']} updates in {res['offered_for']:.1f}s ({res['n'] / res['offered_for']:.1f}/s), "
+          f"{res['duplicates']} duplicates, webhook statuses {res['statuses']}")
+    print(f"answered {len(done)} of {len(sent)}  sustained {len(done) / span if span else 0:.1f} updates/s  "
+          f"replies sent {len(tg.state.sent)}  (unanswered {len(sent) - len(done)})")
+    print(_percentiles("webhook ack", res["acks"]))
+    print(_percentiles("end-to-end", e2e))
+    print(f"upstream: openai calls {llm.state.calls}, telegram injected errors {tg.state.errors}")
+    print("stage means: " + "  ".join(f"{s} {ms:.1f}ms (n={c})" for s, (ms, c) in sorted(_stage_means(res["metrics"]).items())))
+    grown = {t: after[t] - before.get(t, 0) for t in after if after[t] != before.get(t, 0)}
+    print("rows added: " + "  ".join(f"{t} +{d}" for t, d in sorted(grown.items())))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--backend", choices=("sqlite", "postgres", "both"),
+                    default="postgres" if os.environ.get("DATABASE_URL") else "sqlite")
+    ap.add_argument("--rps", type=float, default=50.0)
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds of offered load")
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--dup-rate", type=float, default=0.05, help="share of updates that are redeliveries")
+    ap.add_argument("--connections", type=int, default=64, help="webhook client connections")
+    ap.add_argument("--drain-timeout", type=float, default=30.0, help="seconds to wait for outstanding replies")
+    ap.add_argument("--llm-latency-ms", type=float, default=400.0)
+    ap.add_argument("--llm-jitter-ms", type=float, default=200.0)
+    ap.add_argument("--llm-error-rate", type=float, default=0.0)
+    ap.add_argument("--tg-latency-ms", type=float, default=30.0)
+    ap.add_argument("--tg-error-rate", type=float, default=0.0, help="sendMessage 500s")
+    ap.add_argument("--tg-429-rate", type=float, default=0.0, help="sendMessage 429s")
+    ap.add_argument("--telegram-limits", action="store_true", help="keep the per-chat/global send limits")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    if args.backend != "both":
+        run(args)
+        return
+    if not os.environ.get("DATABASE_URL"):
+        sys.exit("--backend both needs DATABASE_URL for the Postgres run")
+    # USE_POSTGRES is fixed at import time, so each backend gets a fresh interpreter
+    # (argparse keeps the last --backend, so appending one overrides "both")
+    for backend in ("sqlite", "postgres"):
+        print(f"== {backend}", flush=True)
+        subprocess.run([sys.executable, "-m", "bench.load_test", *sys.argv[1:], "--backend", backend], check=True)
+
+
+if __name__ == "__main__":
+    main()
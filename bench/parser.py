@@ -0,0 +1,70 @@
+"""Parser throughput and per-type latency over the synthetic corpus.
+
+Usage (from the repo root):
+
+    python -m bench.parser --n 5000 --rounds 5
+
+Reports messages/sec for rule_parse alone, fast_parse (rules + NL) and the
+parse_batch API, per-type latency percentiles in microseconds, and how much
+of the corpus the fast path absorbs without the LLM.
+"""
+import argparse
+import statistics
+import time
+from collections import defaultdict
+
+from app.parsing import fast_parse, parse_batch, rule_parse
+from bench.corpus import messages
+
+
+def _throughput(fn, texts, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(texts)
+        best = min(best, time.perf_counter() - t0)
+    return len(texts) / best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--n", type=int, default=5000)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    corpus = messages(args.n, args.seed)
+    texts = [t for t, _ in corpus]
+
+    print(f"corpus: {len(texts)} messages (seed {args.seed}), best of {args.rounds} rounds")
+    print(f"rule_parse   {_throughput(lambda ts: [rule_parse(t) for t in ts], texts, args.rounds):12,.0f} msg/s")
+    print(f"fast_parse   {_throughput(lambda ts: [fast_parse(t) for t in ts], texts, args.rounds):12,.0f} msg/s")
+    print(f"parse_batch  {_throughput(parse_batch, texts, args.rounds):12,.0f} msg/s")
+
+    lat = defaultdict(list)
+    hits = defaultdict(lambda: [0, 0, 0])  # absorbed, correct, total
+    for text, expected in corpus:
+        t0 = time.perf_counter()
+        payload, _conf = fast_parse(text)
+        lat[expected or "chatter"].append((time.perf_counter() - t0) * 1e6)
+        h = hits[expected or "chatter"]
+        h[2] += 1
+        if payload:
+            h[0] += 1
+            h[1] += payload["type"] == expected
+        elif expected is None:
+            h[1] += 1
+
+    print(f"\n{'type':<11}{'n':>6}{'p50 us':>9}{'p99 us':>9}{'fast path':>11}{'correct':>9}")
+    absorbed = total = 0
+    for kind in sorted(lat):
+        qs = statistics.quantiles(lat[kind], n=100) if len(lat[kind]) > 1 else lat[kind] * 99
+        a, c, n = hits[kind]
+        absorbed += a if kind != "chatter" else 0
+        total += n if kind != "chatter" else 0
+        print(f"{kind:<11}{n:>6}{qs[49]:>9.1f}{qs[98]:>9.1f}{a / n:>10.0%}{c / n:>9.0%}")
+    print(f"\nfast path absorbs {absorbed / total:.1%} of parseable traffic")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Local stand-ins for external APIs, served by uvicorn on a background thread."""
+import asyncio
+import itertools
+import json
+import random
+import re
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubServer:
+    """Run an ASGI app on 127.0.0.1 in a daemon thread (context manager).
+
+    Stubs run without lifespan; pass ``lifespan="on"`` to serve the real app.
+    """
+
+    def __init__(self, app, port: int | None = None, lifespan: str = "off"):
+        self.port = port or _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port,
+                                                     log_level="warning", lifespan=lifespan))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("stub server did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def telegram_stub(latency_ms: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                  seed: int | None = None) -> FastAPI:
+    """Minimal Bot API: getMe, sendMessage (recorded in ``app.state.sent``),
+    getUpdates long polling over ``app.state.updates``, and documents: getFile
+    and downloads serve ``app.state.files`` (file_id -> bytes), sendDocument
+    bodies are recorded in ``app.state.documents``.
+
+    sendMessage fails with a 500 at ``error_rate`` and a 429 (retry_after 1)
+    at ``rate_limit_rate``; ``app.state.on_send``, if set, is called with each
+    delivered body (on the stub's thread)."""
+    app = FastAPI()
+    app.state.sent = []
+    app.state.on_send = None
+    app.state.errors = 0
+    rng = random.Random(seed)
+    app.state.files = {}
+    app.state.documents = []
+    # pending updates; like the real API, getUpdates(offset=N) confirms everything below N
+    app.state.updates = []
+    app.state.polls = 0
+    ids = itertools.count(1)
+
+    @app.post("/bot{token}/deleteWebhook")
+    async def delete_webhook(token: str):
+        return {"ok": True, "result": True}
+
+    @app.post("/bot{token}/getUpdates")
+    async def get_updates(token: str, request: Request):
+        body = await request.json()
+        app.state.polls += 1
+        offset, limit = body.get("offset"), min(int(body.get("limit", 100)), 100)
+        if offset is not None:
+            app.state.updates = [u for u in app.state.updates if u["update_id"] >= offset]
+        deadline = time.monotonic() + float(body.get("timeout", 0))
+        while not app.state.updates and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return {"ok": True, "result": app.state.updates[:limit]}
+
+    @app.post("/bot{token}/getMe")
+    async def get_me(token: str):
+        return {"ok": True, "result": {"id": 1, "is_bot": True, "username": "stub_bot"}}
+
+    @app.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        body = await request.json()
+        roll = rng.random() if error_rate or rate_limit_rate else 1.0
+        if roll < error_rate + rate_limit_rate:
+            app.state.errors += 1
+            if roll < error_rate:
+                return JSONResponse({"ok": False, "description": "injected failure"}, status_code=500)
+            return JSONResponse({"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                 "parameters": {"retry_after": 1}}, status_code=429)
+        app.state.sent.append(body)
+        if app.state.on_send is not None:
+            app.state.on_send(body)
+        return {"ok": True, "result": {"message_id": next(ids), "chat": {"id": body.get("chat_id")}}}
+
+    @app.post("/bot{token}/getFile")
+    async def get_file(token: str, request: Request):
+        file_id = (await request.json()).get("file_id")
+        if file_id not in app.state.files:
+            return JSONResponse({"ok": False, "description": "file not found"}, status_code=400)
+        return {"ok": True, "result": {"file_id": file_id, "file_path": f"documents/{file_id}"}}
+
+    @app.get("/file/bot{token}/documents/{file_id}")
+    async def download(token: str, file_id: str):
+        return Response(app.state.files[file_id], media_type="application/octet-stream")
+
+    @app.post("/bot{token}/sendDocument")
+    async def send_document(token: str, request: Request):
+        app.state.documents.append(await request.body())
+        return {"ok": True, "result": {"message_id": next(ids)}}
+
+    return app
+
+
+def _guess(text: str) -> dict:
+    """Crude stand-in for the model: enough structure for the app to insert a row."""
+    nums = [int(n) for n in re.findall(r"\d+", text)] or [1]
+    words = text.lower()
+    if "log" in words:
+        name = re.search(r"from (\w+)", text)
+        return {"type": "STOCK_IN", "supplier_name": name.group(1) if name else "Unknown", "qty_logs": nums[0]}
+    if "order" in words:
+        return {"type": "ORDER", "customer_name": text.split()[0], "qty": nums[0]}
+    if "paid" in words or "payment" in words:
+        return {"type": "PAYMENT", "order_id": nums[-1], "amount": float(nums[0])}
+    return {"type": "REPORT", "kind": "daily"}
+
+
+def openai_stub(latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                responder=_guess, seed: int | None = None, malformed_rate: float = 0.0) -> FastAPI:
+    """Fake /v1/chat/completions with injectable latency and 500s.
+
+    A user message that is a JSON array is a coalesced batch and gets
+    ``{"results": [...]}`` back (truncated at ``malformed_rate``). Prompt size
+    is estimated at 4 characters per token into ``app.state.prompt_tokens``.
+    """
+    app = FastAPI()
+    app.state.calls = 0
+    app.state.prompt_tokens = 0
+    rng = random.Random(seed)
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        app.state.calls += 1
+        body = await request.json()
+        delay = latency_ms + (rng.uniform(0, jitter_ms) if jitter_ms else 0.0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if error_rate and rng.random() < error_rate:
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=500)
+        user = next((m["content"] for m in reversed(body["messages"]) if m["role"] == "user"), "")
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        app.state.prompt_tokens += prompt_tokens
+        batch = json.loads(user) if user.startswith("[") else None
+        if isinstance(batch, list):
+            results = [responder(t) for t in batch]
+            if malformed_rate and rng.random() < malformed_rate:
+                results = results[:-1]
+            content = json.dumps({"results": results})
+        else:
+            content = json.dumps(responder(user))
+        return {
+            "id": f"chatcmpl-{app.state.calls}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens},
+        }
+
+    return app
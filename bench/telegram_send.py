@@ -0,0 +1,70 @@
+"""tg_send latency: new AsyncClient per message vs the shared keep-alive client.
+
+Usage (from the repo root):
+
+    python -m bench.telegram_send --n 500
+
+Runs against a local plain-HTTP Bot API stub, so the "before" numbers only
+include the TCP handshake; against api.telegram.org each fresh client also
+pays a TLS handshake, so the real gap is larger.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench-token")
+
+import httpx  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services import telegram  # noqa: E402
+from bench.stubs import StubServer, telegram_stub  # noqa: E402
+
+
+async def _per_call_client(chat_id: int, text: str):
+    # what tg_send did before the shared client
+    async with httpx.AsyncClient(timeout=15.0) as client:
+        r = await client.post(telegram.api_url("sendMessage"), json={"chat_id": chat_id, "text": text})
+        r.json()
+
+
+async def _measure(send, n: int) -> list[float]:
+    samples = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        await send(1000 + i % 10, f"bench message {i}")
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _summary(label: str, samples: list[float]) -> str:
+    qs = statistics.quantiles(samples, n=100)
+    return (f"{label:<20} mean {statistics.fmean(samples):7.2f} ms  p50 {qs[49]:7.2f}  "
+            f"p95 {qs[94]:7.2f}  p99 {qs[98]:7.2f}")
+
+
+async def _run(n: int):
+    before = await _measure(_per_call_client, n)
+    await telegram.start_client()
+    try:
+        after = await _measure(telegram.tg_send, n)
+    finally:
+        await telegram.close_client()
+    print(_summary("client per message", before))
+    print(_summary("shared client", after))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--n", type=int, default=500)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="stub server think time")
+    args = ap.parse_args()
+    with StubServer(telegram_stub(args.latency_ms)) as stub:
+        settings.TELEGRAM_API_BASE = stub.url
+        asyncio.run(_run(args.n))
+
+
+if __name__ == "__main__":
+    main()
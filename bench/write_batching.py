@@ -0,0 +1,72 @@
+"""Sustained updates/sec with group-commit write batching on and off.
+
+Usage (from the repo root):
+
+    python -m bench.write_batching --n 3000 --concurrency 64
+
+Each simulated update claims its update_id and submits one write through
+the batcher, as process_update does, with ``--concurrency`` updates in
+flight (a foreman pasting lines, several chats at once).
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="sawmill-bench-"), "bench.db"))
+
+from app import db  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.services import dedup  # noqa: E402
+from app.services.write_batcher import writes  # noqa: E402
+
+PAYLOADS = [
+    ("STOCK_IN", lambda i: {"supplier_name": f"Supplier {i % 20}", "qty_logs": 10 + i % 40, "volume_cft": 120.0}),
+    ("PRODUCTION", lambda i: {"batch_id": 1 + i % 50, "thickness_mm": 50.8, "width_mm": 101.6, "qty": 25}),
+    ("ORDER", lambda i: {"customer_name": f"Customer {i % 15}", "qty": 100, "size_label": "2x4",
+                         "thickness_mm": 50.8, "width_mm": 101.6}),
+    ("PAYMENT", lambda i: {"order_id": 1 + i % 100, "amount": 5000.0, "method": "upi"}),
+]
+
+
+async def _run(n: int, concurrency: int, start_id: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+    rng = random.Random(1)
+
+    async def one(i: int):
+        async with sem:
+            if await dedup.claim(start_id + i):
+                kind, make = rng.choice(PAYLOADS)
+                await writes.submit(kind, make(i))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return n / (time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--n", type=int, default=3000)
+    ap.add_argument("--concurrency", type=int, default=64)
+    args = ap.parse_args()
+
+    db.init_db()
+    backend = "postgres" if db.USE_POSTGRES else f"sqlite ({settings.DB_PATH})"
+    print(f"backend: {backend}  n={args.n}  concurrency={args.concurrency}  "
+          f"window={settings.WRITE_BATCH_WINDOW_MS}ms max={settings.WRITE_BATCH_MAX}")
+    base = int(time.time() * 1000) * 10
+
+    settings.WRITE_BATCH_ENABLED = False
+    off = asyncio.run(_run(args.n, args.concurrency, base))
+    settings.WRITE_BATCH_ENABLED = True
+    on = asyncio.run(_run(args.n, args.concurrency, base + args.n))
+    print(f"batching off : {off:10.1f} updates/s")
+    print(f"batching on  : {on:10.1f} updates/s  (avg batch {writes.stats()['avg_batch']})")
+    print(f"verify totals: {'OK' if not db.verify_totals() else db.verify_totals()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from app import db, dialect, migrations
+from app.config import settings
+
+# DB tests run on SQLite and, when DATABASE_URL names a Postgres server, on
+# Postgres too, in a throwaway schema so the database's own tables are untouched
+PG_URL = os.environ.get("DATABASE_URL")
+PG_SCHEMA = "sawmill_test"
+
+BACKENDS = ["sqlite", pytest.param("postgres", marks=pytest.mark.skipif(
+    not PG_URL or dialect.psycopg2 is None, reason="set DATABASE_URL to run the Postgres tests"))]
+
+
+def _pg_test_url() -> str:
+    url = dialect.psycopg2.extensions.make_dsn(PG_URL, options=f"-c search_path={PG_SCHEMA}")
+    conn = dialect.psycopg2.connect(PG_URL)
+    try:
+        with conn, conn.cursor() as c:
+            c.execute(f"DROP SCHEMA IF EXISTS {PG_SCHEMA} CASCADE")
+            c.execute(f"CREATE SCHEMA {PG_SCHEMA}")
+    finally:
+        conn.close()
+    return url
+
+
+@pytest.fixture(params=BACKENDS)
+def empty_db(request, tmp_path, monkeypatch):
+    """A database with no tables yet, on each backend."""
+    postgres = request.param == "postgres"
+    db.close_pool()
+    monkeypatch.setattr(settings, "DATABASE_URL", _pg_test_url() if postgres else None)
+    monkeypatch.setattr(settings, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(dialect, "POSTGRES", postgres)
+    monkeypatch.setattr(db, "USE_POSTGRES", postgres)
+    monkeypatch.setattr(migrations, "USE_POSTGRES", postgres)
+    db.supplier_ids.clear()
+    db.customer_ids.clear()
+    yield db
+    db.close_pool()
+
+
+@pytest.fixture
+def fresh_db(empty_db):
+    """An empty, fully migrated database."""
+    empty_db.init_db()
+    empty_db.load_inventory()
+    return empty_db
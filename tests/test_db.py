@@ -0,0 +1,142 @@
+import pytest
+
+from app import db
+from app.config import settings
+from app.dialect import execute_prepared, copy_rows, to_postgres
+from app.parsing import parse_size_to_mm
+
+T, W, L = parse_size_to_mm("2x4x12")
+
+
+def _one(sql, *args):
+    with db.db_conn() as conn:
+        c = conn.cursor()
+        c.execute(sql, args)
+        return c.fetchone()
+
+
+def test_to_postgres_rewrites_sqlite_sql():
+    assert to_postgres("SELECT 1 FROM meta WHERE key=?") == "SELECT 1 FROM meta WHERE key=%s"
+    assert (to_postgres("INSERT OR IGNORE INTO updates_processed(update_id) VALUES(?)")
+            == "INSERT INTO updates_processed(update_id) VALUES(%s) ON CONFLICT DO NOTHING")
+    assert (to_postgres("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)")
+            == "INSERT INTO meta(key,value) VALUES(%s,%s) ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value")
+    ddl = to_postgres("CREATE TABLE t(id INTEGER PRIMARY KEY AUTOINCREMENT, n INTEGER, v REAL, "
+                      "ts TEXT DEFAULT (datetime('now')))")
+    assert "BIGSERIAL PRIMARY KEY" in ddl and "n BIGINT" in ddl and "v DOUBLE PRECISION" in ddl
+    assert "datetime" not in ddl
+
+
+def test_every_writer_in_one_batch(fresh_db):
+    db = fresh_db
+    ops = [
+        ("STOCK_IN", {"supplier_name": "Kumar", "qty_logs": 50, "volume_cft": 500.0}),
+        ("STOCK_IN", {"supplier_name": "Arun", "qty_logs": 20, "volume_cft": 180.0}),
+        ("ORDER", {"customer_name": "Ravi", "qty": 100, "size_label": "2x4x12", "thickness_mm": T, "width_mm": W,
+                   "length_mm": L, "amount": 1000.0}),
+        ("ORDER", {"customer_name": "Mohan", "qty": 10, "size_label": "2x4x12", "thickness_mm": T, "width_mm": W,
+                   "length_mm": L}),
+        # batch 0 / order 0 mean "none given" and must land as NULL foreign keys
+        ("PRODUCTION", {"batch_id": 0, "thickness_mm": T, "width_mm": W, "length_mm": L, "qty": 30}),
+        ("DELIVERY", {"order_id": 0, "lorry_number": "KA01AB1234"}),
+        ("PAYMENT", {"order_id": 0, "amount": 50.0, "method": "cash"}),
+    ]
+    ids = db.apply_writes(ops)
+    assert all(isinstance(i, int) for i in ids), ids
+    b1, b2, o1, o2, out, dlv, pay = ids
+
+    # ids come back in row order
+    assert _one("SELECT s.name FROM stock_in b JOIN suppliers s USING(supplier_id) WHERE batch_id=?", b1) == ("Kumar",)
+    assert _one("SELECT s.name FROM stock_in b JOIN suppliers s USING(supplier_id) WHERE batch_id=?", b2) == ("Arun",)
+    assert _one("SELECT c.name FROM orders o JOIN customers c USING(customer_id) WHERE order_id=?", o2) == ("Mohan",)
+    assert _one("SELECT batch_id FROM stock_out WHERE id=?", out) == (None,)
+    assert _one("SELECT order_id FROM deliveries WHERE delivery_id=?", dlv) == (None,)
+    assert _one("SELECT order_id FROM payments WHERE payment_id=?", pay) == (None,)
+
+    # a second batch references the first one's rows
+    ids = db.apply_writes([
+        ("PRODUCTION", {"batch_id": b1, "thickness_mm": T, "width_mm": W, "length_mm": L, "qty": 200}),
+        ("DELIVERY", {"order_id": o1, "lorry_number": "KA01AB1234", "qty": 40}),
+        ("PAYMENT", {"order_id": o1, "amount": 400.0, "method": "upi"}),
+    ])
+    assert all(isinstance(i, int) for i in ids), ids
+    s = db.order_summary(o1)
+    assert (s["qty_delivered"], s["amount_paid"], s["status"]) == (40, 400.0, "pending")
+    assert db.report_totals()["logs_in"] == 70
+    assert db.verify_totals() == {} and db.verify_inventory() == {}
+
+
+def test_single_writers(fresh_db):
+    db = fresh_db
+    batch = db.insert_stockin({"supplier_name": "Kumar", "qty_logs": 5})
+    assert db.insert_production({"batch_id": batch, "thickness_mm": T, "width_mm": W, "length_mm": L, "qty": 12})
+    oid = db.insert_order({"customer_name": "Ravi", "qty": 12, "size_label": "2x4x12", "thickness_mm": T,
+                           "width_mm": W, "length_mm": L, "amount": 120.0})
+    db.insert_delivery({"order_id": oid, "lorry_number": "KA01AB1234"})
+    db.insert_payment({"order_id": oid, "amount": 120.0, "method": "cash"})
+    assert db.order_summary(oid)["status"] == "closed"
+    assert db.inventory_stock(T, W, L)["shipped"] == 12
+
+
+def test_upsert_named_returns_existing_id(fresh_db):
+    db = fresh_db
+    sid = db.upsert_supplier("Kumar")
+    db.supplier_ids.clear()
+    assert db.upsert_supplier("Kumar") == sid
+    assert db.upsert_supplier("Arun") != sid
+
+
+def test_claim_update_once(fresh_db):
+    db = fresh_db
+    assert db.claim_update(42) is True
+    assert db.claim_update(42) is False
+    db.release_update(42)
+    assert db.claim_update(42) is True
+    assert db.is_update_processed(42)
+
+
+def test_inbox_claim(fresh_db):
+    db = fresh_db
+    assert db.inbox_append(1, '{"update_id": 1}') is True
+    assert db.inbox_append(1, '{"update_id": 1}') is False
+    assert db.inbox_append_many([(1, "{}"), (2, '{"update_id": 2}'), (3, '{"update_id": 3}')]) == 2
+
+    rid, payload, attempts = db.inbox_claim("w1")
+    assert (payload, attempts) == ('{"update_id": 1}', 0)
+    assert db.inbox_claim("w2")[0] != rid
+    assert db.inbox_status()["processing"] == 2
+
+    db.inbox_retry(rid, 1, 0, "boom")
+    db.inbox_done(db.inbox_claim("w1")[0])
+    assert db.inbox_status()["pending"] == 1
+
+    # a worker that died mid-update: its row and claim come back
+    db.claim_update(3)
+    assert db.inbox_claim("w3")[1] == '{"update_id": 3}'
+    assert db.inbox_recover(float("inf")) == [2, 3]
+    assert db.claim_update(3) is True
+
+
+@pytest.mark.parametrize("n", [2, 5])
+def test_copy_rows(fresh_db, monkeypatch, n):
+    # 5 rows take the COPY path on Postgres, 2 the multi-row INSERT
+    monkeypatch.setattr(settings, "DB_COPY_MIN_ROWS", 3)
+    labels = ["tab\there", "new\nline", "back\\slash", None, "plain"][:n]
+    cols = ("key", "value")
+    with db.db_conn() as conn:
+        assert copy_rows(conn.cursor(), "meta", cols, [(f"k{i}", v) for i, v in enumerate(labels)]) == n
+    with db.db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT value FROM meta WHERE key LIKE 'k_' ORDER BY key")
+        assert [r[0] for r in c.fetchall()] == labels
+
+
+def test_execute_prepared(fresh_db):
+    with db.db_conn() as conn:
+        c = conn.cursor()
+        for key in ("a", "b"):
+            execute_prepared(c, "meta_put", "INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", (key, key * 2))
+        execute_prepared(c, "meta_put", "INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", ("a", "x"))
+        if db.USE_POSTGRES:
+            assert "meta_put" in conn.prepared
+    assert (db.meta_get("a"), db.meta_get("b")) == ("x", "bb")
@@ -0,0 +1,31 @@
+import asyncio
+import csv
+
+from app.config import settings
+from app.services.importer import Importer
+
+LEDGER = b"""supplier,logs,date
+Kumar,50,01/02/2021
+Arun,20,31/02/2021
+Ravi,10,2021-03-05
+"""
+
+
+async def _chunks(data: bytes):
+    yield data
+
+
+def test_unreadable_date_rejects_the_row(fresh_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "IMPORT_DIR", str(tmp_path / "imports"))
+    job = asyncio.run(Importer().run(_chunks(LEDGER), "csv", default_type="STOCK_IN"))
+
+    assert (job.accepted, job.rejected) == (2, 1)
+    with open(job.report_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[1][:2] == ["3", "unreadable date '31/02/2021'"]
+
+    # the accepted rows keep their ledger dates
+    with fresh_db.db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT date FROM stock_in ORDER BY batch_id")
+        assert [r[0][:10] for r in c.fetchall()] == ["2021-02-01", "2021-03-05"]
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from app.config import settings
+from app.services.inbox import Inbox
+
+
+def test_start_leaves_other_workers_fresh_claims(fresh_db, monkeypatch):
+    db = fresh_db
+    monkeypatch.setattr(settings, "INBOX_WORKERS", 1)
+    for update_id in (1, 2):
+        db.inbox_append(update_id, f'{{"update_id": {update_id}}}')
+        db.claim_update(update_id)
+    # update 1 is being handled right now by another process; update 2's worker died long ago
+    live, _payload, _n = db.inbox_claim("otherhost-123-0")
+    stale, _payload, _n = db.inbox_claim("otherhost-99-0")
+    with db.db_conn() as conn:
+        conn.cursor().execute("UPDATE inbox SET claimed_at=? WHERE id=?",
+                              (time.time() - settings.INBOX_VISIBILITY_TIMEOUT - 1, stale))
+
+    handled = []
+
+    async def handler(update, inbox_id=None, final_attempt=True):
+        handled.append(update["update_id"])
+
+    async def run():
+        inbox = Inbox()
+        await inbox.start(handler)
+        for _ in range(100):
+            if handled:
+                break
+            await asyncio.sleep(0.01)
+        await inbox.stop()
+        return inbox
+
+    inbox = asyncio.run(run())
+    assert handled == [2] and inbox.stats()["recovered"] == 1
+    with db.db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT status, worker FROM inbox WHERE id=?", (live,))
+        assert c.fetchone() == ("processing", "otherhost-123-0")
+    # its dedup claim is intact, so a redelivery cannot run the write a second time
+    assert db.claim_update(1) is False
@@ -0,0 +1,107 @@
+import asyncio
+from contextlib import contextmanager
+
+import pytest
+
+from app.config import settings
+from app.services import openai_parser
+from bench.stubs import StubServer, openai_stub
+
+
+def _echo(text: str) -> dict:
+    # each answer names the message it was for, so we can check it reached the right caller
+    return {"type": "ORDER", "customer_name": text, "qty": 1}
+
+
+@pytest.fixture(autouse=True)
+def llm(monkeypatch):
+    """Fresh client, dispatcher, breaker and counters, coalescing every parse of a test into one batch."""
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(settings, "LLM_COALESCE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_COALESCE_WINDOW_MS", 50.0)
+    monkeypatch.setattr(settings, "LLM_COALESCE_MAX", 16)
+    monkeypatch.setattr(settings, "LLM_TIMEOUT_SECONDS", 2.0)
+    monkeypatch.setattr(openai_parser, "_client", None)
+    monkeypatch.setattr(openai_parser, "_sem", None)
+    monkeypatch.setattr(openai_parser, "dispatcher", openai_parser.LLMDispatcher())
+    monkeypatch.setattr(openai_parser, "breaker", openai_parser.CircuitBreaker(5, 60.0))
+    monkeypatch.setattr(openai_parser, "_stats", dict.fromkeys(openai_parser._stats, 0))
+    return openai_parser
+
+
+@contextmanager
+def _server(monkeypatch, **kw):
+    stub = openai_stub(**kw)
+    with StubServer(stub) as server:
+        monkeypatch.setattr(settings, "OPENAI_BASE_URL", server.url + "/v1")
+        yield stub.state
+
+
+def _parse_all(texts: list[str]) -> list:
+    async def run():
+        try:
+            return await asyncio.gather(*(openai_parser.llm_parse(t) for t in texts))
+        finally:
+            await openai_parser.close_client()
+    return asyncio.run(run())
+
+
+TEXTS = ["Ravi wants 10 planks", "Mohan wants 5 beams", "Kumar wants 2 battens"]
+
+
+def test_batch_answer_maps_back_to_callers(llm, monkeypatch):
+    with _server(monkeypatch, responder=_echo) as stub:
+        results = _parse_all(TEXTS)
+    assert [r["customer_name"] for r in results] == TEXTS
+    assert stub.calls == 1
+    assert llm.dispatcher.stats()["batches"] == 1 and llm.dispatcher.stats()["max_batch"] == 3
+
+
+def test_wrong_length_answer_falls_back_per_message(llm, monkeypatch):
+    with _server(monkeypatch, responder=_echo, malformed_rate=1.0) as stub:
+        results = _parse_all(TEXTS)
+    assert [r["customer_name"] for r in results] == TEXTS
+    assert stub.calls == 1 + len(TEXTS)
+    assert llm.llm_stats()["batch_malformed"] == 1
+
+
+def test_non_object_entries_are_asked_again(llm, monkeypatch):
+    seen = set()
+
+    def responder(text):
+        # "twice" is unreadable every time, "once" only in the batch
+        first = text not in seen
+        seen.add(text)
+        if "twice" in text or ("once" in text and first):
+            return "no idea"
+        return _echo(text)
+
+    texts = ["fine 1", "once 2", "twice 3", "fine 4"]
+    with _server(monkeypatch, responder=responder) as stub:
+        results = _parse_all(texts)
+    assert results[0]["customer_name"] == "fine 1" and results[3]["customer_name"] == "fine 4"
+    assert results[1]["customer_name"] == "once 2"
+    assert results[2] is None
+    # the batch, then one call each for the two non-object entries
+    assert stub.calls == 3
+    assert llm.llm_stats()["bad_json"] == 1 and llm.llm_stats()["batch_malformed"] == 0
+
+
+def test_timeout_returns_none_for_every_caller(llm, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_TIMEOUT_SECONDS", 0.2)
+    with _server(monkeypatch, responder=_echo, latency_ms=1000):
+        results = _parse_all(TEXTS)
+    assert results == [None] * len(TEXTS)
+    assert llm.llm_stats()["timeouts"] == 1
+    assert llm.breaker.failures == 1
+
+
+def test_open_breaker_short_circuits_the_batch(llm, monkeypatch):
+    for _ in range(llm.breaker.threshold):
+        llm.breaker.record_failure()
+    assert llm.breaker.state == "open"
+    with _server(monkeypatch, responder=_echo) as stub:
+        results = _parse_all(TEXTS)
+    assert results == [None] * len(TEXTS)
+    assert stub.calls == 0
+    assert llm.llm_stats()["short_circuited"] == 1
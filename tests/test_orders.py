@@ -0,0 +1,68 @@
+from app.parsing import fast_parse, parse_size_to_mm
+
+SIZE = parse_size_to_mm("2x4x12")
+
+
+def _order(db, qty=100, amount=1000.0):
+    t, w, l = SIZE
+    return db.insert_order({"customer_name": "Ravi", "qty": qty, "size_label": "2x4x12", "thickness_mm": t,
+                            "width_mm": w, "length_mm": l, "amount": amount})
+
+
+def _stock(db):
+    row = db.inventory_stock(*SIZE)
+    return row["reserved"], row["shipped"]
+
+
+def test_partial_deliveries_accumulate(fresh_db):
+    db = fresh_db
+    oid = _order(db)
+    db.insert_delivery({"order_id": oid, "lorry_number": "KA01AB1234", "qty": 40})
+    s = db.order_summary(oid)
+    assert (s["qty_delivered"], s["status"]) == (40, "pending")
+    assert _stock(db) == (60, 40)
+    assert db.report_totals()["orders_pending"] == 1
+
+    db.insert_delivery({"order_id": oid, "lorry_number": "KA01AB1234", "qty": 35})
+    assert db.order_summary(oid)["qty_delivered"] == 75
+
+    # no qty: the rest of the order
+    db.insert_delivery({"order_id": oid, "lorry_number": "KA01AB1234"})
+    s = db.order_summary(oid)
+    assert (s["qty_delivered"], s["status"]) == (100, "delivered")
+    assert _stock(db) == (0, 100)
+    assert db.report_totals()["orders_pending"] == 0
+    assert db.verify_totals() == {} and db.verify_inventory() == {}
+
+
+def test_delivery_is_capped_at_ordered_qty(fresh_db):
+    db = fresh_db
+    oid = _order(db, qty=50)
+    db.insert_delivery({"order_id": oid, "lorry_number": "KA01AB1234", "qty": 30})
+    db.insert_delivery({"order_id": oid, "lorry_number": "KA01AB1234", "qty": 30})
+    s = db.order_summary(oid)
+    assert (s["qty_delivered"], s["status"]) == (50, "delivered")
+    assert _stock(db) == (0, 50)
+    assert db.verify_inventory() == {}
+
+
+def test_rebuild_matches_incremental_state(fresh_db):
+    db = fresh_db
+    a, b = _order(db, qty=100), _order(db, qty=20)
+    db.apply_writes([("DELIVERY", {"order_id": a, "lorry_number": "X1", "qty": 10}),
+                     ("DELIVERY", {"order_id": a, "lorry_number": "X2", "qty": 15}),
+                     ("DELIVERY", {"order_id": b, "lorry_number": "X3"})])
+    before = [db.order_summary(a), db.order_summary(b)]
+    assert before[0]["qty_delivered"] == 25 and before[1]["status"] == "delivered"
+    db.rebuild_order_state()
+    assert [db.order_summary(a), db.order_summary(b)] == before
+    assert db.verify_totals() == {} and db.verify_inventory() == {}
+
+
+def test_delivery_qty_is_parsed():
+    payload, _conf = fast_parse("deliver order=12 lorry=KA01AB1234 qty=40", 0.8)
+    assert (payload["type"], payload["qty"]) == ("DELIVERY", 40)
+    payload, _conf = fast_parse("dispatched 40 pcs of order 12 on lorry KA01AB1234", 0.8)
+    assert (payload["type"], payload["qty"]) == ("DELIVERY", 40)
+    payload, _conf = fast_parse("deliver order=12 lorry=KA01AB1234", 0.8)
+    assert payload["qty"] is None
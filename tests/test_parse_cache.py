@@ -0,0 +1,15 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.parse_cache import ParseCache
+
+
+def test_concurrent_stores_prune_once_per_hundred(fresh_db, monkeypatch):
+    cache = ParseCache(maxsize=0, ttl=3600)
+    prunes = []
+    monkeypatch.setattr(cache, "prune", lambda: prunes.append(1))
+    now = time.time()
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: cache._db_put(f"k{i}", {"type": "REPORT"}, now), range(200)))
+    assert len(prunes) == 2
+    assert cache._stores_since_prune == 0
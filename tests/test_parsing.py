@@ -0,0 +1,30 @@
+import pytest
+
+from app.parsing import fast_parse
+
+
+def _order(text):
+    payload, _confidence = fast_parse(text, 0.8)
+    assert payload and payload["type"] == "ORDER"
+    return payload
+
+
+@pytest.mark.parametrize("text, qty, amount", [
+    ("Ravi needs 50 2x4x10 at Rs 300 each", 50, 15000.0),
+    ("Ravi wants 40 pcs 2x4 @ 120", 40, 4800.0),
+    ("Ravi ordered 100 planks of 2x4 rate 25", 100, 2500.0),
+    ("Ravi wants 40 pcs 2x4 at 300/- per plank", 40, 12000.0),
+    ("Suresh ordered 20 planks of 1x4 Rs 50/pc", 20, 1000.0),
+    ("order customer=Ravi qty=10 size=2x4 rate=30", 10, 300.0),
+])
+def test_order_rate_is_multiplied_by_qty(text, qty, amount):
+    payload = _order(text)
+    assert (payload["qty"], payload["amount"]) == (qty, amount)
+
+
+def test_order_total_is_kept():
+    assert _order("Ravi ordered 100 planks of 2x4 for Rs 15000")["amount"] == 15000.0
+
+
+def test_ambiguous_per_unit_price_leaves_amount_unset():
+    assert _order("Ravi needs 10 2x4 priced per foot Rs 40")["amount"] is None
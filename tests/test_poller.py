@@ -0,0 +1,51 @@
+import asyncio
+
+from app.config import settings
+from app.services.poller import OFFSET_KEY, Poller
+
+
+def _handler(fail: dict):
+    """Fails update ``i`` the first ``fail[i]`` times it is seen; records (update_id, final_attempt) calls."""
+    calls = []
+
+    async def handle(update, final_attempt=True):
+        calls.append((update["update_id"], final_attempt))
+        if fail.get(update["update_id"], 0) > 0:
+            fail[update["update_id"]] -= 1
+            if not final_attempt:
+                raise RuntimeError("db down")
+    return handle, calls
+
+
+def _page(*ids):
+    return [{"update_id": i, "message": {"text": "hi"}} for i in ids]
+
+
+def test_offset_stops_at_first_failed_update(fresh_db):
+    p = Poller()
+    p._handler, calls = _handler({11: 1})
+
+    assert asyncio.run(p._handle(_page(12, 10, 11, 13))) is False
+    assert p.offset == 11
+    assert fresh_db.meta_get(OFFSET_KEY) == "11"
+    assert sorted(calls) == [(10, False), (11, False), (12, False), (13, False)]
+
+    # the refetch retries 11; the rest would be dropped by their claims in process_update
+    assert asyncio.run(p._handle(_page(11, 12, 13))) is True
+    assert p.offset == 14
+    assert p.stats()["failed"] == 1 and p._attempts == {}
+
+
+def test_update_is_given_up_after_max_attempts(fresh_db, monkeypatch):
+    monkeypatch.setattr(settings, "INBOX_MAX_ATTEMPTS", 3)
+    p = Poller()
+    p._handler, calls = _handler({5: 99})
+
+    for _ in range(2):
+        assert asyncio.run(p._handle(_page(5, 6))) is False
+        assert p.offset is None
+    # the final attempt tells the user instead of raising, and the offset moves on
+    assert asyncio.run(p._handle(_page(5, 6))) is True
+    assert p.offset == 7
+    assert [c for c in calls if c[0] == 5] == [(5, False), (5, False), (5, True)]
+    assert p.stats()["failed"] == 2 and p._attempts == {}
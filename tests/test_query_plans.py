@@ -0,0 +1,28 @@
+from app import migrations
+
+
+def test_report_and_lookup_queries_use_their_indexes(fresh_db):
+    assert migrations.check_plans() == {}
+
+
+def test_migrate_twice_is_a_no_op(fresh_db):
+    assert migrations.migrate() == []
+    assert migrations.current_version() == migrations.MIGRATIONS[-1][0]
+
+
+def test_every_step_is_recorded_under_its_version(fresh_db):
+    status = migrations.migration_status()
+    assert [(v, name) for v, name, _applied in status] == [(v, name) for v, name, _step in migrations.MIGRATIONS]
+    assert all(applied for _v, _name, applied in status)
+
+
+def test_migrate_stops_at_target(empty_db):
+    assert migrations.migrate(target=3) == [1, 2, 3]
+    assert migrations.current_version() == 3
+    assert migrations.migrate() == [v for v, _name, _step in migrations.MIGRATIONS if v > 3]
+
+
+def test_a_full_scan_is_reported(fresh_db, monkeypatch):
+    monkeypatch.setattr(migrations, "PLAN_CHECKS", [
+        ("lorry lookup", "SELECT delivery_id FROM deliveries WHERE lorry_number=?", ("KA01",), None)])
+    assert list(migrations.check_plans()) == ["lorry lookup"]
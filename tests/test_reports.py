@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from app.dates import BadDate, report_window
+from app.parsing import fast_parse
+from app.routers.telegram import build_report
+
+
+def test_custom_window_bounds():
+    assert report_window("custom", "01/04/2024", "30/04/2024") == (
+        "Custom", "2024-04-01 00:00:00", "2024-05-01 00:00:00")
+    assert report_window("custom", "2024-04-01", None) == ("Custom", "2024-04-01 00:00:00", None)
+
+
+@pytest.mark.parametrize("start, end, bad", [
+    ("32/13/2024", "30/04/2024", "32/13/2024"),
+    ("01/04/2024", "end of april", "end of april"),
+    (None, None, None),
+])
+def test_unreadable_custom_window_is_rejected(start, end, bad):
+    with pytest.raises(BadDate) as e:
+        report_window("custom", start, end)
+    assert e.value.value == bad
+
+
+def test_report_with_bad_date_asks_again_instead_of_all_time():
+    payload, _conf = fast_parse("report from=32/13/2024 to=30/04/2024", 0.8)
+    reply = asyncio.run(build_report(payload))
+    assert reply.startswith("Couldn't read the date '32/13/2024'")
+    assert "All-time" not in reply
+
+    reply = asyncio.run(build_report({"type": "REPORT", "kind": "custom"}))
+    assert reply.startswith("Couldn't read the dates")
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from app.config import settings
+from app.services import send_queue
+from app.services.send_queue import SendQueue
+
+
+def _fake_telegram(monkeypatch, delay: float = 0.0):
+    sent = []
+
+    async def tg_call(method, payload, **kw):
+        await asyncio.sleep(delay)
+        sent.append((payload["chat_id"], payload["text"]))
+        return httpx.Response(200, json={"ok": True, "result": {}})
+
+    monkeypatch.setattr(send_queue, "tg_call", tg_call)
+    return sent
+
+
+def _limits(monkeypatch, per_minute=60, global_rate=30.0):
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", per_minute)
+    monkeypatch.setattr(settings, "TELEGRAM_GLOBAL_RATE", global_rate)
+    monkeypatch.setattr(settings, "TELEGRAM_COALESCE", False)
+
+
+def test_drain_estimate_covers_the_busiest_chat(monkeypatch):
+    _limits(monkeypatch, per_minute=30, global_rate=10.0)
+    q = SendQueue()
+    for i in range(4):
+        q.enqueue(1, f"reply {i}")
+    q.enqueue(2, "other")
+    # chat 1 sends every 2s; the global bucket (5 sends at 10/s) is not the bottleneck
+    assert q.drain_estimate() == 8.0
+    monkeypatch.setattr(settings, "TELEGRAM_COALESCE", True)
+    assert q.drain_estimate() == 2.0
+
+
+def test_stop_delivers_backlog_within_drain_time(monkeypatch):
+    _limits(monkeypatch, per_minute=600)
+    sent = _fake_telegram(monkeypatch)
+
+    async def run():
+        q = SendQueue()
+        await q.start()
+        for i in range(3):
+            q.enqueue(7, f"reply {i}")
+        await q.stop(drain_timeout=5.0)
+        return q
+
+    q = asyncio.run(run())
+    assert sent == [(7, "reply 0"), (7, "reply 1"), (7, "reply 2")]
+    assert q.stats()["dropped"] == 0
+
+
+def test_stop_logs_every_dropped_reply(monkeypatch, caplog):
+    _limits(monkeypatch, per_minute=60)
+    monkeypatch.setattr(settings, "TELEGRAM_SEND_DRAIN_SECONDS", 0.3)
+    sent = _fake_telegram(monkeypatch, delay=0.1)
+
+    async def run():
+        q = SendQueue()
+        await q.start()
+        for chat in (11, 12):
+            for i in range(3):
+                q.enqueue(chat, f"chat {chat} reply {i}")
+        await q.stop()
+        return q
+
+    with caplog.at_level(logging.WARNING, logger="sawmill.send_queue"):
+        q = asyncio.run(run())
+
+    # one send per chat fits in the window; the per-chat bucket holds back the rest
+    assert sorted(sent) == [(11, "chat 11 reply 0"), (12, "chat 12 reply 0")]
+    dropped = [r for r in caplog.records if r.getMessage().startswith("Dropping reply to chat")]
+    assert sorted(r.args[0] for r in dropped) == [11, 11, 12, 12]
+    assert q.stats()["dropped"] == 4 and q.depth() == 0
+    assert any("needs ~3s to drain" in r.getMessage() for r in caplog.records)
+
+
+def test_stop_logs_cancelled_send(monkeypatch, caplog):
+    _limits(monkeypatch)
+    _fake_telegram(monkeypatch, delay=10.0)
+
+    async def run():
+        q = SendQueue()
+        await q.start()
+        q.enqueue(21, "slow", reply_to_message_id=5)
+        await asyncio.sleep(0.05)
+        await q.stop(drain_timeout=0.1)
+        return q
+
+    with caplog.at_level(logging.ERROR, logger="sawmill.send_queue"):
+        q = asyncio.run(run())
+    (rec,) = [r for r in caplog.records if r.getMessage().startswith("Dropping reply to chat")]
+    assert rec.args[:2] == (21, "send cancelled, may not have arrived")
+    assert q.stats()["dropped"] == 1 and q.stats()["inflight"] == 0
+
+
+def _rate_limited_telegram(monkeypatch, limited: int, retry_after: float):
+    """The first ``limited`` sends get a 429; returns the (monotonic time, chat_id, status) of every call."""
+    calls = []
+
+    async def tg_call(method, payload, **kw):
+        status = 429 if len(calls) < limited else 200
+        calls.append((time.monotonic(), payload["chat_id"], status))
+        if status == 429:
+            return httpx.Response(429, json={"ok": False, "error_code": 429,
+                                             "parameters": {"retry_after": retry_after}})
+        return httpx.Response(200, json={"ok": True, "result": {}})
+
+    monkeypatch.setattr(send_queue, "tg_call", tg_call)
+    return calls
+
+
+def test_429s_do_not_use_up_retries(monkeypatch):
+    _limits(monkeypatch, per_minute=0, global_rate=0)
+    monkeypatch.setattr(settings, "TELEGRAM_SEND_MAX_RETRIES", 2)
+    calls = _rate_limited_telegram(monkeypatch, limited=5, retry_after=0.01)
+
+    async def run():
+        q = SendQueue()
+        await q.start()
+        q.enqueue(31, "order confirmed")
+        await q.stop(drain_timeout=5.0)
+        return q
+
+    q = asyncio.run(run())
+    assert [status for _t, _chat, status in calls] == [429] * 5 + [200]
+    st = q.stats()
+    assert (st["sent"], st["dropped"], st["rate_limited"], st["retried"]) == (1, 0, 5, 0)
+
+
+def test_429_holds_back_every_chat(monkeypatch):
+    _limits(monkeypatch, per_minute=0, global_rate=0)
+    calls = _rate_limited_telegram(monkeypatch, limited=1, retry_after=0.3)
+
+    async def run():
+        q = SendQueue()
+        await q.start()
+        q.enqueue(41, "first")
+        await asyncio.sleep(0.05)
+        q.enqueue(42, "other chat")
+        await q.stop(drain_timeout=5.0)
+
+    asyncio.run(run())
+    (t429, chat, _status), *rest = calls
+    assert chat == 41 and len(rest) == 2
+    # the other chat waited out the flood limit too
+    assert all(t - t429 >= 0.29 for t, _c, _s in rest)